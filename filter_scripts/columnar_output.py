@@ -0,0 +1,241 @@
+'''
+    columnar_output.py
+        Compact, columnar storage for the contact tables built by get_sample.py
+
+        The old output was a ~40 column CSV where most of the columns were
+            blank and every row repeated the PDB ID, residue names and atom
+            names as text. Here only the populated columns are kept, strings
+            are stored as (dictionary encoded) categoricals, distances as
+            float32 and labels/atom numbers as small ints.
+
+        On disk this is Parquet (via pyarrow): every column is dictionary
+            encoded and compressed, row groups carry min/max statistics and
+            readers can pull just the columns (and PDB IDs) they care about:
+
+            >>> from columnar_output import read_contacts
+            >>> read_contacts('FADS.parquet', columns=['key_atom_name', 'distance'])
+'''
+
+import numpy as np
+import pandas as pd
+
+# column name -> pandas dtype of every populated column in the contact table.
+#  The order here is the order of the columns on disk.
+CONTACT_SCHEMA = [
+    ('PDB_ID',                  'category'),
+    ('key_atom_number',         'int32'),
+    ('key_atom_name',           'category'),
+    ('key_atom_residue',        'category'),
+    ('key_atom_chain_id',       'category'),
+    ('key_atom_residue_number', 'int32'),
+    ('target_atom_number',      'int32'),
+    ('target_atom_name',        'category'),
+    ('target_atom_residue',     'category'),
+    ('target_atom_chain_id',    'category'),
+    ('target_atom_residue_number', 'int32'),
+    ('distance',                'float32'),
+    ('interaction_label',       'int8'),
+    # position of the target in the flavin's frame, see isoalloxazine_frames.py
+    ('plane_offset',            'float32'),
+    ('height',                  'float32'),
+    ('elevation',               'float32'),
+    # redundant flavin sites, see site_redundancy.py (-1/NaN when not grouped)
+    ('site_group',              'int32'),
+    ('site_weight',             'float32'),
+    # NMR models / ensembles, see structure_ensemble.py (-1/NaN otherwise)
+    ('model',                   'int32'),
+    ('contact_occupancy',       'float32'),
+    # MD frame, see trajectory_contacts.py (-1 otherwise)
+    ('frame',                   'int32'),
+]
+
+# rows are sorted by these before writing so that the row group statistics
+#  are tight enough to skip whole groups when filtering by PDB ID; frame keeps
+#  the frames of a trajectory in order (it's -1 everywhere otherwise)
+SORT_COLUMNS = ['PDB_ID', 'frame', 'key_atom_number', 'distance']
+
+# ~64k rows per group keeps the statistics useful without too much overhead
+ROW_GROUP_SIZE = 1 << 16
+
+_ARROW_TYPES = {
+    'category': 'string',
+    'int8':     'int8',
+    'int32':    'int32',
+    'float32':  'float32',
+}
+
+
+def _schema_columns(schema):
+    return [name for name, _ in schema]
+
+
+def compact_contacts(frame, schema=CONTACT_SCHEMA):
+    """ Return a copy of :frame: restricted to the columns in :schema: and cast
+        to the compact dtypes listed there.
+
+        :frame: a pandas.DataFrame of contacts as built by get_sample.py
+        :schema: list of (column name, dtype) pairs
+        Missing columns are created empty; missing integer values (eg. an
+            unknown interaction label) are stored as -1.
+    """
+    out = pd.DataFrame(index=range(len(frame)))
+    for name, dtype in schema:
+        if name in frame:
+            values = frame[name].values
+        else:
+            values = np.full(len(frame), np.nan)
+        if dtype == 'category':
+            out[name] = pd.Categorical([None if pd.isnull(v) else str(v) for v in values])
+        elif dtype.startswith('int'):
+            out[name] = pd.Series(values).fillna(-1).values.astype(dtype)
+        else:
+            out[name] = np.asarray(values, dtype=dtype)
+    return out
+
+
+def _arrow_schema(schema):
+    import pyarrow as pa
+    return pa.schema([pa.field(name, getattr(pa, _ARROW_TYPES[dtype])())
+                      for name, dtype in schema])
+
+
+def _to_arrow(frame, schema):
+    """ converts a compacted frame to a pyarrow.Table with a fixed schema
+
+        categoricals go over as plain strings; parquet dictionary encodes them
+        on disk regardless and it keeps the schema identical across row groups
+    """
+    import pyarrow as pa
+    arrays = []
+    for name, dtype in schema:
+        values = frame[name]
+        if dtype == 'category':
+            values = [None if pd.isnull(v) else v for v in values.astype(object)]
+        else:
+            values = values.values
+        arrays.append(pa.array(values, type=getattr(pa, _ARROW_TYPES[dtype])()))
+    return pa.Table.from_arrays(arrays, schema=_arrow_schema(schema))
+
+
+class ContactWriter():
+    '''
+        Streams contact tables into a single Parquet file.
+
+        get_sample.py produces one (small) table per protein; these are
+            buffered and flushed as row groups of roughly :row_group_size:
+            rows so memory stays bounded no matter how many proteins are
+            scanned.
+
+        Usage:
+            with ContactWriter('out.parquet') as writer:
+                for contacts in ...:
+                    writer.write(contacts)
+    '''
+
+    def __init__(self, path, schema=CONTACT_SCHEMA, row_group_size=ROW_GROUP_SIZE,
+                 compression='snappy'):
+        import pyarrow.parquet as pq
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._buffer = []
+        self._buffered = 0
+        self._writer = pq.ParquetWriter(path, _arrow_schema(schema),
+                                        compression=compression, use_dictionary=True)
+
+    def write(self, frame):
+        """ buffers :frame: (any contact table) and flushes full row groups """
+        if not len(frame):
+            return
+        self._buffer.append(compact_contacts(frame, self.schema))
+        self._buffered += len(frame)
+        if self._buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        frame = pd.concat(self._buffer, ignore_index=True)
+        sort_by = [c for c in SORT_COLUMNS if c in frame]
+        if sort_by:
+            frame = frame.sort_values(by=sort_by)
+        self._writer.write_table(_to_arrow(frame, self.schema),
+                                 row_group_size=self.row_group_size)
+        self.rows_written += len(frame)
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_contacts(frame, path, schema=CONTACT_SCHEMA, row_group_size=ROW_GROUP_SIZE):
+    """ Writes a whole contact table to :path: in one go; see ContactWriter """
+    with ContactWriter(path, schema=schema, row_group_size=row_group_size) as writer:
+        writer.write(frame)
+
+
+def _row_group_may_contain(metadata, group, column_index, values):
+    """ uses a row group's min/max statistics to decide if any of :values:,
+        in any mix of upper and lower case, can be inside of it. Errs on the
+        side of reading the group.
+    """
+    stats = metadata.row_group(group).column(column_index).statistics
+    if stats is None or not stats.has_min_max:
+        return True
+    low, high = stats.min, stats.max
+    if isinstance(low, bytes):
+        low, high = low.decode('utf-8'), high.decode('utf-8')
+    # every case variant of v sorts between v.upper() and v.lower()
+    return any(v.upper() <= high and low <= v.lower() for v in values)
+
+
+def read_contacts(path, columns=None, pdb_ids=None, schema=CONTACT_SCHEMA):
+    """ Reads a contact table written by ContactWriter/write_contacts.
+
+        :columns: *Optional* list of columns to load; the rest are never read
+            off of disk.
+        :pdb_ids: *Optional* iterable of PDB IDs (case insensitive). Row
+            groups whose statistics show they can't contain any of these are
+            skipped entirely and the remaining rows are filtered down to them.
+        Returns a pandas.DataFrame with the compact dtypes from :schema:
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(path)
+    names = [parquet.schema.column(i).name for i in range(parquet.metadata.num_columns)]
+    # files written before a column was added to the schema just don't have it
+    wanted = list(columns) if columns is not None else \
+        [c for c in _schema_columns(schema) if c in names]
+    read = list(wanted)
+    groups = list(range(parquet.num_row_groups))
+    if pdb_ids is not None:
+        pdb_ids = set(str(p).lower() for p in pdb_ids)
+        if 'PDB_ID' not in read:
+            read.append('PDB_ID')
+        index = names.index('PDB_ID')
+        groups = [g for g in groups
+                  if _row_group_may_contain(parquet.metadata, g, index, pdb_ids)]
+
+    tables = [parquet.read_row_group(g, columns=read) for g in groups]
+    if tables:
+        frame = pa.concat_tables(tables).to_pandas()
+    else:
+        frame = pd.DataFrame(columns=read)
+    if pdb_ids is not None:
+        frame = frame[frame['PDB_ID'].astype(str).str.lower().isin(pdb_ids).values] \
+            .reset_index(drop=True)
+
+    dtypes = dict(schema)
+    for name in wanted:
+        if name in dtypes:
+            frame[name] = frame[name].astype(dtypes[name])
+    return frame[wanted]
@@ -0,0 +1,288 @@
+'''
+    contact_graphs.py
+        Flavin -> residue contact graphs, stored so that training code can
+            memory map them instead of rebuilding them from the long form
+            contact table every time.
+
+        Every flavin instance is a bipartite graph in CSR form:
+            rows:  the isoalloxazine key atoms (KEY_ATOMS, always the same
+                   rows in the same order)
+            nodes: the residues the flavin is in contact with
+            edges: key atom -> residue, the closest contact between the two,
+                   with its distance, interaction label and chemical code
+        and every residue node has a type (index into RESIDUE_TYPES), its
+            residue number, how many contacts it makes and its closest
+            distance.
+
+        A batch of graphs is a directory of .npy files, every array being
+            all graphs concatenated:
+            indptr.npy          (n_graphs, len(KEY_ATOMS) + 1) per graph CSR row pointers
+            indices.npy         (n_edges,) residue node of every edge, per graph
+            distance.npy, label.npy, chemical_code.npy
+                                (n_edges,) edge attributes
+            residue_type.npy, residue_number.npy, node_contacts.npy, node_distance.npy
+                                (n_nodes,) residue node features
+            edge_offsets.npy, node_offsets.npy
+                                (n_graphs + 1,) where each graph starts
+            graphs.csv          PDB_ID, chain_id, residue_number and
+                                residue_name of the flavin of every graph,
+                                and its model for ensembles
+            meta.json           key atoms and residue types the indices refer to
+
+        Contacts of ensembles (see structure_ensemble.py) have a model column;
+            every model of a flavin is then a graph of its own.
+
+        Building one from the output of get_sample.py:
+            python contact_graphs.py FADS.parquet FADS.graphs
+
+        Loading mini-batches:
+            batch = ContactGraphBatch('FADS.graphs')
+            adjacency, nodes = batch.minibatch(0, 64)
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import KEY_ATOMS
+from isoalloxazine_frames import ATOM_ALIASES
+from radial_distribution import chemical_code_array, load_chemical_codes
+
+# residue node types; anything else (waters, ions, ligands, ...) is 'other'
+RESIDUE_TYPES = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+                 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL',
+                 'HOH', 'other']
+
+GRAPH_COLUMNS = ['PDB_ID', 'chain_id', 'residue_number', 'residue_name']
+# added to GRAPH_COLUMNS (and the instance key) when the contacts have it
+MODEL_COLUMN = 'model'
+
+EDGE_ARRAYS = [('indices', 'int32'), ('distance', 'float32'), ('label', 'int8'),
+               ('chemical_code', 'int16')]
+NODE_ARRAYS = [('residue_type', 'int16'), ('residue_number', 'int32'),
+               ('node_contacts', 'int16'), ('node_distance', 'float32')]
+
+# identifies a flavin instance / a target residue in a contact table
+_INSTANCE = ['PDB_ID', 'key_atom_chain_id', 'key_atom_residue_number', 'key_atom_residue']
+_TARGET = ['target_atom_chain_id', 'target_atom_residue_number', 'target_atom_residue']
+
+
+def _keys(frame, columns):
+    """ one string key per row of :frame: out of :columns: """
+    key = frame[columns[0]].astype(str).values.astype(object)
+    for column in columns[1:]:
+        key = key + ':' + frame[column].astype(str).values.astype(object)
+    return key
+
+
+def _residue_types(names):
+    index = pd.Series(range(len(RESIDUE_TYPES)), index=RESIDUE_TYPES)
+    return pd.Series(names).astype(str).map(index).fillna(RESIDUE_TYPES.index('other')) \
+        .values.astype(np.int16)
+
+
+def build_graph(contacts, codes):
+    """ The contact graph of one flavin instance.
+
+        :contacts: labelled contacts of that one flavin (see find_contacts,
+            label_contacts)
+        :codes: chemical codes as returned by load_chemical_codes
+        Returns a dict with 'indptr' and every EDGE_ARRAYS and NODE_ARRAYS
+            array of the graph
+    """
+    names = contacts['key_atom_name'].astype(str).replace(ATOM_ALIASES)
+    row = pd.Series(range(len(KEY_ATOMS)), index=KEY_ATOMS).reindex(names.values).values
+    known = ~np.isnan(row)
+    contacts = contacts[known]
+    row = row[known].astype(np.int64)
+
+    # residue nodes, numbered in order of appearance
+    node, uniques = pd.factorize(_keys(contacts, _TARGET))
+    distance = contacts['distance'].values.astype(np.float64)
+
+    # closest contact of every (row, node) pair becomes its edge
+    order = np.lexsort((distance, node, row))
+    pair = row[order] * max(len(uniques), 1) + node[order]
+    first = order[np.r_[True, pair[1:] != pair[:-1]]] if len(order) else order
+    edges = first[np.lexsort((node[first], row[first]))]
+
+    label = contacts['interaction_label'].values if 'interaction_label' in contacts \
+        else np.full(len(contacts), -1)
+    code = chemical_code_array(contacts['target_atom_name'].astype(str).values,
+                               contacts['target_atom_residue'].astype(str).values, codes)
+    graph = {
+        'indptr': np.concatenate([[0], np.cumsum(np.bincount(row[edges], minlength=len(KEY_ATOMS)))]),
+        'indices': node[edges],
+        'distance': distance[edges],
+        'label': label[edges],
+        'chemical_code': code[edges],
+    }
+
+    first_contact = pd.Series(range(len(node))).groupby(node).first().values \
+        if len(node) else np.array([], dtype=np.int64)
+    graph['residue_type'] = _residue_types(contacts['target_atom_residue'].values[first_contact])
+    graph['residue_number'] = contacts['target_atom_residue_number'].values[first_contact] \
+        if 'target_atom_residue_number' in contacts else np.full(len(uniques), -1)
+    graph['node_contacts'] = np.bincount(node, minlength=len(uniques))
+    graph['node_distance'] = pd.Series(distance).groupby(node).min().values \
+        if len(node) else np.array([])
+    return graph
+
+
+class GraphBatchWriter():
+    '''
+        Collects the graphs of many flavin instances and writes them as one
+            batch directory (see the module docstring) on close.
+
+        Usage:
+            with GraphBatchWriter('FADS.graphs') as writer:
+                for contacts in ...:     # labelled contacts with a PDB_ID column
+                    writer.write(contacts)
+    '''
+
+    def __init__(self, directory, codes=None):
+        self.directory = directory
+        self.codes = codes if codes is not None else load_chemical_codes()
+        self._graphs = []
+        self._instances = []
+        self._models = False
+
+    def write(self, contacts):
+        """ adds a graph for every flavin instance (and model, for ensembles)
+            in :contacts:
+        """
+        if not len(contacts):
+            return
+        columns = list(_INSTANCE)
+        models = MODEL_COLUMN in contacts
+        if models:
+            columns.append(MODEL_COLUMN)
+            self._models = True
+        instance, uniques = pd.factorize(_keys(contacts, columns))
+        first = pd.Series(range(len(instance))).groupby(instance).first().values
+        for i in range(len(uniques)):
+            row = [contacts[c].values[first[i]] for c in _INSTANCE]
+            row.append(contacts[MODEL_COLUMN].values[first[i]] if models else -1)
+            self._instances.append(row)
+            self._graphs.append(build_graph(contacts[instance == i], self.codes))
+
+    def __len__(self):
+        return len(self._graphs)
+
+    def close(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        graphs = self._graphs
+        edge_counts = [len(g['indices']) for g in graphs]
+        node_counts = [len(g['residue_type']) for g in graphs]
+
+        def save(name, arrays, dtype):
+            values = np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+            np.save(os.path.join(self.directory, name + '.npy'), values)
+
+        indptr = np.array([g['indptr'] for g in graphs], dtype=np.int32) \
+            .reshape(len(graphs), len(KEY_ATOMS) + 1)
+        np.save(os.path.join(self.directory, 'indptr.npy'), indptr)
+        for name, dtype in EDGE_ARRAYS + NODE_ARRAYS:
+            save(name, [g[name] for g in graphs], dtype)
+        np.save(os.path.join(self.directory, 'edge_offsets.npy'),
+                np.concatenate([[0], np.cumsum(edge_counts)]).astype(np.int64))
+        np.save(os.path.join(self.directory, 'node_offsets.npy'),
+                np.concatenate([[0], np.cumsum(node_counts)]).astype(np.int64))
+        graphs_csv = pd.DataFrame(self._instances, columns=GRAPH_COLUMNS + [MODEL_COLUMN])
+        if not self._models:
+            graphs_csv = graphs_csv[GRAPH_COLUMNS]
+        graphs_csv.to_csv(os.path.join(self.directory, 'graphs.csv'), index=False)
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump({'key_atoms': KEY_ATOMS, 'residue_types': RESIDUE_TYPES}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ContactGraphBatch():
+    '''
+        Memory mapped access to a batch directory written by GraphBatchWriter.
+            Nothing is parsed or copied until it's sliced.
+
+        :graphs: pandas.DataFrame of GRAPH_COLUMNS (and model), one row per
+            graph
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.graphs = pd.read_csv(os.path.join(directory, 'graphs.csv'))
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['key_atoms'] != KEY_ATOMS:
+            raise ValueError(directory + " was built over different key atoms")
+        self.residue_types = meta['residue_types']
+        self.arrays = {}
+        for name in ['indptr', 'edge_offsets', 'node_offsets'] + \
+                [name for name, _ in EDGE_ARRAYS + NODE_ARRAYS]:
+            self.arrays[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.graphs)
+
+    def graph(self, i):
+        """ the arrays of graph :i: (views into the memory map) """
+        e0, e1 = self.arrays['edge_offsets'][i:i + 2]
+        n0, n1 = self.arrays['node_offsets'][i:i + 2]
+        graph = {'indptr': self.arrays['indptr'][i]}
+        for name, _ in EDGE_ARRAYS:
+            graph[name] = self.arrays[name][e0:e1]
+        for name, _ in NODE_ARRAYS:
+            graph[name] = self.arrays[name][n0:n1]
+        return graph
+
+    def csr(self, i, attribute='distance'):
+        """ graph :i: as a scipy.sparse.csr_matrix of :attribute: """
+        from scipy.sparse import csr_matrix
+        graph = self.graph(i)
+        return csr_matrix((graph[attribute], graph['indices'], graph['indptr']),
+                          shape=(len(KEY_ATOMS), len(graph['residue_type'])))
+
+    def minibatch(self, start, stop, attribute='distance'):
+        """ graphs :start: to :stop: as one block diagonal graph
+
+            Returns (adjacency, nodes): a scipy.sparse.csr_matrix of
+                :attribute: with len(KEY_ATOMS) rows per graph and the residue
+                nodes of all graphs as columns, and a dict of every
+                NODE_ARRAYS array of those nodes (plus 'graph', the graph
+                each node belongs to)
+        """
+        from scipy.sparse import csr_matrix
+        edge_offsets = np.asarray(self.arrays['edge_offsets'][start:stop + 1])
+        node_offsets = np.asarray(self.arrays['node_offsets'][start:stop + 1])
+        e0, e1 = edge_offsets[0], edge_offsets[-1]
+        n0, n1 = node_offsets[0], node_offsets[-1]
+
+        # per graph row pointers + where the graph's edges start in the batch
+        indptr = np.asarray(self.arrays['indptr'][start:stop], dtype=np.int64) + \
+            (edge_offsets[:-1] - e0)[:, None]
+        indptr = np.concatenate([indptr[:, :-1].ravel(), [e1 - e0]])
+        # node indices are per graph; shift them to where the graph's nodes start
+        edge_graph = np.repeat(np.arange(stop - start), np.diff(edge_offsets))
+        indices = np.asarray(self.arrays['indices'][e0:e1], dtype=np.int64) + \
+            (node_offsets[:-1] - n0)[edge_graph]
+        adjacency = csr_matrix((np.asarray(self.arrays[attribute][e0:e1]), indices, indptr),
+                               shape=((stop - start) * len(KEY_ATOMS), n1 - n0))
+        nodes = dict((name, np.asarray(self.arrays[name][n0:n1])) for name, _ in NODE_ARRAYS)
+        nodes['graph'] = np.repeat(np.arange(start, stop), np.diff(node_offsets))
+        return adjacency, nodes
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import sys
+    from columnar_output import read_contacts
+    if len(sys.argv) != 3:
+        raise ValueError("Usage: python contact_graphs.py <contacts.parquet> <graph directory>")
+    with GraphBatchWriter(sys.argv[2]) as writer:
+        writer.write(read_contacts(sys.argv[1]))
+    print("Wrote", len(writer), "graphs to", sys.argv[2])
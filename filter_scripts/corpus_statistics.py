@@ -0,0 +1,309 @@
+'''
+    corpus_statistics.py
+        Online, mergeable statistics over the contacts found by get_sample.py
+
+        Instead of loading the whole output back into pandas after a run, the
+            aggregators here are updated with every structure's contacts as
+            they're found and saved next to the output. Every aggregator can be
+            merged with another one of the same kind, and merging is exact:
+            statistics of shards run separately (or by separate workers) and
+            merged afterwards are the same as those of one big run.
+
+            Counts:          exact counts of hashable keys
+            RunningMoments:  count, mean, variance, min and max
+            FixedHistogram:  counts over fixed bin edges (+ under/overflow)
+            QuantileSketch:  quantiles with bounded relative error
+
+        Merging shards from the command line:
+            python corpus_statistics.py merged.stats.pkl shard_1.stats.pkl shard_2.stats.pkl ...
+'''
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+class Counts():
+    ''' exact counts of hashable keys (eg. (key atom, interaction label)) '''
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def update(self, keys):
+        self.counts.update(keys)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    def to_frame(self, names):
+        """ counts as a pandas.DataFrame with a column per entry of :names:
+            (the parts of the keys) and a "count" column, most common first
+        """
+        rows = []
+        for key, count in self.counts.most_common():
+            key = key if isinstance(key, tuple) else (key,)
+            rows.append(list(key) + [count])
+        return pd.DataFrame(rows, columns=list(names) + ['count'])
+
+
+class RunningMoments():
+    ''' count, mean, variance, min and max; merged with Chan et al.'s pairwise
+        update so no precision is lost by merging shards
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _combine(self, count, mean, m2, low, high):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        mean = values.mean()
+        self._combine(len(values), mean, ((values - mean) ** 2).sum(),
+                      values.min(), values.max())
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """ sample variance (np.nan with less than two values) """
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class FixedHistogram():
+    ''' counts of values over fixed bin :edges:; values outside of the edges
+        are kept in an underflow and an overflow bin
+    '''
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        # bin i holds edges[i - 1] <= v < edges[i]; 0 and -1 are under/overflow
+        bins = np.searchsorted(self.edges, values, side='right')
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("can't merge histograms with different bin edges")
+        self.counts += other.counts
+        return self
+
+    def to_frame(self):
+        lower = np.concatenate([[-np.inf], self.edges])
+        upper = np.concatenate([self.edges, [np.inf]])
+        return pd.DataFrame({'lower': lower, 'upper': upper, 'count': self.counts},
+                            columns=['lower', 'upper', 'count'])
+
+
+class QuantileSketch():
+    ''' A log-bucketed quantile sketch (DDSketch): every quantile it returns
+        is within :relative_accuracy: of the true value, it takes constant
+        memory for a fixed range of values and, because buckets are fixed,
+        merging two sketches is just adding their bucket counts.
+
+        Only meant for positive values like distances; values <= 0 are kept
+        in a single zero bucket.
+    '''
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            index = np.ceil(np.log(positive) / np.log(self.gamma)).astype(np.int64)
+            keys, counts = np.unique(index, return_counts=True)
+            self.buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def merge(self, other):
+        if self.gamma != other.gamma:
+            raise ValueError("can't merge sketches with different accuracies")
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """ approximate :q:-th quantile (0 <= q <= 1), np.nan if empty """
+        if not self.count:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+# distances of interest are all well under this
+_DISTANCE_EDGES = np.round(np.arange(0, 6.0001, 0.05), 2)
+_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class CorpusStatistics():
+    '''
+        All of the corpus wide summaries of a run, updated per structure (or
+            per pocket / site of one).
+
+        :pdb_ids: set of the PDB IDs seen; a structure analyzed in parts is
+            still one structure
+
+        Usage:
+            stats = CorpusStatistics()
+            for each structure:
+                stats.update(contacts)   # labelled contacts with a PDB_ID column
+            stats.save('run.stats.pkl')
+            stats.tables()['key_atom_label']
+
+            # shards
+            total = CorpusStatistics.combine(['a.stats.pkl', 'b.stats.pkl'])
+    '''
+
+    def __init__(self):
+        self.pdb_ids = set()
+        self.key_atom_label = Counts()      # (key atom, interaction label)
+        self.target_residue = Counts()      # target residue name
+        self.chain = Counts()               # (PDB ID, key atom chain)
+        self.distance = RunningMoments()
+        self.distance_histogram = FixedHistogram(_DISTANCE_EDGES)
+        self.distance_quantiles = QuantileSketch()
+        self.key_atom_distance = {}         # key atom -> RunningMoments
+        self.key_atom_quantiles = {}        # key atom -> QuantileSketch
+
+    @property
+    def structures(self):
+        return len(self.pdb_ids)
+
+    def update(self, contacts, pdb_id=None):
+        """ adds the labelled contact table of (part of) a structure; every
+            PDB_ID in :contacts:, and :pdb_id: (for tables without contacts),
+            counts as a structure
+        """
+        if pdb_id is not None:
+            self.pdb_ids.add(pdb_id)
+        if not len(contacts):
+            return
+        self.key_atom_label.update(zip(contacts['key_atom_name'].values,
+                                       contacts['interaction_label'].values.tolist()))
+        self.pdb_ids.update(pd.unique(contacts['PDB_ID'].values).tolist())
+        self.target_residue.update(contacts['target_atom_residue'].values)
+        self.chain.update(zip(contacts['PDB_ID'].values, contacts['key_atom_chain_id'].values))
+
+        distances = contacts['distance'].values
+        self.distance.update(distances)
+        self.distance_histogram.update(distances)
+        self.distance_quantiles.update(distances)
+        for key, group in contacts.groupby('key_atom_name', sort=False):
+            values = group['distance'].values
+            self.key_atom_distance.setdefault(key, RunningMoments()).update(values)
+            self.key_atom_quantiles.setdefault(key, QuantileSketch()).update(values)
+
+    def merge(self, other):
+        """ adds :other:'s statistics into this one, returns self """
+        self.pdb_ids |= other.pdb_ids
+        for name in ['key_atom_label', 'target_residue', 'chain', 'distance',
+                     'distance_histogram', 'distance_quantiles']:
+            getattr(self, name).merge(getattr(other, name))
+        for key, moments in other.key_atom_distance.items():
+            self.key_atom_distance.setdefault(key, RunningMoments()).merge(moments)
+        for key, sketch in other.key_atom_quantiles.items():
+            self.key_atom_quantiles.setdefault(key, QuantileSketch()).merge(sketch)
+        return self
+
+    def save(self, path):
+        pd.to_pickle(self, path)
+
+    @staticmethod
+    def load(path):
+        return pd.read_pickle(path)
+
+    @staticmethod
+    def combine(paths):
+        """ merges the saved statistics at every path in :paths: """
+        total = CorpusStatistics()
+        for path in paths:
+            total.merge(CorpusStatistics.load(path))
+        return total
+
+    def _distance_row(self, moments, sketch):
+        row = [moments.count, moments.mean, moments.std, moments.min, moments.max]
+        return row + [sketch.quantile(q) for q in _QUANTILES]
+
+    def tables(self):
+        """ summary tables for the whole corpus as a dict of pandas.DataFrames:
+
+            key_atom_label:     contacts per (key atom, interaction label)
+            target_residue:     contacts per target residue type
+            chain:              contacts per (PDB ID, chain)
+            distance:           distance summaries per key atom and overall
+            distance_histogram: overall distance histogram
+        """
+        columns = ['key_atom_name', 'count', 'mean', 'std', 'min', 'max'] + \
+            ['q%02d' % int(q * 100) for q in _QUANTILES]
+        rows = [[key] + self._distance_row(self.key_atom_distance[key], self.key_atom_quantiles[key])
+                for key in sorted(self.key_atom_distance)]
+        rows.append(['all'] + self._distance_row(self.distance, self.distance_quantiles))
+        return {
+            'key_atom_label': self.key_atom_label.to_frame(['key_atom_name', 'interaction_label']),
+            'target_residue': self.target_residue.to_frame(['target_atom_residue']),
+            'chain': self.chain.to_frame(['PDB_ID', 'key_atom_chain_id']),
+            'distance': pd.DataFrame(rows, columns=columns),
+            'distance_histogram': self.distance_histogram.to_frame(),
+        }
+
+    def write_tables(self, prefix):
+        """ writes every summary table to <prefix>.<table name>.csv """
+        for name, table in self.tables().items():
+            table.to_csv(prefix + '.' + name + '.csv', index=False)
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import sys
+    # pickle the merged result as corpus_statistics.CorpusStatistics, not __main__'s
+    from corpus_statistics import CorpusStatistics
+    if len(sys.argv) < 3:
+        raise ValueError("Usage: python corpus_statistics.py <merged.stats.pkl> <shard.stats.pkl> ...")
+    merged = CorpusStatistics.combine(sys.argv[2:])
+    merged.save(sys.argv[1])
+    print("merged", merged.structures, "structures and", merged.distance.count, "contacts")
+    print(merged.tables()['key_atom_label'].head(20))
@@ -0,0 +1,242 @@
+'''
+    flavin_contacts.py
+        The per structure stages of get_sample.py, pulled out of the script so
+            they can be reused (and cached) on their own:
+
+            1. fetch_structure: download a PDB entry as one ATOM + HETATM frame
+            2. find_contacts: the geometry stage, finds every atom sitting at
+                vdW distance (+/- tolerance) of an isoalloxazine key atom
+            3. label_contacts: the labelling stage, tags every contact with the
+                interaction label of the target atom
+
+        find_contacts does the same thing as the old per atom
+            _make_distance_comparator closure (same bounding box, same vdW
+            window, same same-residue exclusion) but for all key atoms of a
+            structure at once with numpy instead of a DataFrame.apply per atom.
+'''
+
+import numpy as np
+import pandas as pd
+from biopandas import pdb
+from physical_constants import vdW_radii, vdW_bounds
+
+# anecdotal names of key atoms in the isoalloxazine to lookup
+KEY_ATOMS = ['N1', 'C2', 'O2', 'N3', 'C4', 'O4', 'C4X', 'N5', 'C5X', 'C6', 'C7',
+             'C7M', 'C8', 'C9', 'C9A', 'N10', 'C10']
+# PDB names for flavins
+FLAVINS = ['FMN', 'FAD']
+# default +/- window (angstroms) around the vdW contact distance
+TOLERANCE = 0.2
+
+LABEL_TABLE = './interaction_labels/interaction_dictionary.pkl'
+
+# upper bound on the number of (key atom, atom) pairs looked at in one go; keeps
+#  the temporaries of find_contacts to a few hundred MB on large structures
+_PAIR_CHUNK = 1 << 22
+
+# columns of the structure that are copied over into the contact tables
+_ATOM_COLUMNS = [('atom_number', 'number'), ('atom_name', 'name'),
+                 ('residue_name', 'residue'), ('chain_id', 'chain_id'),
+                 ('residue_number', 'residue_number')]
+
+
+def fetch_frames(pdb_id, attempts=3):
+    """ Download :pdb_id: from the PDB and return its biopandas record frames
+        (the .df dict of a PandasPDB).
+
+        Fetching can fail on occassion so it is attempted :attempts: times;
+        returns None if it never succeeds.
+    """
+    for _ in range(attempts):
+        try:
+            return pdb.PandasPDB().fetch_pdb(pdb_id).df
+        # not finishing this try will cause compile errors on some implementations
+        except:
+            continue
+    return None
+
+
+def fetch_structure(pdb_id, attempts=3):
+    """ Download :pdb_id: from the PDB (see fetch_frames) and return its ATOM
+        and HETATM records as a single pandas.DataFrame, since we make no
+        distinction between atoms and heteroatoms. Returns None if it never
+        succeeds.
+    """
+    pro = fetch_frames(pdb_id, attempts)
+    if pro is None:
+        return None
+    return pd.concat([pro['ATOM'], pro['HETATM']], ignore_index=True)
+
+
+def vdW_radius_array(atom_names, residue_names, ligands=FLAVINS, radii=vdW_radii):
+    """ vectorized physical_constants.get_vdW_radius
+
+        :atom_names: sequence of atom names
+        :residue_names: sequence of residue names, same length as :atom_names:
+        Atoms in :ligands: use the isoalloxazine radii. Atoms that can't be
+            found get np.inf (which can never be in contact with anything)
+            rather than being logged one by one.
+    """
+    ring = radii['Isoalloxazine']
+    flat = dict((k, v) for k, v in radii.items() if k != 'Isoalloxazine')
+    ligands = set(ligands)
+    lookup = {}
+    out = np.empty(len(atom_names), dtype=np.float64)
+    for i, (name, residue) in enumerate(zip(atom_names, residue_names)):
+        pair = (name, residue in ligands)
+        if pair not in lookup:
+            if pair[1]:
+                lookup[pair] = ring.get(name, np.inf)
+            else:
+                lookup[pair] = flat.get(name, ring.get(name, np.inf))
+        out[i] = lookup[pair]
+    return out
+
+
+def select_key_atoms(structure, key_atoms=KEY_ATOMS, ligands=FLAVINS, instance=None):
+    """ Returns the positional indices (into :structure:) of every key atom
+        that belongs to a ligand, ordered by :key_atoms: and then by the order
+        of the atoms in the structure.
+
+        :instance: *Optional* (chain_id, residue_number) of a single flavin to
+            restrict the key atoms to, eg. the flavin a pocket was cut around
+    """
+    names = structure['atom_name'].values
+    is_ligand = structure['residue_name'].isin(ligands).values
+    if instance is not None:
+        chain_id, residue_number = instance
+        is_ligand = is_ligand & (structure['chain_id'].values == chain_id) & \
+            (structure['residue_number'].values == residue_number)
+    indices = [np.nonzero((names == key) & is_ligand)[0] for key in key_atoms]
+    if not indices:
+        return np.array([], dtype=np.int64)
+    return np.concatenate(indices)
+
+
+def pairs_within(key_xyz, xyz, box):
+    """ The neighbour search shared by every stage: returns (key index, atom
+        index, distance) of every pair of a row of :key_xyz: and a row of
+        :xyz: that are less than :box: angstroms apart along every axis.
+
+        Key atoms are processed in chunks so the temporaries stay bounded on
+        large structures.
+    """
+    chunk = max(1, _PAIR_CHUNK // max(1, len(xyz)))
+    key_hits, atom_hits, distances = [], [], []
+    for start in range(0, len(key_xyz), chunk):
+        delta = np.abs(xyz[None, :, :] - key_xyz[start:start + chunk, None, :])
+        k, a = np.nonzero((delta < box).all(axis=2))
+        key_hits.append(k + start)
+        atom_hits.append(a)
+        distances.append(np.sqrt((delta[k, a] ** 2).sum(axis=1)))
+    if not key_hits:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+    return np.concatenate(key_hits), np.concatenate(atom_hits), np.concatenate(distances)
+
+
+def _pair_window(key_xyz, key_radii, key_residues, xyz, radii, residues,
+                 tolerance, box=vdW_bounds['lower']):
+    """ the numeric kernel of find_contacts: returns (key index, atom index,
+        distance) of every pair whose distance lies strictly inside of
+        (r_key + r_atom - tolerance, r_key + r_atom + tolerance).
+
+        Pairs are only considered if they are within :box: angstroms along
+        every axis and don't share a residue number, exactly like the old
+        distance comparator did.
+    """
+    k, a, dist = pairs_within(key_xyz, xyz, box)
+    expected = key_radii[k] + radii[a]
+    keep = (residues[a] != key_residues[k]) & \
+        (dist < expected + tolerance) & (dist > expected - tolerance)
+    return k[keep], a[keep], dist[keep]
+
+
+def find_contacts(structure, key_atoms=KEY_ATOMS, ligands=FLAVINS, tolerance=TOLERANCE,
+                  radii=vdW_radii, instance=None, positions=False):
+    """ The geometry stage: every (key atom, target atom) pair at van der
+        Waals' distance of each other.
+
+        :structure: pandas.DataFrame of atoms in biopandas format (see
+            fetch_structure)
+        :key_atoms: names of the isoalloxazine atoms to search around
+        :ligands: residue names of the flavins
+        :tolerance: error term in angstroms; a pair is in contact if its
+            distance is within <tolerance> of the sum of their vdW radii
+        :radii: vdW radius table, see physical_constants.vdW_radii
+        :instance: *Optional* (chain_id, residue_number) of the only flavin to
+            search around (see select_key_atoms)
+        :positions: *Optional* also return the rows (positional indices into
+            :structure:) of both atoms as key_atom_position and
+            target_atom_position; atom numbers aren't unique in structures
+            with several models flattened together
+
+        Returns a pandas.DataFrame with a row per contact and the columns
+            key_atom_{number, name, residue, chain_id, residue_number},
+            target_atom_{number, name, residue, chain_id, residue_number} and
+            distance. Rows are grouped by key atom (in :key_atoms: order) and
+            sorted by distance within each key atom.
+    """
+    keys = select_key_atoms(structure, key_atoms, ligands, instance)
+    xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    names = structure['atom_name'].values
+    residue_names = structure['residue_name'].values
+    residue_numbers = structure['residue_number'].values
+    radii_all = vdW_radius_array(names, residue_names, ligands, radii)
+
+    k, a, dist = _pair_window(xyz[keys], radii_all[keys], residue_numbers[keys],
+                              xyz, radii_all, residue_numbers, tolerance)
+    # group by key atom, closest target first
+    order = np.lexsort((dist, k))
+    k, a, dist = keys[k[order]], a[order], dist[order]
+
+    contacts = pd.DataFrame()
+    for column, suffix in _ATOM_COLUMNS:
+        contacts['key_atom_' + suffix] = structure[column].values[k]
+    for column, suffix in _ATOM_COLUMNS:
+        contacts['target_atom_' + suffix] = structure[column].values[a]
+    contacts['distance'] = dist
+    if positions:
+        contacts['key_atom_position'] = k
+        contacts['target_atom_position'] = a
+    return contacts
+
+
+def load_label_table(path=LABEL_TABLE):
+    """ loads the residue interaction categories: a dict of residue name to a
+        pandas.DataFrame with the columns "Residue Atom" and "Code"
+    """
+    return pd.read_pickle(path)
+
+
+def label_contacts(contacts, residue_categories):
+    """ The labelling stage: returns a copy of :contacts: with an
+        interaction_label column holding the code of each target atom in
+        :residue_categories: (see load_label_table).
+
+        Atoms or residues that aren't in the table are labelled -1 and logged
+        once each.
+    """
+    lookup = {}
+    for residue, table in residue_categories.items():
+        # some of the tables have stray whitespace in their headers (eg. LEU)
+        table = table.rename(columns=lambda c: c.strip())
+        for atom, code in zip(table['Residue Atom'], table['Code']):
+            lookup[(residue, atom)] = code
+
+    labels = np.empty(len(contacts), dtype=np.int64)
+    missing = set()
+    pairs = zip(contacts['target_atom_residue'].values, contacts['target_atom_name'].values)
+    for i, pair in enumerate(pairs):
+        code = lookup.get(pair)
+        if code is None:
+            missing.add(pair)
+            code = -1
+        labels[i] = code
+    for residue in sorted(set(r for r, _ in missing if r not in residue_categories)):
+        print("residue not found:", residue)
+    for residue, atom in sorted(p for p in missing if p[0] in residue_categories):
+        print("could not find", atom, "in", residue)
+
+    labelled = contacts.copy()
+    labelled['interaction_label'] = labels
+    return labelled
@@ -1,122 +1,153 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import argparse
 import numpy as np
-from biopandas import pdb
 import pandas as pd
-from physical_constants import get_vdW_radius, vdW_bounds
+from physical_constants import vdW_radii
+from columnar_output import ContactWriter, compact_contacts
+from corpus_statistics import CorpusStatistics
+from radial_distribution import RadialHistogram
+from isoalloxazine_frames import contact_descriptors
+from pocket_library import POCKET_RADIUS, PocketLibrary, PocketWriter
+from site_redundancy import fan_out, group_sites, site_profile
+from contact_graphs import GraphBatchWriter
+from structure_ensemble import fetch_ensemble, find_ensemble_contacts
+from progressive_sampling import ALLOCATIONS, ContactFrequencies, rounds_of, \
+    stratified_order
+from flavin_contacts import KEY_ATOMS, FLAVINS, TOLERANCE, fetch_structure, \
+    find_contacts, label_contacts, load_label_table
+from result_cache import ResultCache, combine_keys, settings_fingerprint, \
+    structure_fingerprint
 import random
 import sys
 
 """
     Gets a random sample of 100 protines
     arguments:
-        ./get_sample.py <PDB_IDS.csv> <output_data.csv> <sample_size>
+        ./get_sample.py <PDB_IDS.csv> <output_data.csv> <sample_size> [options]
 
     for example:
         ./get_sample.py my_FADs.csv my_FADs_data.csv 100
+        ./get_sample.py my_FADs.csv my_FADs_data.parquet --cache-dir ~/.flavin_cache
+        ./get_sample.py sample_redox_potentials.csv redox.parquet --stratify-by Enzyme \
+            --seed 1 --ci-width 0.1
 
     :PDB_IDS: A CSV file with the heading "PDB ID", will ignore other columns
         in file.
-    :data.csv: Name of the file to write data.
+    :data.csv: Name of the file to write data. If it ends in ".parquet" the
+        data is written in the compact columnar format from columnar_output.py
+        (recommended: an order of magnitude smaller and faster to reload),
+        otherwise it's written as CSV.
+        Corpus statistics (see corpus_statistics.py) are saved next to it as
+        <data.csv>.stats.pkl, with summary tables in <data.csv>.stats.*.csv
     :sample_size: *Optional* If passed in, script will analyze
         min(sample_size, number of unique PDB_IDs). If not passed in script will
         analyze all PDB_IDs in the file.
+    :--tolerance: *Optional* vdW distance window in angstroms (default 0.2)
+    :--cache-dir: *Optional* directory to memoize per structure results in
+        (see result_cache.py). Re-runs with the same settings skip straight to
+        the output; changing only the interaction labels reuses the geometry.
+    :--cache-size: *Optional* size bound of the cache directory in MB
+    :--rdf-cutoff: *Optional* also histogram every ring atom to protein atom
+        distance up to this many angstroms, per chemical code, and save the
+        (mergeable) histograms as <data.csv>.rdf.npz; see radial_distribution.py
+    :--rdf-bin: *Optional* width in angstroms of the histogram bins (default 0.1)
+    :--pocket-library: *Optional* also cut a pocket out around every flavin
+        and add it to this pocket library (see pocket_library.py)
+    :--pocket-radius: *Optional* radius of the pockets in angstroms (default 8)
+    :--from-pockets: *Optional* analyze the pockets of the PDB IDs in this
+        pocket library instead of downloading whole structures
+    :--dedup: *Optional* with --from-pockets, group near-identical flavin
+        sites (see site_redundancy.py) and only analyze one site per group;
+        results are moved onto every member with a site_group and a
+        site_weight column, and group membership is written to
+        <data.csv>.sites.csv
+    :--seed: *Optional* seed for the sample, so runs can be reproduced
+    :--stratify-by: *Optional* column of <PDB_IDS.csv> (eg. Enzyme) to
+        stratify the sample by; see progressive_sampling.py
+    :--allocation: *Optional* 'equal' (default, every stratum in turn) or
+        'proportional' sampling of the strata
+    :--ci-width: *Optional* analyze structures in rounds and stop once the 95%
+        confidence interval of every (key atom, label) contact frequency is
+        narrower than this. The achieved precision is reported and written
+        to <data.csv>.sampling.csv (per round) and <data.csv>.precision.csv
+    :--round-size: *Optional* structures per round (default 25)
+    :--ensembles: *Optional* read NMR models and alternate locations as an
+        ensemble (see structure_ensemble.py) instead of flattening them, and
+        find the contacts of every model; adds model and contact_occupancy
+        columns
+    :--graphs: *Optional* also write the flavin -> residue contact graph of
+        every flavin to this directory, see contact_graphs.py
 """
-if len(sys.argv) < 2:
-    raise ValueError("Usage: ./get_sample.py <PDB_IDS.csv: Required> <output_data.csv: Required> <sample_size: Optional>")
+parser = argparse.ArgumentParser(description="Find the atoms interacting with the isoalloxazine of every flavin in a set of PDB entries.")
+parser.add_argument("pdb_ids", help="CSV file with a 'PDB ID' column")
+parser.add_argument("output", help="file to write the contacts to (.csv or .parquet)")
+parser.add_argument("sample_size", nargs="?", type=int, default=None,
+                    help="number of PDB IDs to sample (default: all of them)")
+parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                    help="vdW distance window in angstroms")
+parser.add_argument("--cache-dir", dest="cache_dir", default=None,
+                    help="directory to cache per structure results in")
+parser.add_argument("--cache-size", dest="cache_size", type=int, default=1024,
+                    help="size bound of the cache directory in MB")
+parser.add_argument("--rdf-cutoff", dest="rdf_cutoff", type=float, default=None,
+                    help="histogram all ring atom distances up to this cutoff")
+parser.add_argument("--rdf-bin", dest="rdf_bin", type=float, default=0.1,
+                    help="width of the radial distribution bins in angstroms")
+parser.add_argument("--pocket-library", dest="pocket_library", default=None,
+                    help="pocket library to add the pockets of every structure to")
+parser.add_argument("--pocket-radius", dest="pocket_radius", type=float, default=POCKET_RADIUS,
+                    help="radius of the pockets in angstroms")
+parser.add_argument("--from-pockets", dest="from_pockets", default=None,
+                    help="pocket library to analyze instead of whole structures")
+parser.add_argument("--dedup", action="store_true",
+                    help="only analyze one of each group of near-identical flavin sites")
+parser.add_argument("--seed", type=int, default=None,
+                    help="seed for the sample, for reproducible runs")
+parser.add_argument("--stratify-by", dest="stratify_by", default=None,
+                    help="column of the PDB ID file to stratify the sample by")
+parser.add_argument("--allocation", choices=ALLOCATIONS, default='equal',
+                    help="how the sample is spread over the strata")
+parser.add_argument("--ci-width", dest="ci_width", type=float, default=None,
+                    help="stop once every contact frequency's 95%% CI is narrower than this")
+parser.add_argument("--round-size", dest="round_size", type=int, default=25,
+                    help="structures per round with --ci-width")
+parser.add_argument("--ensembles", action="store_true",
+                    help="keep NMR models / alternate locations apart as an ensemble")
+parser.add_argument("--graphs", default=None,
+                    help="directory to write a memory mappable contact graph batch to")
+args = parser.parse_args()
+if args.from_pockets and (args.rdf_cutoff or args.pocket_library):
+    parser.error("--from-pockets works on trimmed pockets; it can't be combined with --rdf-cutoff or --pocket-library")
+if args.dedup and not args.from_pockets:
+    parser.error("--dedup needs the pockets of --from-pockets")
+if args.ensembles and (args.from_pockets or args.pocket_library):
+    parser.error("pockets are cut out of flattened structures; --ensembles can't be combined with them")
+if args.dedup and args.ci_width:
+    parser.error("--dedup groups sites over the whole sample; it can't be combined with --ci-width")
 
-PDB_IDS = sys.argv[1]
-DATAFILENAME = sys.argv[2]
+PDB_IDS = args.pdb_ids
+DATAFILENAME = args.output
 proteins = []
 try:
-    proteins = list(pd.read_csv(PDB_IDS)['PDB ID'].unique())
+    pdb_table = pd.read_csv(PDB_IDS).drop_duplicates('PDB ID')
+    proteins = list(pdb_table['PDB ID'])
 except:
     raise ValueError("Unable to read " + PDB_IDS + " please check that this \
             exists and is in correct format and try again.")
+strata = None
+if args.stratify_by:
+    if args.stratify_by not in pdb_table:
+        parser.error(PDB_IDS + " has no column " + args.stratify_by + " to stratify by")
+    strata = list(pdb_table[args.stratify_by].fillna('unknown'))
 
 SAMPLE_SIZE = len(proteins)
-if len(sys.argv) == 4:
-    try:
-        SAMPLE_SIZE = int(sys.argv[3])
-        print("Using sample size of: " + sys.argv[3])
-    except:
-        raise ValueError("sample_size must be passed in as a valid integer")
-
-proteins = random.sample(proteins, SAMPLE_SIZE)
-
-def _make_distance_comparator(origin, tolerance=0.2):
-    """ Returns a distance functor based upon a given atom
-
-        :origin: one row of a pandas.DataFrame with that contains the columns:
-            { "x_coord", "y_coord", "z_coord", "chain_id", "residue_name", "atom_name",
-            "residue_number" } in standard PDB format
-        :tolerance: an integer error term used when calculating distnace in
-            angstroms. If the actual distance of the atoms is within
-            <tolerance> angstroms it is said that the two atoms under
-            examination are interacting.
-    """
-    keys = ["x_coord", "y_coord", "z_coord", "chain_id", "residue_name",
-            "atom_name", "residue_number"]
-    coords = origin[keys].values[0]
-    x_o, y_o, z_o = coords[0], coords[1], coords[2]
-    residue_o, residue_num_o = coords[4], coords[6]
-    vdW_keyatom = get_vdW_radius(origin['atom_name'].values[0], residue_o)
-    def distance_comparator(point):
-        """
-        A distance comparator that returns the distance of the between the input "point"
-        atom and the atom based in to origin.
-
-        distance is calculated based on an atoms x, y, z coordinates
-
-        Errors/Exceptions: if the atom's name is not listed in
-            "physical_constants.py" then on failing to look it up,
-            get_vdW_radius will log the atom's name to standard out and
-            distance_comparator will return np.nan, np.nan
-
-        Returns: (distance, label)
-        :distance: a double in angstroms describing the 3-D distance between
-            the atoms under examination
-        :label: an integer value that approximates the electrostatic potentials
-            between the atoms under consideration, as retrieved in
-            interaction_labels.txt
-        If these two atoms do not experience electrostatic interactions or an
-            error occured while looking up the atom's van Der Waals' forces then
-            the return value is a tuple (np.nan, np.nan)
-        """
-        coords = point[keys]
-        x, y, z = coords[0], coords[1], coords[2]
-        residue, name, residue_num = coords[4], coords[5], coords[6]
-        if residue_num == residue_num_o:
-            return np.nan, np.nan
-        net_x, net_y, net_z = abs(x - x_o), abs(y - y_o), abs(z - z_o)
-        if net_x < vdW_bounds['lower'] and net_y < vdW_bounds['lower'] and net_z < vdW_bounds['lower']:
-            distance = np.sqrt(net_x **2 + net_y ** 2 + net_z ** 2)
-            expected_weak_iteraction_dist = get_vdW_radius(point['atom_name'], residue) + vdW_keyatom
-            if distance < expected_weak_iteraction_dist + tolerance and distance > expected_weak_iteraction_dist - tolerance:
-                return distance, get_label(name, residue)
-        return np.nan, np.nan
-
-    return distance_comparator
+if args.sample_size is not None:
+    SAMPLE_SIZE = min(args.sample_size, len(proteins))
+    print("Using sample size of: " + str(SAMPLE_SIZE))
 
-# load residue interaction categories:
-residue_categories = pd.read_pickle('./interaction_labels/interaction_dictionary.pkl')
-
-def get_label(atom_name, residue):
-    """
-        Attempts to look up label for an atom in a given residue. If not found
-        logs error to stdout and returns np.nan
-    """
-    try:
-        res = residue_categories[residue]
-    except:
-        print("residue not found:", residue)
-        return -1
-    try:
-        res = residue_categories[residue]
-        return res[res['Residue Atom'] == atom_name].Code.values[0]
-    except:
-        print("could not find", atom_name, "in", residue)
-        return -1
+proteins = stratified_order(proteins, strata, seed=args.seed,
+                            allocation=args.allocation)[:SAMPLE_SIZE]
 
 
 ###############################################################################
@@ -127,81 +158,226 @@ def get_label(atom_name, residue):
 
 
 # anecdotal names of key atoms in the isoalloxazine to lookup
-key_atoms = ['N1', 'C2', 'O2', 'N3', 'C4', 'O4', 'C4X', 'N5', 'C5X', 'C6', 'C7',
-            'C7M', 'C8', 'C9', 'C9A', 'N10', 'C10']
+key_atoms = KEY_ATOMS
 # PDB names for flavins
-flavins = ['FMN', 'FAD']
-# taken from biopandas.PDB() object
-pdb_columns = ['record_name', 'atom_number', 'blank_1', 'atom_name', 'alt_loc',
-  'residue_name', 'blank_2', 'chain_id', 'residue_number', 'insertion',
-  'blank_3', 'x_coord', 'y_coord', 'z_coord', 'occupancy', 'b_factor',
-  'blank_4', 'segment_id', 'element_symbol', 'charge', 'line_idx']
-
-# DataFrame that aggregates information accross the columns: contains
-#  information on both the target atom and key atom
-dataset = pd.DataFrame(columns = ['distance']+ ['key_' + x for x in pdb_columns] +
-        ['target_' + x for x in pdb_columns])
-
-for protein in proteins:
-    pro = None # running out of names for things at this point
-    # attempt to download the protein multiple times from the PDB as this can
-    #  fail on occassion
-    for _ in range(3):
-        try:
-            pro = pdb.PandasPDB().fetch_pdb(protein).df
-            break
-        # not finishing this try will cause compile errors on some implementations
-        except:
+flavins = FLAVINS
+
+# load residue interaction categories:
+residue_categories = load_label_table()
+
+# everything the geometry stage depends on, and everything the labelling
+#  stage adds on top of it. Results are cached under these fingerprints so
+#  they're invalidated automatically when any of them changes
+geometry_settings = settings_fingerprint(key_atoms=key_atoms, ligands=flavins,
+                                         tolerance=args.tolerance, vdW_radii=vdW_radii,
+                                         positions=True)
+label_settings = settings_fingerprint(interaction_labels=residue_categories)
+
+cache = None
+if args.cache_dir:
+    cache = ResultCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20)
+
+
+def _memoize(stage, key, compute):
+    if cache is None:
+        return compute()
+    return cache.memoize(stage, key, compute)
+
+
+def analyze_structure(structure, instance=None):
+    """ geometry + labelling stages for one structure (or only the flavin
+        :instance: of a pocket), through the cache
+    """
+    geometry_key = combine_keys(structure_fingerprint(structure), geometry_settings,
+                                str(instance))
+    contacts = _memoize('geometry', geometry_key, lambda: find_contacts(
+        structure, key_atoms, flavins, tolerance=args.tolerance, radii=vdW_radii,
+        instance=instance, positions=True))
+    return _memoize('labels', combine_keys(geometry_key, label_settings),
+                    lambda: label_contacts(contacts, residue_categories))
+
+
+def analyze_ensemble(ensemble):
+    """ geometry + labelling + descriptor stages for every model of an
+        ensemble at once, through the cache
+    """
+    geometry_key = combine_keys(ensemble.fingerprint(), geometry_settings, 'ensemble')
+    contacts = _memoize('geometry', geometry_key, lambda: find_ensemble_contacts(
+        ensemble, key_atoms, flavins, tolerance=args.tolerance, radii=vdW_radii))
+    contacts = _memoize('labels', combine_keys(geometry_key, label_settings),
+                        lambda: label_contacts(contacts, residue_categories))
+    # flavin frames are fitted per model
+    return pd.concat([contact_descriptors(contacts[contacts['model'].values == model_id],
+                                          ensemble.model(i), flavins)
+                      for i, model_id in enumerate(ensemble.model_ids)], ignore_index=True)
+
+
+# contact tables that hold information on both the target atom and key atom.
+#  Parquet output is streamed to disk as we go, CSV output is collected and
+#  written at the end
+datasets = []
+statistics = CorpusStatistics()
+radial = None
+if args.rdf_cutoff:
+    radial = RadialHistogram(cutoff=args.rdf_cutoff, bin_width=args.rdf_bin, ligands=flavins)
+writer = None
+if DATAFILENAME.endswith('.parquet'):
+    writer = ContactWriter(DATAFILENAME)
+graphs = None
+if args.graphs:
+    graphs = GraphBatchWriter(args.graphs)
+pockets = None
+if args.pocket_library:
+    pockets = PocketWriter(args.pocket_library, ligands=flavins, radius=args.pocket_radius)
+
+
+membership = None
+profiles = None
+
+
+def representative_pockets(library, batch):
+    """ profiles every pocket of :batch: in :library:, groups near-identical
+        sites and generates (provenance, pocket, site) of each group's
+        representative, :site: being (representative, pockets of the other
+        members)
+    """
+    global membership, profiles
+    positions = library.select(batch)
+    positions = positions[np.argsort(library.index['offset'].values[positions], kind='mergesort')]
+    sites = library.index.iloc[positions].reset_index(drop=True)
+    fingerprints, profiles = [], []
+    with open(library.path, 'rb') as f:
+        for i in positions:
+            provenance, pocket = library.read(i, f)
+            fingerprint, profile = site_profile(
+                pocket, (provenance['chain_id'], provenance['residue_number']), flavins)
+            fingerprints.append(fingerprint)
+            profiles.append(profile)
+    sites['fingerprint'] = fingerprints
+    membership = group_sites(sites, profiles)
+    membership.to_csv(DATAFILENAME + '.sites.csv', index=False)
+    print("Found", membership['site_group'].nunique(), "distinct sites among", len(membership))
+
+    representatives = membership['representative'].values
+    with open(library.path, 'rb') as f:
+        for site in np.unique(representatives):
+            provenance, pocket = library.read(positions[site], f)
+            others = [m for m in np.nonzero(representatives == site)[0] if m != site]
+            yield provenance, pocket, (site, dict((m, library.read(positions[m], f)[1])
+                                                  for m in others))
+
+
+def structures(batch):
+    """ generates (PDB ID, structure, flavin instance, site) of everything to
+        analyze in :batch: (PDB IDs): whole structures straight from the PDB,
+        or the pockets of a library. :site: is only set for the
+        representatives of --dedup (see representative_pockets)
+    """
+    if args.from_pockets:
+        library = PocketLibrary(args.from_pockets)
+        if args.dedup:
+            selected = representative_pockets(library, batch)
+        else:
+            selected = ((p, pocket, None) for p, pocket in library.pockets(pdb_ids=batch))
+        for provenance, pocket, site in selected:
+            yield provenance['PDB_ID'], pocket, (provenance['chain_id'],
+                                                 provenance['residue_number']), site
+        return
+
+    for protein in batch:
+        # attempt to download the protein multiple times from the PDB as this can
+        #  fail on occassion
+        pro = fetch_ensemble(protein) if args.ensembles else fetch_structure(protein)
+        if pro is None:
+            # totally failed, log the erorr and move on
+            print("UNABLE TO DOWNLOAD: ", protein)
             continue
+        if pockets is not None:
+            pockets.write_structure(protein, pro)
+        yield protein, pro, None, None
+
+
+# with --ci-width structures are analyzed in rounds until the contact
+#  frequencies are precise enough, otherwise everything is one round
+frequencies = ContactFrequencies()
+rounds = rounds_of(proteins, args.round_size if args.ci_width else None)
+sampling = []
+try:
+    for number, batch in enumerate(rounds):
+        for protein, pro, instance, site in structures(batch):
+            if args.ensembles:
+                temp_df = analyze_ensemble(pro)
+                if radial is not None:
+                    for i in range(pro.n_models):
+                        radial.update(pro.model(i))
+            else:
+                # where each contact sits relative to the ring plane of its flavin;
+                #  the atom positions only mean something in this structure
+                temp_df = contact_descriptors(analyze_structure(pro, instance), pro, flavins) \
+                    .drop(['key_atom_position', 'target_atom_position'], axis=1)
+                if radial is not None:
+                    radial.update(pro)
+            temp_df.insert(0, 'PDB_ID', protein)
+            if site is not None:
+                representative, members = site
+                temp_df = fan_out(temp_df, membership, representative, members, profiles)
+            frequencies.update(protein, temp_df)
+            statistics.update(temp_df, protein)
+            if graphs is not None:
+                graphs.write(temp_df)
+            if writer is not None:
+                writer.write(temp_df)
+            else:
+                datasets.append(compact_contacts(temp_df))
+
+        if args.ci_width:
+            width = frequencies.max_width()
+            sampling.append([number + 1, frequencies.structures, width])
+            print("Round", number + 1, "-", frequencies.structures, "structures, widest CI", width)
+            if width <= args.ci_width:
+                break
+finally:
+    # keep every pocket written so far, even if the run dies part way
+    if pockets is not None:
+        pockets.close()
 
-    if pro == None:
-        # totally failed, log the erorr and move on
-        print("UNABLE TO DOWNLOAD: ", protein)
-        continue
-
-    # adjust the protein so that caculations
-    #  are easier since we make no distinction between atom and heteroatom
-    pro = pd.concat([pro['ATOM'], pro["HETATM"]])
-    atmnums = [[], []]
-    for key in key_atoms:
-        key_rows = pro[pro['atom_name'] == key]
-        for i in range(len(key_rows)):
-            if key_rows.iloc[i]['residue_name'] in flavins:
-                atmnums[0].append(key_rows.iloc[i]['atom_number'])
-                atmnums[1].append(key)
-
-    # iterate over all of the atoms add it to the DataFrame
-    for num in atmnums[0]:
-        atom_data = pro[pro.atom_number == num]
-        func = _make_distance_comparator(atom_data)
-        distance_from_atom_df = pro.apply(func, axis=1)
-        pro['distance'] = [x[0] for x in distance_from_atom_df]
-        pro['interaction_label'] = [x[1] for x in distance_from_atom_df]
-        valid_atom_indices = pro['distance'].notnull()
-        valid_key_atoms = pro[valid_atom_indices].sort_values(by=['distance'], ascending=True)
-        atom_name = atom_data.atom_name.values[0]
-        atom_residue = atom_data.residue_name.values[0]
-        chain = atom_data.chain_id.values[0]
-
-        # set temp dataframe and add to dataset
-        temp_df = pd.DataFrame(columns=dataset.columns)
-        temp_df['distance'] = valid_key_atoms['distance']
-        temp_df['PDB_ID'] = [protein for _ in range(len(temp_df))]
-        temp_df['key_atom_number'] = [num for _ in range(len(temp_df))]
-        temp_df['key_atom_name'] = [atom_name for _ in range(len(temp_df))]
-        temp_df['key_atom_residue'] = [atom_residue for _ in range(len(temp_df))]
-        temp_df['key_atom_chain_id'] = [chain for _ in range(len(temp_df))]
-        temp_df['target_atom_residue'] = valid_key_atoms['residue_name']
-        temp_df['target_atom_number'] = valid_key_atoms['atom_number']
-        temp_df['target_atom_name'] = valid_key_atoms['atom_name']
-        temp_df['target_atom_chain_id'] = valid_key_atoms['chain_id']
-        temp_df['interaction_label'] = valid_key_atoms['interaction_label']
-        dataset = pd.concat([dataset, temp_df])
+if args.ci_width:
+    width = frequencies.max_width()
+    if width <= args.ci_width:
+        print("Reached a CI width of", width, "with", frequencies.structures, "structures")
+    else:
+        print("Ran out of structures: widest CI is", width, "with", frequencies.structures,
+              "structures, wanted", args.ci_width)
+    pd.DataFrame(sampling, columns=['round', 'structures', 'max_ci_width']) \
+        .to_csv(DATAFILENAME + '.sampling.csv', index=False)
+    frequencies.intervals().to_csv(DATAFILENAME + '.precision.csv', index=False)
+
+if cache is not None:
+    print("Result cache:", cache.hits, "hits,", cache.misses, "misses")
+if graphs is not None:
+    graphs.close()
+    print("Wrote", len(graphs), "contact graphs to", args.graphs)
 
 # Finished computations; log data into provided file
-if len(sys.argv[2]):
+statistics.save(DATAFILENAME + '.stats.pkl')
+statistics.write_tables(DATAFILENAME + '.stats')
+if radial is not None:
+    radial.save(DATAFILENAME + '.rdf.npz')
+print(statistics.tables()['key_atom_label'].head(20))
+
+if writer is not None:
+    writer.close()
+    print("Wrote", writer.rows_written, "contacts to", DATAFILENAME)
+    sys.exit(0)
+
+if datasets:
+    dataset = pd.concat(datasets, ignore_index=True)
+else:
+    dataset = compact_contacts(pd.DataFrame())
+
+if len(DATAFILENAME):
     try:
-        dataset.to_csv(sys.argv[2])
+        dataset.to_csv(DATAFILENAME)
     except:
         # printing could be really painful/useless, but it's still better than losing
         # hours worth of computation
@@ -0,0 +1,202 @@
+'''
+    isoalloxazine_frames.py
+        Local coordinate frames for every flavin in a structure, and the
+            position of every contact expressed in its flavin's frame.
+
+        Distances alone can't tell an in-plane hydrogen bond at N5/O4 from a
+            residue stacked on top of the ring, so every contact also gets:
+
+            plane_offset: distance from the ring centroid within the ring plane
+            height:       signed distance above (+) or below (-) the ring plane
+            elevation:    angle in degrees between the ring plane and the
+                          centroid -> target vector (+/-90 is straight above/below)
+
+        Frames are fitted to all flavins at once with a batched SVD over a
+            (n_flavins, n_ring_atoms, 3) array:
+
+            origin: centroid of the ring atoms
+            x:      N10 -> N5, projected into the plane
+            z:      plane normal, oriented so that (x, long axis, z) is right
+                    handed where the long axis runs from C7 to N3, which keeps
+                    the re/si faces consistent between flavins
+            y:      z cross x
+
+        A flavin whose ring atoms show up more than once (models of an NMR
+            entry flattened into one frame, alternate locations) gets a frame
+            per copy: the n-th occurrence of each ring atom is copy n, and a
+            contact is placed in the frame of its key atom's copy.
+'''
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import FLAVINS
+
+# the atoms of the tricyclic ring system that the plane is fitted to
+FRAME_ATOMS = ['N1', 'C2', 'N3', 'C4', 'C4X', 'N5', 'C5X', 'C6', 'C7', 'C8', 'C9',
+               'C9A', 'N10', 'C10']
+
+# remediated PDB entries name these C4A and C5A
+ATOM_ALIASES = {'C4A': 'C4X', 'C5A': 'C5X'}
+
+# columns identifying a flavin instance within a structure
+INSTANCE_COLUMNS = ['chain_id', 'residue_number', 'residue_name']
+
+DESCRIPTOR_COLUMNS = ['plane_offset', 'height', 'elevation']
+
+
+def _instance_keys(chain_ids, residue_numbers, residue_names, copies=None):
+    keys = pd.Series(chain_ids).astype(str).values + ':' + \
+        pd.Series(residue_numbers).astype(str).values + ':' + \
+        pd.Series(residue_names).astype(str).values
+    if copies is None:
+        return keys
+    return keys + ':' + pd.Series(copies).astype(str).values
+
+
+def _copies(structure, ligands=FLAVINS):
+    """ copy (see the module docstring) of every atom of :structure:; the
+        number of earlier atoms of the same flavin with the same name, 0 for
+        anything that isn't a flavin
+    """
+    is_ligand = structure['residue_name'].isin(ligands).values
+    copies = np.zeros(len(structure), dtype=np.int64)
+    if is_ligand.any():
+        ligand = structure[is_ligand]
+        keys = _instance_keys(*[ligand[c].values for c in INSTANCE_COLUMNS])
+        names = ligand['atom_name'].replace(ATOM_ALIASES).values
+        copies[is_ligand] = pd.Series(keys).groupby([keys, names]).cumcount().values
+    return copies
+
+
+def ring_coordinates(structure, ligands=FLAVINS, atoms=FRAME_ATOMS):
+    """ Gathers the ring atoms of every flavin in :structure:
+
+        Returns (instances, coords) where :instances: is a pandas.DataFrame
+            with the INSTANCE_COLUMNS and copy of each flavin and :coords: is
+            an array of shape (len(instances), len(atoms), 3) with np.nan
+            where an atom is missing from a flavin.
+    """
+    names = structure['atom_name'].replace(ATOM_ALIASES)
+    copies = _copies(structure, ligands)
+    selected = structure['residue_name'].isin(ligands).values & names.isin(atoms).values
+    ring = structure[selected]
+    keys = _instance_keys(*[ring[c].values for c in INSTANCE_COLUMNS] + [copies[selected]])
+    instance, uniques = pd.factorize(keys)
+    first = ~pd.Series(keys).duplicated().values
+    instances = ring[INSTANCE_COLUMNS][first].reset_index(drop=True)
+    instances['copy'] = copies[selected][first]
+    slot = pd.Series(range(len(atoms)), index=atoms)[names.values[selected]].values
+    coords = np.full((len(uniques), len(atoms), 3), np.nan)
+    coords[instance, slot] = ring[['x_coord', 'y_coord', 'z_coord']].values
+    return instances, coords
+
+
+def _unit(vectors):
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return vectors / norm
+
+
+def fit_frames(coords, atoms=FRAME_ATOMS):
+    """ Fits a local frame to every flavin at once.
+
+        :coords: array of shape (n, len(atoms), 3), np.nan for missing atoms
+        Returns (origins, axes): arrays of shape (n, 3) and (n, 3, 3) where
+            axes[i] holds the unit x, y and z vectors of flavin i as rows.
+            Flavins with fewer than 3 ring atoms get np.nan frames.
+    """
+    present = ~np.isnan(coords).any(axis=2)
+    counts = present.sum(axis=1)
+    filled = np.where(present[:, :, None], coords, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        origins = filled.sum(axis=1) / counts[:, None]
+    centered = np.where(present[:, :, None], coords - origins[:, None, :], 0.0)
+
+    # right singular vectors are the principal axes of each ring, least
+    #  significant last; missing atoms were zeroed so they don't contribute
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    normal = vt[:, 2]
+
+    def in_plane(start, stop, fallback):
+        i, j = atoms.index(start), atoms.index(stop)
+        vector = coords[:, j] - coords[:, i]
+        vector = vector - (vector * normal).sum(axis=1, keepdims=True) * normal
+        missing = ~(present[:, i] & present[:, j])
+        return _unit(np.where(missing[:, None], fallback, vector))
+
+    x = in_plane('N10', 'N5', vt[:, 1])
+    long_axis = in_plane('C7', 'N3', vt[:, 0])
+    z = _unit(np.cross(x, long_axis))
+    y = np.cross(z, x)
+
+    axes = np.stack([x, y, z], axis=1)
+    degenerate = counts < 3
+    origins[degenerate] = np.nan
+    axes[degenerate] = np.nan
+    return origins, axes
+
+
+def local_coordinates(points, origins, axes):
+    """ :points: (m, 3) expressed in the frames (origins (m, 3), axes (m, 3, 3)) """
+    return np.einsum('mij,mj->mi', axes, points - origins)
+
+
+def _atom_positions(contacts, structure):
+    """ rows of :structure: of the key and target atom of every contact: the
+        key_atom_position / target_atom_position columns of find_contacts or,
+        without them, looked up by atom number
+    """
+    if 'key_atom_position' in contacts and 'target_atom_position' in contacts:
+        return contacts['key_atom_position'].values.astype(np.int64), \
+            contacts['target_atom_position'].values.astype(np.int64)
+    numbers = structure['atom_number']
+    if numbers.duplicated().any():
+        raise ValueError("atom numbers repeat in the structure (flattened models?); "
+                         "find its contacts with find_contacts(..., positions=True)")
+    positions = pd.Series(range(len(structure)), index=numbers.values)
+    return positions[contacts['key_atom_number'].values].values, \
+        positions[contacts['target_atom_number'].values].values
+
+
+def contact_descriptors(contacts, structure, ligands=FLAVINS):
+    """ Returns a copy of :contacts: (as built by find_contacts) with the
+        DESCRIPTOR_COLUMNS added, computed in the frame of each contact's
+        flavin. Contacts of key atoms whose flavin has no frame get np.nan.
+
+        Atoms are found in :structure: by the key/target_atom_position columns
+            of find_contacts(..., positions=True) when :contacts: has them,
+            by atom number otherwise (a ValueError if those aren't unique).
+    """
+    described = contacts.copy()
+    if not len(contacts):
+        for column in DESCRIPTOR_COLUMNS:
+            described[column] = np.array([], dtype=np.float64)
+        return described
+
+    instances, coords = ring_coordinates(structure, ligands)
+    origins, axes = fit_frames(coords)
+
+    # flavin instance (and copy, that of the key atom) of every contact
+    key_positions, target_positions = _atom_positions(contacts, structure)
+    instance_ids = dict(zip(_instance_keys(*[instances[c].values
+                                             for c in INSTANCE_COLUMNS + ['copy']]),
+                            range(len(instances))))
+    key = _instance_keys(contacts['key_atom_chain_id'].values,
+                         contacts['key_atom_residue_number'].values,
+                         contacts['key_atom_residue'].values,
+                         _copies(structure, ligands)[key_positions])
+    instance = pd.Series(key).map(instance_ids).values.astype(np.float64)
+
+    xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    targets = xyz[target_positions]
+
+    found = ~np.isnan(instance)
+    local = np.full((len(contacts), 3), np.nan)
+    index = instance[found].astype(np.int64)
+    local[found] = local_coordinates(targets[found], origins[index], axes[index])
+
+    offset = np.hypot(local[:, 0], local[:, 1])
+    described['plane_offset'] = offset
+    described['height'] = local[:, 2]
+    described['elevation'] = np.degrees(np.arctan2(local[:, 2], offset))
+    return described
@@ -0,0 +1,224 @@
+'''
+    pocket_library.py
+        A library of flavin pockets: the flavin plus every atom within a few
+            angstroms of it, cut out of each structure once and packed many to
+            a file so that reanalysis never has to fetch or load whole
+            structures again.
+
+        Every pocket keeps its provenance (PDB ID, chain, residue number and
+            name of the flavin) and the original atom numbers of every atom,
+            and reads back as a regular biopandas style DataFrame, so the
+            neighbour, labelling and descriptor stages run on it unchanged.
+            Pass the pocket's (chain_id, residue_number) as the :instance: of
+            find_contacts so only its own flavin is searched around.
+
+        On disk a library is two files:
+            <library>:           the pockets, each one a zlib compressed pickle
+            <library>.index.pkl: pandas.DataFrame with one row per pocket, its
+                                 provenance and (offset, length) into <library>
+
+        Usage:
+            with PocketWriter('FADS.pockets') as writer:
+                writer.write_structure('2dor', structure)
+
+            library = PocketLibrary('FADS.pockets')
+            for provenance, pocket in library.pockets(pdb_ids=['2dor']):
+                find_contacts(pocket, instance=(provenance['chain_id'],
+                                                provenance['residue_number']))
+'''
+
+import os
+import pickle
+import zlib
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import FLAVINS, pairs_within
+
+# angstroms around any flavin atom; comfortably more than the largest vdW
+#  contact distance so pockets give exactly the same contacts as structures
+POCKET_RADIUS = 8.0
+
+# the columns of a structure that are kept in a pocket
+POCKET_COLUMNS = ['record_name', 'atom_number', 'atom_name', 'alt_loc', 'residue_name',
+                  'chain_id', 'residue_number', 'insertion', 'x_coord', 'y_coord',
+                  'z_coord', 'occupancy', 'b_factor', 'element_symbol']
+
+INDEX_COLUMNS = ['PDB_ID', 'chain_id', 'residue_number', 'residue_name', 'n_atoms',
+                 'offset', 'length']
+
+_INDEX_SUFFIX = '.index.pkl'
+
+# pockets written between saves of the index
+SAVE_EVERY = 100
+
+
+def _instance_key(pdb_id, chain_id, residue_number):
+    """ identifies a flavin instance across runs """
+    return str(pdb_id).lower(), str(chain_id), int(residue_number)
+
+
+def extract_pockets(structure, pdb_id, ligands=FLAVINS, radius=POCKET_RADIUS):
+    """ Cuts a pocket out of :structure: around every flavin in it.
+
+        :structure: pandas.DataFrame of atoms in biopandas format
+        :pdb_id: PDB ID the structure came from, kept as provenance
+        :radius: atoms within this many angstroms of any atom of the flavin
+            are part of its pocket
+        Returns a list of (provenance, pocket) where provenance is a dict of
+            PDB_ID, chain_id, residue_number and residue_name and pocket is a
+            pandas.DataFrame with the POCKET_COLUMNS of the pocket's atoms, in
+            the same order as in :structure:
+    """
+    is_ligand = structure['residue_name'].isin(ligands).values
+    if not is_ligand.any():
+        return []
+    xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    chains = structure['chain_id'].values
+    numbers = structure['residue_number'].values
+    names = structure['residue_name'].values
+    columns = [c for c in POCKET_COLUMNS if c in structure]
+
+    ligand_rows = np.nonzero(is_ligand)[0]
+    instances = pd.DataFrame({'chain_id': chains[ligand_rows],
+                              'residue_number': numbers[ligand_rows],
+                              'residue_name': names[ligand_rows]}).drop_duplicates()
+    pockets = []
+    for chain_id, residue_number, residue_name in instances.values:
+        members = np.nonzero(is_ligand & (chains == chain_id) & (numbers == residue_number) &
+                             (names == residue_name))[0]
+        _, near, dist = pairs_within(xyz[members], xyz, radius)
+        inside = np.union1d(np.unique(near[dist < radius]), members)
+        provenance = {'PDB_ID': pdb_id, 'chain_id': chain_id,
+                      'residue_number': residue_number, 'residue_name': residue_name}
+        pockets.append((provenance, structure[columns].iloc[inside].reset_index(drop=True)))
+    return pockets
+
+
+def _pack(provenance, pocket):
+    record = {'provenance': provenance,
+              'columns': dict((c, pocket[c].values) for c in pocket.columns),
+              'order': list(pocket.columns)}
+    return zlib.compress(pickle.dumps(record, protocol=2))
+
+
+def _unpack(blob):
+    record = pickle.loads(zlib.decompress(blob))
+    frame = pd.DataFrame(record['columns'], columns=record['order'])
+    return record['provenance'], frame
+
+
+class PocketWriter():
+    '''
+        Appends pockets to a library, see the module docstring.
+
+        Opening an existing library appends to it; pockets of flavins that
+            are already in it (same PDB ID, chain and residue number) are
+            skipped. The index is saved every :save_every: pockets and on
+            close, so a run that dies part way keeps what it wrote.
+    '''
+
+    def __init__(self, path, ligands=FLAVINS, radius=POCKET_RADIUS, save_every=SAVE_EVERY):
+        self.path = path
+        self.ligands = ligands
+        self.radius = radius
+        self.save_every = save_every
+        self._index = []
+        if os.path.exists(path) and os.path.exists(path + _INDEX_SUFFIX):
+            self._index = pd.read_pickle(path + _INDEX_SUFFIX).values.tolist()
+        self._known = set(_instance_key(row[0], row[1], row[2]) for row in self._index)
+        self._unsaved = 0
+        self._file = open(path, 'ab')
+
+    def write(self, provenance, pocket):
+        """ appends :pocket:, unless its flavin is already in the library;
+            returns whether it was written
+        """
+        key = _instance_key(provenance['PDB_ID'], provenance['chain_id'],
+                            provenance['residue_number'])
+        if key in self._known:
+            return False
+        blob = _pack(provenance, pocket)
+        offset = self._file.tell()
+        self._file.write(blob)
+        self._index.append([provenance['PDB_ID'], provenance['chain_id'],
+                            provenance['residue_number'], provenance['residue_name'],
+                            len(pocket), offset, len(blob)])
+        self._known.add(key)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+        return True
+
+    def write_structure(self, pdb_id, structure):
+        """ extracts and writes every new pocket of :structure:, returns how
+            many were written
+        """
+        pockets = extract_pockets(structure, pdb_id, self.ligands, self.radius)
+        return sum(self.write(provenance, pocket) for provenance, pocket in pockets)
+
+    def save(self):
+        """ writes the index of every pocket written so far """
+        if self._file.closed:
+            return
+        self._file.flush()
+        # write then rename so a crash never leaves half an index behind
+        pd.to_pickle(pd.DataFrame(self._index, columns=INDEX_COLUMNS),
+                     self.path + _INDEX_SUFFIX + '.tmp')
+        os.rename(self.path + _INDEX_SUFFIX + '.tmp', self.path + _INDEX_SUFFIX)
+        self._unsaved = 0
+
+    def close(self):
+        self.save()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PocketLibrary():
+    '''
+        Read access to a pocket library. Only the index is loaded up front;
+            each pocket is read on its own with a single seek + read.
+
+        :index: pandas.DataFrame of INDEX_COLUMNS, one row per pocket
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.index = pd.read_pickle(path + _INDEX_SUFFIX)
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, i, handle=None):
+        """ (provenance, pocket) of the :i:-th pocket in the index """
+        offset, length = self.index['offset'].values[i], self.index['length'].values[i]
+        if handle is None:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return _unpack(f.read(length))
+        handle.seek(offset)
+        return _unpack(handle.read(length))
+
+    def select(self, pdb_ids=None):
+        """ positions in the index of the pockets of :pdb_ids: (case
+            insensitive), or of every pocket
+        """
+        if pdb_ids is None:
+            return np.arange(len(self.index))
+        wanted = set(str(p).lower() for p in pdb_ids)
+        return np.nonzero(self.index['PDB_ID'].astype(str).str.lower().isin(wanted).values)[0]
+
+    def pockets(self, pdb_ids=None):
+        """ generates (provenance, pocket) for every pocket of :pdb_ids:, in
+            file order so reads are sequential
+        """
+        positions = self.select(pdb_ids)
+        positions = positions[np.argsort(self.index['offset'].values[positions], kind='mergesort')]
+        with open(self.path, 'rb') as f:
+            for i in positions:
+                yield self.read(i, f)
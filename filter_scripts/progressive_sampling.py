@@ -0,0 +1,143 @@
+'''
+    progressive_sampling.py
+        Seeded, stratified sampling of PDB IDs in rounds, and the precision
+            check that decides when enough structures have been analyzed.
+
+        Ordering: within every stratum (eg. the Enzyme column of
+            sample_redox_potentials.csv) PDB IDs are shuffled with a seeded
+            RNG, then the strata are interleaved so that any prefix of the
+            order is stratified:
+                equal:        round robin over the strata, so rare families
+                              show up in the very first rounds
+                proportional: every stratum at its share of the corpus
+            Same input + same seed = same order, so runs are reproducible
+            and a longer run is a superset of a shorter one.
+
+        Precision: for every (key atom, interaction label) the frequency is
+            the fraction of analyzed structures where that key atom makes at
+            least one contact with that label. Structures are the sampling
+            unit so these are binomial, and their 95% Wilson score intervals
+            are well behaved even for rare labels (p near 0) and small n.
+            Sampling can stop once the widest interval is under a target.
+
+            Note that with equal allocation the frequencies are over the
+            (stratified) sample, not the corpus.
+'''
+
+import random
+
+import numpy as np
+import pandas as pd
+
+# ~95% two sided
+Z = 1.96
+
+ALLOCATIONS = ['equal', 'proportional']
+
+
+def stratified_order(pdb_ids, strata=None, seed=None, allocation='equal'):
+    """ Returns :pdb_ids: in the order they should be analyzed in.
+
+        :strata: *Optional* stratum of every PDB ID (same length as
+            :pdb_ids:); without it the order is a plain seeded shuffle
+        :seed: seed of the RNG, None for a different order every run
+        :allocation: 'equal' or 'proportional', see the module docstring
+    """
+    rng = random.Random(seed)
+    pdb_ids = list(pdb_ids)
+    if strata is None:
+        return rng.sample(pdb_ids, len(pdb_ids))
+    if allocation not in ALLOCATIONS:
+        raise ValueError("allocation must be one of " + ", ".join(ALLOCATIONS))
+
+    members = {}
+    for pdb_id, stratum in zip(pdb_ids, strata):
+        members.setdefault(stratum, []).append(pdb_id)
+    # stratum names can be mixed types (eg. NaN), so order them by their str
+    keys = []
+    for stratum in sorted(members, key=str):
+        group = members[stratum]
+        rng.shuffle(group)
+        for position in range(len(group)):
+            if allocation == 'equal':
+                key = position + rng.random()
+            else:
+                key = (position + rng.random()) / len(group)
+            keys.append((key, group[position]))
+    keys.sort(key=lambda k: k[0])
+    return [pdb_id for _, pdb_id in keys]
+
+
+def rounds_of(pdb_ids, round_size):
+    """ splits :pdb_ids: into consecutive rounds of :round_size: """
+    if not round_size:
+        return [list(pdb_ids)]
+    return [list(pdb_ids[i:i + round_size]) for i in range(0, len(pdb_ids), round_size)]
+
+
+def wilson_interval(successes, n, z=Z):
+    """ Wilson score intervals of binomial proportions, vectorized.
+
+        Returns (lower, upper); np.nan where n == 0
+    """
+    successes = np.asarray(successes, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = successes / n
+        denominator = 1 + z ** 2 / n
+        center = (p + z ** 2 / (2 * n)) / denominator
+        half = z / denominator * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+    return center - half, center + half
+
+
+class ContactFrequencies():
+    '''
+        Per structure (key atom, interaction label) contact frequencies and
+            their confidence intervals, updated as structures are analyzed.
+
+        Pockets of the same PDB entry can be added separately; they're counted
+            as one structure.
+    '''
+
+    def __init__(self, z=Z):
+        self.z = z
+        self._seen = {}     # PDB ID -> set of (key atom, interaction label)
+
+    @property
+    def structures(self):
+        return len(self._seen)
+
+    def update(self, pdb_id, contacts):
+        """ adds the labelled :contacts: of (part of) the structure :pdb_id: """
+        pairs = self._seen.setdefault(pdb_id, set())
+        if len(contacts):
+            pairs.update(zip(contacts['key_atom_name'].values,
+                             contacts['interaction_label'].values.tolist()))
+
+    def intervals(self):
+        """ pandas.DataFrame of key_atom_name, interaction_label, structures
+            (with at least one such contact), frequency, lower, upper and
+            width, widest interval first
+        """
+        counts = {}
+        for pairs in self._seen.values():
+            for pair in pairs:
+                counts[pair] = counts.get(pair, 0) + 1
+        rows = [list(pair) + [count] for pair, count in counts.items()]
+        table = pd.DataFrame(rows, columns=['key_atom_name', 'interaction_label', 'structures'])
+        n = self.structures
+        lower, upper = wilson_interval(table['structures'].values, np.full(len(table), n), self.z)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table['frequency'] = table['structures'].values / float(n)
+        table['lower'] = lower
+        table['upper'] = upper
+        table['width'] = upper - lower
+        return table.sort_values(by=['width', 'key_atom_name'], ascending=[False, True]) \
+            .reset_index(drop=True)
+
+    def max_width(self):
+        """ width of the widest interval, np.inf before anything was found """
+        table = self.intervals()
+        if not len(table):
+            return np.inf
+        return table['width'].max()
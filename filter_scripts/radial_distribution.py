@@ -0,0 +1,223 @@
+'''
+    radial_distribution.py
+        Radial distribution profiles, g(r), between every isoalloxazine ring
+            atom and every protein chemical code over the whole corpus.
+
+        Rather than throwing away everything outside of the vdW window like
+            find_contacts does, every pair distance up to a cutoff is binned
+            into a dense (ring atom x chemical code x distance bin) array in
+            one vectorized pass per structure. Histograms only hold counts so
+            they can be saved per run (or per shard) and merged exactly:
+
+            python radial_distribution.py merged.rdf.npz shard_1.rdf.npz shard_2.rdf.npz ...
+
+        Chemical codes are the ones in protein_atom_chemical_codes_v1.txt;
+            atoms without a code are counted under code 0.
+'''
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import FLAVINS, pairs_within
+
+CHEMICAL_CODES = './protein_atom_chemical_codes_v1.txt'
+
+# all 18 atoms of the isoalloxazine, in the order of the histogram's first axis;
+#  spelled out since dict order isn't stable between python 3.5 processes
+RING_ATOMS = ['N1', 'C2', 'O2', 'N3', 'C4', 'O4', 'C4X', 'N5', 'C5X', 'C6', 'C7',
+              'C7M', 'C8', 'C8M', 'C9', 'C9A', 'N10', 'C10']
+
+# residue names in the chemical code file that aren't residue names
+_ANY_RESIDUE = 'Last residue'
+_LIGAND_RESIDUES = 'FMN or FAD'
+
+
+def load_chemical_codes(path=CHEMICAL_CODES):
+    """ parses protein_atom_chemical_codes_v1.txt into a dict of
+        (residue name, atom name) -> chemical code
+
+        Codes that apply to every residue (eg. OXT on the last residue) are
+        stored under the residue name None.
+    """
+    with open(path) as f:
+        text = f.read().replace('\r\n', '\n').replace('\r', '\n')
+    codes = {}
+    residue = None
+    for line in text.split('\n')[1:]:
+        fields = line.split('\t')
+        values = [f.strip() for f in fields if f.strip()]
+        if len(values) < 2:
+            continue
+        if fields[0].strip():
+            residue = fields[0].strip()
+        atom, code = values[-2], int(values[-1])
+        if residue == _ANY_RESIDUE:
+            codes[(None, atom)] = code
+        elif residue == _LIGAND_RESIDUES:
+            for ligand in FLAVINS:
+                codes[(ligand, atom)] = code
+        else:
+            codes[(residue, atom)] = code
+    return codes
+
+
+def chemical_code_array(atom_names, residue_names, codes):
+    """ chemical code of every atom, 0 for atoms without one """
+    out = np.zeros(len(atom_names), dtype=np.int64)
+    for i, pair in enumerate(zip(residue_names, atom_names)):
+        out[i] = codes.get(pair, codes.get((None, pair[1]), 0))
+    return out
+
+
+class RadialHistogram():
+    '''
+        Counts of (ring atom, chemical code, distance bin) over a corpus.
+
+        :counts: int64 array of shape (len(RING_ATOMS), n_codes, n_bins)
+        :references: int64 array with the number of times each ring atom
+            was seen, which is what the profiles are normalized by
+
+        Usage:
+            hist = RadialHistogram(cutoff=10.0, bin_width=0.1)
+            for each structure:
+                hist.update(structure)
+            hist.save('run.rdf.npz')
+            g = hist.g()        # (ring atom, code, bin)
+    '''
+
+    def __init__(self, cutoff=10.0, bin_width=0.1, codes=None, ligands=FLAVINS):
+        self.codes = codes if codes is not None else load_chemical_codes()
+        self.ligands = list(ligands)
+        n_codes = max(self.codes.values()) + 1
+        n_bins = int(np.ceil(cutoff / bin_width - 1e-9))
+        self.edges = np.arange(n_bins + 1) * bin_width
+        self.counts = np.zeros((len(RING_ATOMS), n_codes, n_bins), dtype=np.int64)
+        self.references = np.zeros(len(RING_ATOMS), dtype=np.int64)
+
+    @property
+    def cutoff(self):
+        return self.edges[-1]
+
+    @property
+    def bin_width(self):
+        return self.edges[1] - self.edges[0]
+
+    def update(self, structure):
+        """ bins every (ring atom, other atom) distance under the cutoff
+
+            :structure: pandas.DataFrame of atoms in biopandas format. Atoms
+                in the ring atom's own residue are left out.
+        """
+        names = structure['atom_name'].values
+        residue_names = structure['residue_name'].values
+        ring_index = pd.Series(range(len(RING_ATOMS)), index=RING_ATOMS)
+        is_ring = structure['residue_name'].isin(self.ligands).values & \
+            structure['atom_name'].isin(RING_ATOMS).values
+        rings = np.nonzero(is_ring)[0]
+        if not len(rings):
+            return
+        slot = ring_index[names[rings]].values
+        self.references += np.bincount(slot, minlength=len(RING_ATOMS))
+
+        # chain + residue number identifies a residue within the structure
+        residue_ids = pd.factorize(structure['chain_id'].astype(str) + ':' +
+                                   structure['residue_number'].astype(str))[0]
+        xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+        k, a, dist = pairs_within(xyz[rings], xyz, self.cutoff)
+        keep = (dist < self.cutoff) & (residue_ids[a] != residue_ids[rings[k]])
+        k, a, dist = k[keep], a[keep], dist[keep]
+
+        code = chemical_code_array(names[a], residue_names[a], self.codes)
+        bins = np.minimum((dist / self.bin_width).astype(np.int64), self.counts.shape[2] - 1)
+        n_codes, n_bins = self.counts.shape[1:]
+        flat = (slot[k] * n_codes + code) * n_bins + bins
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """ adds :other:'s counts into this one, returns self """
+        if self.counts.shape != other.counts.shape or not np.allclose(self.edges, other.edges):
+            raise ValueError("can't merge histograms with different codes or bins")
+        self.counts += other.counts
+        self.references += other.references
+        return self
+
+    def shell_volumes(self):
+        """ volume (cubic angstroms) of the spherical shell of every bin """
+        return 4.0 / 3.0 * np.pi * np.diff(self.edges ** 3)
+
+    def density(self):
+        """ number density (atoms per cubic angstrom) of each chemical code in
+            each shell around each ring atom, averaged over every time the
+            ring atom was seen
+        """
+        seen = np.maximum(self.references, 1)[:, None, None]
+        return self.counts / (seen * self.shell_volumes()[None, None, :])
+
+    def g(self, bulk_from=None):
+        """ radial distribution functions: density() normalized by the mean
+            density at long range (from :bulk_from: angstroms to the cutoff,
+            by default the outer 20% of the range) so that g -> 1 far from
+            the ring
+        """
+        if bulk_from is None:
+            bulk_from = 0.8 * self.cutoff
+        density = self.density()
+        tail = self.edges[:-1] >= bulk_from
+        bulk = density[:, :, tail].mean(axis=2, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(bulk > 0, density / bulk, np.nan)
+
+    def to_frame(self):
+        """ long form pandas.DataFrame of the non-empty bins """
+        ring, code, bins = np.nonzero(self.counts)
+        volumes = self.shell_volumes()
+        return pd.DataFrame({
+            'ring_atom': np.array(RING_ATOMS)[ring],
+            'chemical_code': code,
+            'r_lower': self.edges[bins],
+            'r_upper': self.edges[bins + 1],
+            'count': self.counts[ring, code, bins],
+            'density': self.density()[ring, code, bins],
+            'shell_volume': volumes[bins],
+        }, columns=['ring_atom', 'chemical_code', 'r_lower', 'r_upper', 'count',
+                    'density', 'shell_volume'])
+
+    def save(self, path):
+        np.savez_compressed(path, counts=self.counts, references=self.references,
+                            edges=self.edges, ring_atoms=np.array(RING_ATOMS),
+                            ligands=np.array(self.ligands),
+                            code_keys=np.array([[str(r), a] for r, a in sorted(self.codes, key=str)]),
+                            code_values=np.array([self.codes[k] for k in sorted(self.codes, key=str)]))
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        if list(data['ring_atoms']) != RING_ATOMS:
+            raise ValueError(path + " was binned over different ring atoms")
+        codes = {}
+        for (residue, atom), value in zip(data['code_keys'], data['code_values']):
+            codes[(None if residue == 'None' else str(residue), str(atom))] = int(value)
+        hist = RadialHistogram(codes=codes, ligands=[str(l) for l in data['ligands']])
+        hist.edges = data['edges']
+        hist.counts = data['counts']
+        hist.references = data['references']
+        return hist
+
+    @staticmethod
+    def combine(paths):
+        """ merges the saved histograms at every path in :paths: """
+        total = None
+        for path in paths:
+            hist = RadialHistogram.load(path)
+            total = hist if total is None else total.merge(hist)
+        return total
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import sys
+    from radial_distribution import RadialHistogram
+    if len(sys.argv) < 3:
+        raise ValueError("Usage: python radial_distribution.py <merged.rdf.npz> <shard.rdf.npz> ...")
+    merged = RadialHistogram.combine(sys.argv[2:])
+    merged.save(sys.argv[1])
+    print("merged", int(merged.counts.sum()), "pairs around", int(merged.references.sum()), "ring atoms")
@@ -0,0 +1,188 @@
+'''
+    result_cache.py
+        On disk memoization of the per structure stages in get_sample.py
+
+        Results are keyed by a hash of the structure's coordinate content plus
+            a fingerprint of every setting the stage depends on, so a cached
+            result can never be stale: change the tolerance, a vdW radius or
+            an interaction label and the key changes with it. Since the
+            labelling stage's key is built on top of the geometry stage's key,
+            changing only the labels still reuses the cached geometry.
+
+        The cache directory is bounded in size; when it grows past
+            <max_bytes> the least recently used entries are evicted until it's
+            back under LOW_WATER of that, so the directory is only walked once
+            every so many writes.
+'''
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# columns that define a structure's content for structure_fingerprint
+_STRUCTURE_COLUMNS = ['atom_number', 'atom_name', 'alt_loc', 'residue_name', 'chain_id',
+                      'residue_number', 'insertion']
+
+# fraction of max_bytes eviction brings the cache back down to
+LOW_WATER = 0.9
+
+
+def _canonical(value):
+    """ a deterministic text representation of (nested) settings """
+    if isinstance(value, dict):
+        return '{' + ','.join(_canonical(k) + ':' + _canonical(value[k])
+                              for k in sorted(value, key=str)) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_canonical(v) for v in value) + ']'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ','.join(sorted(_canonical(v) for v in value)) + '}'
+    if isinstance(value, pd.DataFrame):
+        return _canonical([list(value.columns)] + value.values.tolist())
+    if isinstance(value, np.ndarray):
+        return _canonical(value.tolist())
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+    if isinstance(value, np.integer):
+        return repr(int(value))
+    return repr(value)
+
+
+def settings_fingerprint(**settings):
+    """ sha1 hex digest of the keyword arguments, independent of their order
+
+        Values can be any mix of numbers, strings, lists, dicts, sets, numpy
+            arrays and pandas.DataFrames (eg. the interaction label table).
+    """
+    return hashlib.sha1(_canonical(settings).encode('utf-8')).hexdigest()
+
+
+def structure_fingerprint(structure):
+    """ sha1 hex digest of a structure's coordinates and atom identities
+
+        :structure: pandas.DataFrame of atoms in biopandas format
+    """
+    digest = hashlib.sha1()
+    xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    digest.update(np.ascontiguousarray(xyz).tobytes())
+    for column in _STRUCTURE_COLUMNS:
+        if column in structure:
+            digest.update(column.encode('utf-8'))
+            digest.update('\x00'.join(str(v) for v in structure[column].values).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def combine_keys(*parts):
+    """ hashes several fingerprints (or any strings) into a single key """
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache():
+    '''
+        A size bounded, least recently used, pickle cache on disk.
+
+        Entries live at <directory>/<stage>/<key>.pkl. Reading an entry bumps
+            its modification time, which is what eviction orders by, so
+            several processes can safely share a cache directory.
+
+        :size: bytes in the cache as far as this process knows: one scan of
+            the directory when it's opened plus everything it wrote since.
+            Eviction rescans, so writes by other processes are counted then.
+
+        Usage:
+            cache = ResultCache('./.cache', max_bytes=2 ** 30)
+            contacts = cache.memoize('geometry', key, lambda: find_contacts(...))
+    '''
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, key + '.pkl')
+
+    def get(self, stage, key):
+        """ returns the cached value or None if there isn't one """
+        path = self._path(stage, key)
+        try:
+            value = pd.read_pickle(path)
+        except (IOError, OSError, EOFError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            # evicted by someone else in the mean time, we still have the value
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, stage, key, value):
+        path = self._path(stage, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # write then rename so readers never see half of an entry
+        temp = path + '.' + str(os.getpid()) + '.tmp'
+        pd.to_pickle(value, temp)
+        size = os.path.getsize(temp)
+        if os.path.exists(path):
+            try:
+                self.size -= os.path.getsize(path)
+            except OSError:
+                pass
+        os.rename(temp, path)
+        self.size += size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def memoize(self, stage, key, compute):
+        """ returns the cached value for (:stage:, :key:), computing and storing
+            it with :compute: (a callable with no arguments) on a miss
+        """
+        value = self.get(stage, key)
+        if value is None:
+            value = compute()
+            self.put(stage, key, value)
+        return value
+
+    def entries(self):
+        """ list of (last used, size in bytes, path) of every cached entry """
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.pkl'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                found.append((info.st_mtime, info.st_size, path))
+        return found
+
+    def evict(self):
+        """ removes least recently used entries until the cache is back under
+            LOW_WATER of max_bytes, if it's past max_bytes; returns the number
+            of entries removed
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * LOW_WATER if total > self.max_bytes else self.max_bytes
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.size = total
+        return removed
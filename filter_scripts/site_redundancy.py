@@ -0,0 +1,277 @@
+'''
+    site_redundancy.py
+        Finds flavin sites that are (near) identical so they're only analyzed
+            once: series of entries of the same protein (eg. 1grb, 1gre, 1grf,
+            ...) and homo-oligomers where the same pocket shows up once per
+            chain.
+
+        Every site gets a profile: the residues lining the ring (closest atom
+            within SHELL angstroms of a ring atom, waters excluded) with the
+            distance from the ring centroid to the closest atom of each. None
+            of it depends on the frame, chain names or numbering of the entry.
+
+        Two sites are the same when they're lined by the same residue types
+            and their distances are all within TOLERANCE angstroms of each
+            other; groups are the sites linked that way (single linkage). The
+            residue composition is hashed (the site's fingerprint) so only
+            sites in the same bucket are ever compared. A residue within
+            MARGIN of the edge of the shell may be in or out of a slightly
+            perturbed copy of the site, so every site is put in the bucket of
+            each composition with and without its edge residues.
+
+        Only the first site of each group (its representative) is analyzed
+            and its results are fanned back out to every member, tagged with
+            the group and a 1 / group size weight so statistics can be
+            corrected for redundancy.
+'''
+
+import hashlib
+import itertools
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import FLAVINS, pairs_within
+from isoalloxazine_frames import ATOM_ALIASES, FRAME_ATOMS
+
+# residues with an atom within this many angstroms of a ring atom line the site
+SHELL = 4.5
+# largest difference (angstroms) between the residue distances of two sites
+#  that are still the same site
+TOLERANCE = 1.0
+# residues this close (angstroms) to the edge of the shell may be in or out
+MARGIN = 0.5
+# at most this many edge residues are toggled (2 ** EDGE_LIMIT buckets a site)
+EDGE_LIMIT = 4
+
+# not part of what makes two sites the same
+_IGNORED_RESIDUES = ['HOH']
+
+MEMBERSHIP_COLUMNS = ['site', 'PDB_ID', 'chain_id', 'residue_number', 'residue_name',
+                      'fingerprint', 'site_group', 'representative', 'group_size',
+                      'site_weight']
+PROFILE_COLUMNS = ['chain_id', 'residue_number', 'residue_name', 'approach', 'distance']
+
+
+def _composition(flavin, names):
+    """ sha1 hex digest of a flavin and the residue names lining it """
+    canonical = str(flavin) + '|' + ';'.join(str(name) for name in names)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def site_profile(pocket, instance, ligands=FLAVINS, shell=SHELL, margin=MARGIN):
+    """ The fingerprint and profile of the flavin site :instance:
+        ((chain_id, residue_number)) of :pocket:, see the module docstring.
+
+        Returns (fingerprint, profile): the hashed residue composition of the
+            site and a pandas.DataFrame of PROFILE_COLUMNS, one row per
+            residue with its closest atom within :shell: + :margin: of a ring
+            atom (:approach:), sorted by residue name then distance to the
+            ring centroid. (None, None) if the flavin has no ring atoms in
+            :pocket:.
+    """
+    chain_id, residue_number = instance
+    chains = pocket['chain_id'].values
+    numbers = pocket['residue_number'].values
+    residues = pocket['residue_name'].values
+    names = pocket['atom_name'].replace(ATOM_ALIASES)
+    own = (chains == chain_id) & (numbers == residue_number) & \
+        pocket['residue_name'].isin(ligands).values
+    ring = np.nonzero(own & names.isin(FRAME_ATOMS).values)[0]
+    if not len(ring):
+        return None, None
+
+    xyz = pocket[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    others = np.nonzero(~own & ~pocket['residue_name'].isin(_IGNORED_RESIDUES).values)[0]
+    _, near, dist = pairs_within(xyz[ring], xyz[others], shell + margin)
+    close = dist < shell + margin
+    near, dist = others[near[close]], dist[close]
+
+    centroid = xyz[ring].mean(axis=0)
+    site = pd.DataFrame({'chain_id': chains[near], 'residue_number': numbers[near],
+                         'residue_name': residues[near], 'approach': dist,
+                         'distance': np.linalg.norm(xyz[near] - centroid, axis=1)})
+    profile = site.groupby(['chain_id', 'residue_number', 'residue_name']) \
+        .agg({'approach': 'min', 'distance': 'min'}).reset_index() \
+        .sort_values(by=['residue_name', 'distance'])
+    profile = profile[PROFILE_COLUMNS].reset_index(drop=True)
+    lining = profile['residue_name'].values[profile['approach'].values < shell]
+    return _composition(residues[ring[0]], lining), profile
+
+
+def composition_buckets(flavin, profile, shell=SHELL, margin=MARGIN, limit=EDGE_LIMIT):
+    """ generates (fingerprint, rows) of every composition a slightly perturbed
+        copy of the site could have: the residues within :shell: of the ring
+        with any of the (at most :limit:) residues within :margin: of the
+        edge of the shell toggled in or out. :rows: is a boolean mask over
+        :profile:.
+    """
+    approach = profile['approach'].values
+    inside = approach < shell
+    edge = np.nonzero(np.abs(approach - shell) < margin)[0]
+    edge = edge[np.argsort(np.abs(approach[edge] - shell), kind='mergesort')][:limit]
+    names = profile['residue_name'].values
+    for toggled in itertools.product([False, True], repeat=len(edge)):
+        rows = inside.copy()
+        rows[edge[list(toggled)]] = ~rows[edge[list(toggled)]]
+        yield _composition(flavin, names[rows]), rows
+
+
+def same_site(distances, others, tolerance=TOLERANCE):
+    """ whether two distance profiles over the same residue types (in the
+        same order) are within :tolerance: angstroms of each other
+    """
+    return len(distances) == 0 or np.abs(distances - others).max() <= tolerance
+
+
+def group_sites(sites, profiles, tolerance=TOLERANCE, shell=SHELL, margin=MARGIN):
+    """ Groups near-identical sites.
+
+        :sites: pandas.DataFrame with (at least) PDB_ID, chain_id,
+            residue_number, residue_name and fingerprint columns, one row per
+            site
+        :profiles: the profile of every row of :sites: (see site_profile)
+        Sites sharing a composition bucket (see composition_buckets) are
+            linked when their distances over that composition are within
+            :tolerance: (see same_site) and groups are the linked sites
+            (single linkage). Sites without a fingerprint are each their own
+            group.
+        Returns a pandas.DataFrame of MEMBERSHIP_COLUMNS, one row per site;
+            :representative: is the site (row of :sites:) analyzed for the
+            whole group.
+    """
+    membership = sites.reset_index(drop=True).copy()
+    membership['site'] = np.arange(len(membership))
+    buckets = defaultdict(list)
+    for i in membership['site'].values[membership['fingerprint'].notnull().values]:
+        distances = profiles[i]['distance'].values
+        for key, rows in composition_buckets(membership['residue_name'].values[i], profiles[i],
+                                             shell, margin):
+            buckets[key].append((i, distances[rows]))
+
+    # union-find over the sites, the root of a group being its first site
+    parent = list(range(len(membership)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for bucket in buckets.values():
+        for n, (i, distances) in enumerate(bucket):
+            for j, others in bucket[:n]:
+                if root(i) != root(j) and same_site(distances, others, tolerance):
+                    first, other = sorted([root(i), root(j)])
+                    parent[other] = first
+
+    first = np.array([root(i) for i in range(len(membership))], dtype=np.int64)
+    group, _ = pd.factorize(first)
+    membership['site_group'] = group
+    membership['representative'] = first
+    membership['group_size'] = pd.Series(group).groupby(group).transform('size').values
+    membership['site_weight'] = 1.0 / membership['group_size']
+    return membership[MEMBERSHIP_COLUMNS]
+
+
+def residue_correspondence(profile, other, tolerance=TOLERANCE):
+    """ {(chain_id, residue_number) of :profile: -> (chain_id, residue_number)
+        of :other:}, pairing residues of the same type by closest distance
+        to the ring centroid (at most :tolerance: apart)
+    """
+    pairs = []
+    for name, mine in profile.groupby('residue_name'):
+        theirs = other[other['residue_name'] == name]
+        delta = np.abs(mine['distance'].values[:, None] - theirs['distance'].values[None, :])
+        a, b = np.nonzero(delta <= tolerance)
+        for k in np.argsort(delta[a, b], kind='mergesort'):
+            pairs.append((delta[a[k], b[k]], mine.index[a[k]], theirs.index[b[k]]))
+    mapping, taken = {}, set()
+    for _, i, j in sorted(pairs):
+        if i in mapping or j in taken:
+            continue
+        mapping[i] = j
+        taken.add(j)
+    return dict(((profile['chain_id'][i], profile['residue_number'][i]),
+                 (other['chain_id'][j], other['residue_number'][j])) for i, j in mapping.items())
+
+
+def map_contacts(contacts, instance, pocket, member, residues):
+    """ Moves :contacts: of the flavin :instance: ((chain_id, residue_number))
+        onto the flavin :member: of :pocket: (another site of its group).
+
+        Target residues are moved through :residues: (see
+            residue_correspondence), the flavin onto the member and anything
+            else on the flavin's chain is shifted by the flavin's change in
+            numbering; atoms are then looked up by atom name in :pocket:.
+            Atom numbers of atoms that aren't there (and residue numbers of
+            targets whose residue isn't there) are set to -1.
+    """
+    residues = dict(residues)
+    residues[tuple(instance)] = tuple(member)
+    offset = member[1] - instance[1]
+    atoms = dict((key, (number, name)) for key, number, name in zip(
+        zip(pocket['chain_id'].values, pocket['residue_number'].values,
+            pocket['atom_name'].values),
+        pocket['atom_number'].values, pocket['residue_name'].values))
+    present = set(key[:2] for key in atoms)
+
+    mapped = contacts.copy()
+    mapped['key_atom_chain_id'] = member[0]
+    mapped['key_atom_residue_number'] = member[1]
+    mapped['key_atom_number'] = [atoms.get((member[0], member[1], name), (-1, None))[0]
+                                 for name in contacts['key_atom_name'].values]
+
+    chains, numbers, atom_numbers = [], [], []
+    for chain, number, name, residue in zip(contacts['target_atom_chain_id'].values,
+                                            contacts['target_atom_residue_number'].values,
+                                            contacts['target_atom_name'].values,
+                                            contacts['target_atom_residue'].values):
+        if (chain, number) in residues:
+            chain, number = residues[(chain, number)]
+        elif chain == instance[0]:
+            chain, number = member[0], number + offset
+        atom_number, residue_name = atoms.get((chain, number, name), (-1, None))
+        if residue_name != residue:
+            atom_number = -1
+            if (chain, number) not in present:
+                number = -1
+        chains.append(chain)
+        numbers.append(number)
+        atom_numbers.append(atom_number)
+    mapped['target_atom_chain_id'] = chains
+    mapped['target_atom_residue_number'] = numbers
+    mapped['target_atom_number'] = atom_numbers
+    for column in ['key_atom_number', 'target_atom_number', 'target_atom_residue_number']:
+        mapped[column] = mapped[column].astype(contacts[column].dtype)
+    return mapped
+
+
+def fan_out(contacts, membership, representative, pockets, profiles, tolerance=TOLERANCE):
+    """ Copies the :contacts: found for the site :representative: to every
+        member of its group.
+
+        :pockets: maps every other member (its site) to its pocket
+        :profiles: the profile of every site (see site_profile)
+        Each copy is moved onto its member (see map_contacts) and gets the
+            member's PDB_ID, plus the site_group and site_weight columns.
+    """
+    members = membership[membership['representative'] == representative]
+    own = membership.iloc[representative]
+    instance = (own['chain_id'], own['residue_number'])
+    copies = []
+    for _, member in members.iterrows():
+        if member['site'] == representative:
+            copy = contacts.copy()
+        else:
+            residues = residue_correspondence(profiles[representative], profiles[member['site']],
+                                              tolerance)
+            copy = map_contacts(contacts, instance, pockets[member['site']],
+                                (member['chain_id'], member['residue_number']), residues)
+        copy['PDB_ID'] = member['PDB_ID']
+        copy['site_group'] = member['site_group']
+        copy['site_weight'] = member['site_weight']
+        copies.append(copy)
+    if not copies:
+        return contacts.iloc[:0]
+    return pd.concat(copies, ignore_index=True)
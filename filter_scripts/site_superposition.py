@@ -0,0 +1,296 @@
+'''
+    site_superposition.py
+        Structural comparison of every flavin site against every other one.
+
+        Every site is reduced to two (18, 3) arrays, stacked over all sites:
+            rings:   the 18 isoalloxazine atoms (RING_ATOMS)
+            pockets: for every ring atom, the centroid of the closest protein
+                     residue (any atom within SHELL angstroms), which gives
+                     pocket residues a fixed correspondence between sites
+        with masks for atoms/residues that are missing.
+
+        All sites are superposed onto a reference ring with one batched,
+            weighted Kabsch fit over the (n, 18, 3) stack; the pockets are
+            carried along with the same rotations. Since every site then
+            sits in the same frame, pocket RMSD between two sites needs no
+            further fitting and the all vs all matrix reduces to matrix
+            products (|a - b|^2 = |a|^2 + |b|^2 - 2 a.b), computed in square
+            tiles of at most block x block sites so memory stays bounded.
+
+        Output is either
+            - the condensed matrix (float32, scipy.spatial.distance.squareform
+              order) that scipy.cluster.hierarchy.linkage takes directly, or
+            - the :top_k: closest sites of every site (indices and RMSDs)
+
+        Usage:
+            python site_superposition.py <pocket library> <output.npy> [--top-k K]
+'''
+
+import numpy as np
+import pandas as pd
+from flavin_contacts import FLAVINS, pairs_within
+from isoalloxazine_frames import ring_coordinates
+from radial_distribution import RING_ATOMS
+
+# protein atoms within this many angstroms of a ring atom can be its pocket slot
+SHELL = 6.0
+
+# sites per side of the square tiles the RMSD matrix is computed in
+BLOCK = 1024
+
+# not part of the pocket
+_IGNORED_RESIDUES = ['HOH']
+
+
+def site_arrays(structure, instance, ligands=FLAVINS, shell=SHELL):
+    """ (ring, pocket) arrays of shape (len(RING_ATOMS), 3) of the flavin
+        :instance: ((chain_id, residue_number)) of :structure:, np.nan where
+        a ring atom is missing or has no protein atom within :shell:
+    """
+    chain_id, residue_number = instance
+    own = (structure['chain_id'].values == chain_id) & \
+        (structure['residue_number'].values == residue_number)
+    instances, coords = ring_coordinates(structure[own], ligands, RING_ATOMS)
+    ring = coords[0] if len(instances) else np.full((len(RING_ATOMS), 3), np.nan)
+    pocket = np.full((len(RING_ATOMS), 3), np.nan)
+
+    protein = structure[~own & ~structure['residue_name'].isin(list(ligands) + _IGNORED_RESIDUES).values]
+    present = np.nonzero(~np.isnan(ring).any(axis=1))[0]
+    if not len(protein) or not len(present):
+        return ring, pocket
+    xyz = protein[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    residues = pd.factorize(protein['chain_id'].astype(str) + ':' +
+                            protein['residue_number'].astype(str))[0]
+    counts = np.bincount(residues)
+    centroids = np.stack([np.bincount(residues, xyz[:, d]) for d in range(3)], axis=1) / counts[:, None]
+
+    k, a, dist = pairs_within(ring[present], xyz, shell)
+    keep = dist < shell
+    k, a, dist = k[keep], a[keep], dist[keep]
+    if not len(k):
+        return ring, pocket
+    # closest atom of every ring atom: sort by (ring atom, distance), first of each
+    order = np.lexsort((dist, k))
+    first = order[np.r_[True, k[order][1:] != k[order][:-1]]]
+    pocket[present[k[first]]] = centroids[residues[a[first]]]
+    return ring, pocket
+
+
+def stack_sites(sites, ligands=FLAVINS, shell=SHELL):
+    """ Stacks the arrays of many sites.
+
+        :sites: iterable of (provenance, structure) as generated by
+            PocketLibrary.pockets (provenance needs PDB_ID, chain_id,
+            residue_number and residue_name)
+        Returns (provenance, rings, pockets): a pandas.DataFrame with one row
+            per site and two arrays of shape (n, len(RING_ATOMS), 3)
+    """
+    provenance, rings, pockets = [], [], []
+    for info, structure in sites:
+        ring, pocket = site_arrays(structure, (info['chain_id'], info['residue_number']),
+                                   ligands, shell)
+        provenance.append(info)
+        rings.append(ring)
+        pockets.append(pocket)
+    if not rings:
+        empty = np.zeros((0, len(RING_ATOMS), 3))
+        return pd.DataFrame(provenance), empty, empty.copy()
+    return pd.DataFrame(provenance), np.stack(rings), np.stack(pockets)
+
+
+def kabsch(mobile, reference, weights=None):
+    """ Batched, weighted Kabsch fit of every (m, 3) set in :mobile: onto
+        :reference:.
+
+        :mobile: array of shape (n, m, 3); np.nan rows are left out
+        :reference: array of shape (m, 3)
+        :weights: *Optional* array of shape (n, m) or (m,)
+        Returns (rotations, translations, rmsd) of shapes (n, 3, 3), (n, 3)
+            and (n,) such that mobile[i] @ rotations[i].T + translations[i]
+            is the best fit onto the reference. Sets with fewer than 3 points
+            get np.nan.
+    """
+    present = ~np.isnan(mobile).any(axis=2) & ~np.isnan(reference).any(axis=1)[None, :]
+    w = np.ones(present.shape) if weights is None else np.broadcast_to(weights, present.shape)
+    w = np.where(present, w, 0.0)
+    total = w.sum(axis=1)
+    x = np.where(present[:, :, None], mobile, 0.0)
+    y = np.where(present, 1.0, 0.0)[:, :, None] * np.nan_to_num(reference)[None, :, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_center = (w[:, :, None] * x).sum(axis=1) / total[:, None]
+        y_center = (w[:, :, None] * y).sum(axis=1) / total[:, None]
+    x = np.where(present[:, :, None], x - x_center[:, None, :], 0.0)
+    y = np.where(present[:, :, None], y - y_center[:, None, :], 0.0)
+
+    # covariance, its SVD and the reflection fix, all at once
+    covariance = np.einsum('nm,nmi,nmj->nij', w, x, y)
+    degenerate = (present.sum(axis=1) < 3) | ~np.isfinite(covariance).all(axis=(1, 2))
+    covariance[degenerate] = np.eye(3)
+    u, _, vt = np.linalg.svd(covariance)
+    d = np.sign(np.linalg.det(np.einsum('nji,nkj->nik', vt, u)))
+    d[d == 0] = 1.0
+    u[:, :, 2] *= d[:, None]
+    rotations = np.einsum('nji,nkj->nik', vt, u)
+    translations = y_center - np.einsum('nij,nj->ni', rotations, x_center)
+
+    fitted = np.einsum('nij,nmj->nmi', rotations, x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rmsd = np.sqrt((w * ((fitted - y) ** 2).sum(axis=2)).sum(axis=1) / total)
+    rotations[degenerate] = np.nan
+    translations[degenerate] = np.nan
+    rmsd[degenerate] = np.nan
+    return rotations, translations, rmsd
+
+
+def apply_fit(points, rotations, translations):
+    """ moves :points: (n, m, 3) with the fits returned by kabsch """
+    return np.einsum('nij,nmj->nmi', rotations, points) + translations[:, None, :]
+
+
+def reference_ring(rings, iterations=2):
+    """ a reference to superpose :rings: onto: the mean of the rings after
+        fitting them to the most complete one, refined :iterations: times
+    """
+    counts = (~np.isnan(rings).any(axis=2)).sum(axis=1)
+    reference = rings[np.argmax(counts)]
+    for _ in range(iterations):
+        rotations, translations, _ = kabsch(rings, reference)
+        fitted = apply_fit(rings, rotations, translations)
+        mean = np.nanmean(fitted, axis=0)
+        reference = np.where(np.isnan(mean), reference, mean)
+        reference = reference - np.nanmean(reference, axis=0)
+    return reference
+
+
+def superpose(rings, pockets, reference=None):
+    """ Superposes every site onto :reference: (by default reference_ring)
+        by its ring, carrying the pocket along.
+
+        Returns (rings, pockets, rmsd): the moved arrays and the ring RMSD
+            of every site to the reference
+    """
+    if reference is None:
+        reference = reference_ring(rings)
+    rotations, translations, rmsd = kabsch(rings, reference)
+    return apply_fit(rings, rotations, translations), \
+        apply_fit(pockets, rotations, translations), rmsd
+
+
+def _flatten(points):
+    """ masked, flattened coordinates, squared norms and masks of :points: """
+    mask = ~np.isnan(points).any(axis=2)
+    filled = np.where(mask[:, :, None], points, 0.0)
+    return filled.reshape(len(points), -1), (filled ** 2).sum(axis=2), mask.astype(np.float64)
+
+
+def rmsd_tile(left, right):
+    """ RMSD between every site of :left: and every site of :right: (both
+        _flatten()ed, already superposed), over the slots present in both.
+        Pairs without a shared slot get np.nan.
+    """
+    a, a_squared, a_mask = left
+    b, b_squared, b_mask = right
+    squared = a_squared.dot(b_mask.T) + a_mask.dot(b_squared.T) - 2.0 * a.dot(b.T)
+    shared = a_mask.dot(b_mask.T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(shared > 0, np.sqrt(np.maximum(squared, 0.0) / shared), np.nan)
+
+
+def _tiles(n, block):
+    return [(start, min(start + block, n)) for start in range(0, n, block)]
+
+
+def condensed_rmsd(points, block=BLOCK, out=None):
+    """ All vs all RMSD of the superposed :points: (n, m, 3) as a condensed
+        float32 matrix of length n * (n - 1) / 2 in
+        scipy.spatial.distance.squareform order.
+
+        :out: *Optional* array (eg. a numpy.memmap) to write into, for
+            corpora where the matrix itself doesn't fit in memory
+    """
+    n = len(points)
+    if out is None:
+        out = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    flat = _flatten(points)
+    tiles = _tiles(n, block)
+    for i, (i0, i1) in enumerate(tiles):
+        left = tuple(f[i0:i1] for f in flat)
+        for j0, j1 in tiles[i:]:
+            tile = rmsd_tile(left, tuple(f[j0:j1] for f in flat))
+            for row in range(i0, i1):
+                start = max(j0, row + 1)
+                if start >= j1:
+                    continue
+                # offset of (row, start) in the condensed matrix
+                offset = n * row - row * (row + 1) // 2 + start - row - 1
+                out[offset:offset + j1 - start] = tile[row - i0, start - j0:]
+    return out
+
+
+def top_k_rmsd(points, k, block=BLOCK):
+    """ The :k: sites closest to every site (itself excluded) by RMSD of the
+        superposed :points:.
+
+        Returns (neighbours, rmsd): arrays of shape (n, k), closest first;
+            sites with fewer than k others are padded with -1 / np.nan
+    """
+    n = len(points)
+    flat = _flatten(points)
+    neighbours = np.full((n, k), -1, dtype=np.int64)
+    best = np.full((n, k), np.nan, dtype=np.float32)
+    for i0, i1 in _tiles(n, block):
+        left = tuple(f[i0:i1] for f in flat)
+        kept_index = np.full((i1 - i0, k), -1, dtype=np.int64)
+        kept = np.full((i1 - i0, k), np.inf)
+        rows = np.arange(i1 - i0)[:, None]
+        for j0, j1 in _tiles(n, block):
+            tile = rmsd_tile(left, tuple(f[j0:j1] for f in flat))
+            own_row, own_column = np.nonzero(np.arange(i0, i1)[:, None] == np.arange(j0, j1)[None, :])
+            tile[own_row, own_column] = np.inf
+            tile[np.isnan(tile)] = np.inf
+            # running best k: merge this tile's columns in and keep the k smallest
+            candidates = np.concatenate([kept, tile], axis=1)
+            indices = np.concatenate([kept_index, np.broadcast_to(np.arange(j0, j1), tile.shape)], axis=1)
+            keep = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+            kept, kept_index = candidates[rows, keep], indices[rows, keep]
+        order = np.argsort(kept, axis=1, kind='mergesort')
+        kept, kept_index = kept[rows, order], kept_index[rows, order]
+        found = np.isfinite(kept)
+        neighbours[i0:i1] = np.where(found, kept_index, -1)
+        best[i0:i1] = np.where(found, kept, np.nan)
+    return neighbours, best
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import argparse
+    from pocket_library import PocketLibrary
+    parser = argparse.ArgumentParser(description="All vs all pocket RMSD of the flavin sites in a pocket library.")
+    parser.add_argument("library", help="pocket library (see pocket_library.py)")
+    parser.add_argument("output", help=".npy file for the condensed matrix (or the top k neighbours)")
+    parser.add_argument("--top-k", dest="top_k", type=int, default=None,
+                        help="only keep the k closest sites of every site")
+    parser.add_argument("--block", type=int, default=BLOCK,
+                        help="sites per side of the tiles the matrix is computed in")
+    parser.add_argument("--shell", type=float, default=SHELL,
+                        help="angstroms around the ring that pocket residues are taken from")
+    args = parser.parse_args()
+
+    library = PocketLibrary(args.library)
+    provenance, rings, pockets = stack_sites(library.pockets(), shell=args.shell)
+    rings, pockets, ring_rmsd = superpose(rings, pockets)
+    provenance['ring_rmsd'] = ring_rmsd
+    provenance.to_csv(args.output + '.sites.csv', index_label='site')
+    print("Superposed", len(provenance), "sites, median ring RMSD", np.nanmedian(ring_rmsd))
+
+    if args.top_k:
+        neighbours, rmsd = top_k_rmsd(pockets, args.top_k, block=args.block)
+        np.savez(args.output, neighbours=neighbours, rmsd=rmsd)
+    else:
+        n = len(pockets)
+        out = np.lib.format.open_memmap(args.output, mode='w+', dtype=np.float32,
+                                        shape=(n * (n - 1) // 2,))
+        condensed_rmsd(pockets, block=args.block, out=out)
+        out.flush()
+    print("Wrote", args.output)
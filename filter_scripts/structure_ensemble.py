@@ -0,0 +1,226 @@
+'''
+    structure_ensemble.py
+        NMR entries (several MODELs) and structures with alternate locations
+            as an ensemble over one shared topology, instead of every model
+            and conformer flattened into the same frame.
+
+        An ensemble is
+            topology:    pandas.DataFrame of atoms in biopandas format (without
+                         coordinates that mean anything), one row per atom
+            coordinates: array of shape (n_models, n_atoms, 3), np.nan where
+                         an atom isn't in a model
+            occupancy:   array of shape (n_models, n_atoms)
+
+        Atoms are matched between models by (chain, residue number, insertion,
+            atom name). Residues with alternate locations keep the altloc with
+            the highest mean occupancy (the first one on ties), per model,
+            so every model is one consistent conformer.
+
+        find_ensemble_contacts runs the geometry stage over every model at
+            once and returns the contacts of every model (model column) and
+            the fraction of models each contact is found in (contact_occupancy
+            column); label_contacts works on its output unchanged.
+'''
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+from physical_constants import vdW_radii, vdW_bounds
+from flavin_contacts import KEY_ATOMS, FLAVINS, TOLERANCE, _ATOM_COLUMNS, _PAIR_CHUNK, \
+    fetch_frames, select_key_atoms, vdW_radius_array
+from result_cache import structure_fingerprint
+
+# identifies an atom across models
+ATOM_KEY = ['chain_id', 'residue_number', 'insertion', 'atom_name']
+_RESIDUE_KEY = ['chain_id', 'residue_number', 'insertion']
+
+
+def _model_numbers(atoms, others):
+    """ MODEL number of every atom, from the line numbers of the MODEL
+        records; 1 for everything in entries without MODEL records
+    """
+    if others is None or 'line_idx' not in atoms or not len(others):
+        return np.ones(len(atoms), dtype=np.int64)
+    models = others[others['record_name'] == 'MODEL']
+    if not len(models):
+        return np.ones(len(atoms), dtype=np.int64)
+    starts = models['line_idx'].values
+    numbers = pd.to_numeric(models['entry'], errors='coerce').fillna(0).values.astype(np.int64)
+    numbers = np.where(numbers > 0, numbers, np.arange(1, len(models) + 1))
+    position = np.searchsorted(starts, atoms['line_idx'].values, side='right') - 1
+    return numbers[np.maximum(position, 0)]
+
+
+def _keep_best_altlocs(atoms):
+    """ drops every alternate location of a residue but the one with the
+        highest mean occupancy (per model)
+    """
+    alt = atoms['alt_loc'].fillna('').astype(str).str.strip().values
+    if not (alt != '').any():
+        return atoms
+    frame = atoms[_RESIDUE_KEY].astype(str)
+    residue = frame['chain_id'].values.astype(object) + ':' + \
+        frame['residue_number'].values.astype(object) + ':' + \
+        frame['insertion'].values.astype(object) + ':' + \
+        atoms['model'].astype(str).values.astype(object)
+    scores = pd.DataFrame({'residue': residue, 'alt': alt,
+                           'occupancy': atoms['occupancy'].astype(float).values})
+    scores = scores[scores['alt'] != '']
+    mean = scores.groupby(['residue', 'alt'], sort=False)['occupancy'].mean().reset_index()
+    # highest mean occupancy first, first seen altloc on ties (stable sort)
+    mean = mean.iloc[np.argsort(-mean['occupancy'].values, kind='mergesort')]
+    best = mean.drop_duplicates('residue').set_index('residue')['alt']
+    chosen = pd.Series(residue).map(best).values
+    keep = (alt == '') | (alt == chosen)
+    return atoms[keep]
+
+
+class StructureEnsemble():
+    '''
+        Stacked coordinates of every model of a structure over one topology,
+            see the module docstring.
+
+        Usage:
+            ensemble = StructureEnsemble.from_frames(PandasPDB().fetch_pdb('2k5w').df)
+            ensemble.coordinates.shape     # (n_models, n_atoms, 3)
+            ensemble.model(0)              # model 1 as a regular structure
+    '''
+
+    def __init__(self, topology, coordinates, occupancy, model_ids=None):
+        self.topology = topology.reset_index(drop=True)
+        self.coordinates = coordinates
+        self.occupancy = occupancy
+        self.model_ids = np.arange(1, len(coordinates) + 1) if model_ids is None \
+            else np.asarray(model_ids)
+
+    @property
+    def n_models(self):
+        return self.coordinates.shape[0]
+
+    def __len__(self):
+        return len(self.topology)
+
+    @staticmethod
+    def from_frames(frames):
+        """ builds an ensemble out of the biopandas record frames (the .df
+            dict of a PandasPDB) of a structure
+        """
+        atoms = pd.concat([frames['ATOM'], frames['HETATM']], ignore_index=True)
+        if 'line_idx' in atoms:
+            atoms = atoms.sort_values(by='line_idx', kind='mergesort').reset_index(drop=True)
+        atoms['model'] = _model_numbers(atoms, frames.get('OTHERS'))
+        atoms = _keep_best_altlocs(atoms).reset_index(drop=True)
+
+        frame = atoms[ATOM_KEY].astype(str)
+        key = frame['chain_id'].values.astype(object)
+        for column in ATOM_KEY[1:]:
+            key = key + ':' + frame[column].values.astype(object)
+        # topology: every atom of any model, in order of first appearance
+        slot, uniques = pd.factorize(key)
+        model_ids, model = np.unique(atoms['model'].values, return_inverse=True)
+        first = pd.Series(range(len(atoms))).groupby(slot).first().values
+
+        coordinates = np.full((len(model_ids), len(uniques), 3), np.nan)
+        occupancy = np.zeros((len(model_ids), len(uniques)))
+        coordinates[model, slot] = atoms[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+        occupancy[model, slot] = atoms['occupancy'].astype(float).values
+        topology = atoms.iloc[first].drop('model', axis=1)
+        return StructureEnsemble(topology, coordinates, occupancy, model_ids)
+
+    def model(self, i):
+        """ the :i:-th model (0 based) as a regular biopandas style structure,
+            atoms missing from it left out
+        """
+        present = ~np.isnan(self.coordinates[i]).any(axis=1)
+        structure = self.topology[present].copy()
+        structure[['x_coord', 'y_coord', 'z_coord']] = self.coordinates[i][present]
+        structure['occupancy'] = self.occupancy[i][present]
+        return structure.reset_index(drop=True)
+
+    def fingerprint(self):
+        """ sha1 hex digest of the topology and the coordinates of every model """
+        digest = hashlib.sha1(structure_fingerprint(self.model(0)).encode('utf-8'))
+        digest.update(np.ascontiguousarray(np.nan_to_num(self.coordinates)).tobytes())
+        return digest.hexdigest()
+
+
+def fetch_ensemble(pdb_id, attempts=3):
+    """ Downloads :pdb_id: from the PDB as a StructureEnsemble, see
+        flavin_contacts.fetch_frames. Returns None if it never succeeds.
+    """
+    frames = fetch_frames(pdb_id, attempts)
+    if frames is None:
+        return None
+    return StructureEnsemble.from_frames(frames)
+
+
+def ensemble_pairs_within(key_xyz, xyz, box):
+    """ pairs_within for every model at once: :key_xyz: (n_models, n_keys, 3)
+        and :xyz: (n_models, n_atoms, 3). Returns (model, key index, atom
+        index, distance); atoms missing from a model (np.nan) never pair.
+    """
+    n_models, n_atoms = xyz.shape[:2]
+    chunk = max(1, _PAIR_CHUNK // max(1, n_models * n_atoms))
+    hits = []
+    for start in range(0, key_xyz.shape[1], chunk):
+        delta = np.abs(xyz[:, None, :, :] - key_xyz[:, start:start + chunk, None, :])
+        with np.errstate(invalid='ignore'):
+            m, k, a = np.nonzero((delta < box).all(axis=3))
+        hits.append((m, k + start, a, np.sqrt((delta[m, k, a] ** 2).sum(axis=1))))
+    if not hits:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, np.array([])
+    return tuple(np.concatenate(part) for part in zip(*hits))
+
+
+def find_ensemble_contacts(ensemble, key_atoms=KEY_ATOMS, ligands=FLAVINS, tolerance=TOLERANCE,
+                           radii=vdW_radii, instance=None):
+    """ find_contacts over every model of :ensemble: at once.
+
+        Returns the columns of find_contacts plus
+            model:             MODEL number the contact is found in
+            contact_occupancy: fraction of the models with this (key atom,
+                               target atom) contact
+        Rows are sorted by model, then like find_contacts.
+    """
+    topology = ensemble.topology
+    keys = select_key_atoms(topology, key_atoms, ligands, instance)
+    names = topology['atom_name'].values
+    residue_numbers = topology['residue_number'].values
+    radii_all = vdW_radius_array(names, topology['residue_name'].values, ligands, radii)
+
+    m, k, a, dist = ensemble_pairs_within(ensemble.coordinates[:, keys], ensemble.coordinates,
+                                          vdW_bounds['lower'])
+    expected = radii_all[keys][k] + radii_all[a]
+    keep = (residue_numbers[a] != residue_numbers[keys][k]) & \
+        (dist < expected + tolerance) & (dist > expected - tolerance)
+    m, k, a, dist = m[keep], k[keep], a[keep], dist[keep]
+    order = np.lexsort((dist, k, m))
+    m, k, a, dist = m[order], keys[k[order]], a[order], dist[order]
+
+    contacts = pd.DataFrame()
+    for column, suffix in _ATOM_COLUMNS:
+        contacts['key_atom_' + suffix] = topology[column].values[k]
+    for column, suffix in _ATOM_COLUMNS:
+        contacts['target_atom_' + suffix] = topology[column].values[a]
+    contacts['distance'] = dist
+    contacts['model'] = ensemble.model_ids[m]
+    # in how many models every (key atom, target atom) pair shows up
+    pair = k * len(topology) + a
+    seen = pd.Series(pair).map(pd.Series(pair).value_counts()).values if len(pair) else pair
+    contacts['contact_occupancy'] = seen / float(ensemble.n_models)
+    return contacts
+
+
+def contact_occupancy(contacts):
+    """ one row per (key atom, target atom) of per model :contacts: (see
+        find_ensemble_contacts) with its occupancy, the models it's found in
+        and its mean and min distance over those models
+    """
+    pair = ['key_atom_number', 'target_atom_number']
+    first = contacts.drop_duplicates(pair).drop(['distance', 'model'], axis=1)
+    distances = contacts.groupby(pair)['distance'].agg(['mean', 'min', 'size'])
+    distances.columns = ['mean_distance', 'min_distance', 'models']
+    return first.join(distances, on=pair).sort_values(by='contact_occupancy', ascending=False) \
+        .reset_index(drop=True)
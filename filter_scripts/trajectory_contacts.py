@@ -0,0 +1,360 @@
+'''
+    trajectory_contacts.py
+        The isoalloxazine contact + label analysis of get_sample.py for every
+            frame of an MD trajectory, streamed so memory stays bounded no
+            matter how many frames there are.
+
+        The topology is read once (the first model of the trajectory, or a
+            separate PDB file); frames are then read one at a time from
+            - a multi-model PDB (MODEL / ENDMDL blocks, atoms in the same
+              order in every model), or
+            - a binary trajectory (see BinaryTrajectoryWriter): a small header
+              followed by every frame as float32 (n_atoms, 3)
+
+        Neighbours come from a Verlet list: every (key atom, atom) pair
+            within the largest possible contact distance + :skin: angstroms,
+            rebuilt only once some atom has moved more than skin / 2 since
+            the last build. Between rebuilds a frame only looks at the pairs
+            in the list, and the contacts are exactly those of find_contacts.
+
+        Contacts of every frame are streamed to Parquet (see columnar_output.py)
+            as they're found, and the lifetime of every contact (consecutive
+            frames a key atom, target atom pair stays in contact) is
+            accumulated per (key atom, interaction label) with the mergeable
+            aggregators of corpus_statistics.py.
+
+        Usage:
+            python trajectory_contacts.py <trajectory.pdb|.trj> <output.parquet> \
+                [--topology topology.pdb] [--skin 1.0] [--dt 2.0]
+'''
+
+import struct
+
+import numpy as np
+import pandas as pd
+from physical_constants import vdW_radii, vdW_bounds
+from flavin_contacts import KEY_ATOMS, FLAVINS, TOLERANCE, _ATOM_COLUMNS, label_contacts, \
+    pairs_within, select_key_atoms, vdW_radius_array
+from corpus_statistics import QuantileSketch, RunningMoments
+
+# angstroms added to the contact distance when building the Verlet list
+SKIN = 1.0
+
+_MAGIC = b'FLVTRJ01'
+_HEADER = struct.Struct('<8sI')
+
+# fixed columns of ATOM / HETATM records: name, slice, type
+_PDB_COLUMNS = [('record_name', slice(0, 6), str), ('atom_number', slice(6, 11), int),
+                ('atom_name', slice(12, 16), str), ('alt_loc', slice(16, 17), str),
+                ('residue_name', slice(17, 20), str), ('chain_id', slice(21, 22), str),
+                ('residue_number', slice(22, 26), int), ('insertion', slice(26, 27), str),
+                ('x_coord', slice(30, 38), float), ('y_coord', slice(38, 46), float),
+                ('z_coord', slice(46, 54), float), ('occupancy', slice(54, 60), float),
+                ('b_factor', slice(60, 66), float), ('element_symbol', slice(76, 78), str)]
+
+
+def _is_atom(line):
+    return line.startswith('ATOM') or line.startswith('HETATM')
+
+
+def _parse_atom(line):
+    row = []
+    for _, columns, kind in _PDB_COLUMNS:
+        value = line[columns].strip()
+        if kind is str:
+            row.append(value)
+        else:
+            try:
+                row.append(kind(value))
+            except ValueError:
+                row.append(kind(0))
+    return row
+
+
+def read_topology(path):
+    """ the atoms of the first model of the PDB file at :path: as a
+        biopandas style pandas.DataFrame; stops reading at the end of that
+        model so it's cheap on long trajectories
+    """
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if _is_atom(line):
+                rows.append(_parse_atom(line))
+            elif line.startswith('ENDMDL') and rows:
+                break
+    return pd.DataFrame(rows, columns=[name for name, _, _ in _PDB_COLUMNS])
+
+
+def pdb_frames(path):
+    """ generates the coordinates of every model of the PDB file at :path:
+        as (n_atoms, 3) arrays; a file without MODEL records is one frame
+    """
+    xyz = []
+    with open(path) as f:
+        for line in f:
+            if _is_atom(line):
+                xyz.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            elif line.startswith('ENDMDL') and xyz:
+                yield np.array(xyz)
+                xyz = []
+    if xyz:
+        yield np.array(xyz)
+
+
+class BinaryTrajectoryWriter():
+    '''
+        Writes frames as a binary trajectory: an 8 byte magic, the number of
+            atoms (uint32, little endian) and then every frame as float32
+            (n_atoms, 3), so frame i starts at a fixed offset.
+
+        Usage:
+            with BinaryTrajectoryWriter('run.trj', n_atoms) as writer:
+                for xyz in frames:
+                    writer.write(xyz)
+    '''
+
+    def __init__(self, path, n_atoms):
+        self.n_atoms = n_atoms
+        self.frames = 0
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, n_atoms))
+
+    def write(self, xyz):
+        xyz = np.ascontiguousarray(xyz, dtype='<f4')
+        if xyz.shape != (self.n_atoms, 3):
+            raise ValueError("frame has shape " + str(xyz.shape) + ", expected " +
+                             str((self.n_atoms, 3)))
+        self._file.write(xyz.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def binary_frames(path):
+    """ generates the (n_atoms, 3) frames of a binary trajectory """
+    with open(path, 'rb') as f:
+        magic, n_atoms = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(path + " is not a binary trajectory")
+        size = n_atoms * 3 * 4
+        while True:
+            block = f.read(size)
+            if len(block) < size:
+                return
+            yield np.frombuffer(block, dtype='<f4').reshape(n_atoms, 3).astype(np.float64)
+
+
+def trajectory_frames(path):
+    """ frames of a binary trajectory or a (multi-model) PDB, by content """
+    with open(path, 'rb') as f:
+        binary = f.read(len(_MAGIC)) == _MAGIC
+    return binary_frames(path) if binary else pdb_frames(path)
+
+
+class VerletContacts():
+    '''
+        find_contacts for a fixed topology over many frames, with a Verlet
+            list, see the module docstring.
+
+        :rebuilds: how many times the list was (re)built
+    '''
+
+    def __init__(self, topology, key_atoms=KEY_ATOMS, ligands=FLAVINS, tolerance=TOLERANCE,
+                 radii=vdW_radii, skin=SKIN, box=vdW_bounds['lower']):
+        self.topology = topology.reset_index(drop=True)
+        self.keys = select_key_atoms(self.topology, key_atoms, ligands)
+        self.tolerance = tolerance
+        self.skin = skin
+        self.box = box
+        self.radii = vdW_radius_array(self.topology['atom_name'].values,
+                                      self.topology['residue_name'].values, ligands, radii)
+        self.residue_numbers = self.topology['residue_number'].values
+        # no pair can be in contact past the box's diagonal or the largest vdW sum
+        finite = self.radii[np.isfinite(self.radii)]
+        largest = 2 * finite.max() + tolerance if len(finite) else 0.0
+        self.cutoff = min(np.sqrt(3) * box, largest)
+        self.rebuilds = 0
+        self._reference = None
+        self._k = self._a = np.array([], dtype=np.int64)
+
+    def _build(self, xyz):
+        reach = self.cutoff + self.skin
+        k, a, dist = pairs_within(xyz[self.keys], xyz, reach)
+        keep = (dist < reach) & np.isfinite(self.radii[a]) & \
+            (self.residue_numbers[a] != self.residue_numbers[self.keys][k])
+        self._k, self._a = k[keep], a[keep]
+        self._reference = xyz.copy()
+        self.rebuilds += 1
+
+    def update(self, xyz):
+        """ (key atom, atom, distance) of every contact in the frame :xyz:,
+            grouped by key atom and closest first like find_contacts; atoms
+            are positional indices into the topology
+        """
+        if self._reference is None or \
+                np.sqrt(((xyz - self._reference) ** 2).sum(axis=1).max()) > self.skin / 2.0:
+            self._build(xyz)
+        keys = self.keys[self._k]
+        delta = np.abs(xyz[self._a] - xyz[keys])
+        dist = np.sqrt((delta ** 2).sum(axis=1))
+        expected = self.radii[keys] + self.radii[self._a]
+        keep = (delta < self.box).all(axis=1) & \
+            (dist < expected + self.tolerance) & (dist > expected - self.tolerance)
+        k, a, dist = self._k[keep], self._a[keep], dist[keep]
+        order = np.lexsort((dist, k))
+        return self.keys[k[order]], a[order], dist[order]
+
+
+class ContactLifetimes():
+    '''
+        Running statistics of how many consecutive frames contacts last,
+            overall and per (key atom, interaction label).
+
+        A contact that's still there at the end of the trajectory is only
+            counted once finish() is called, as :censored:.
+    '''
+
+    def __init__(self):
+        self.frames = 0
+        self.censored = 0
+        self.lifetimes = RunningMoments()
+        self.quantiles = QuantileSketch()
+        self.groups = {}            # (key atom, label) -> RunningMoments
+        self._active = np.array([], dtype=np.int64)
+        self._start = np.array([], dtype=np.int64)
+        self._group = np.array([], dtype=object)
+
+    def _close(self, ended, frame):
+        lifetimes = frame - self._start[ended]
+        self.lifetimes.update(lifetimes)
+        self.quantiles.update(lifetimes)
+        by_group = {}
+        for group, lifetime in zip(self._group[ended], lifetimes):
+            by_group.setdefault(group, []).append(lifetime)
+        for group, values in by_group.items():
+            self.groups.setdefault(group, RunningMoments()).update(values)
+
+    def update(self, pairs, groups):
+        """ :pairs: unique int ids of every contact in the next frame, :groups:
+            the (key atom, label) of each
+        """
+        pairs = np.asarray(pairs, dtype=np.int64)
+        ended = ~pd.Series(self._active).isin(pairs).values
+        if ended.any():
+            self._close(ended, self.frames)
+        new = ~pd.Series(pairs).isin(self._active).values
+        keep = ~ended
+        self._active = np.concatenate([self._active[keep], pairs[new]])
+        self._start = np.concatenate([self._start[keep], np.full(new.sum(), self.frames)])
+        group_array = np.empty(len(pairs), dtype=object)
+        group_array[:] = list(groups)
+        self._group = np.concatenate([self._group[keep], group_array[new]])
+        self.frames += 1
+
+    def finish(self):
+        """ counts the contacts still open at the end of the trajectory """
+        if len(self._active):
+            self.censored += len(self._active)
+            self._close(np.ones(len(self._active), dtype=bool), self.frames)
+        self._active = self._active[:0]
+        self._start = self._start[:0]
+        self._group = self._group[:0]
+
+    def to_frame(self, dt=1.0):
+        """ lifetimes (in units of :dt: per frame) per (key atom, label) and
+            overall, as a pandas.DataFrame
+        """
+        rows = [[key, label, m.count, m.mean * dt, m.std * dt, m.min * dt, m.max * dt]
+                for (key, label), m in sorted(self.groups.items(), key=str)]
+        m = self.lifetimes
+        rows.append(['all', '', m.count, m.mean * dt, m.std * dt, m.min * dt, m.max * dt])
+        return pd.DataFrame(rows, columns=['key_atom_name', 'interaction_label', 'contacts',
+                                           'mean', 'std', 'min', 'max'])
+
+
+def analyze_trajectory(frames, topology, writer, residue_categories, name='trajectory',
+                       tolerance=TOLERANCE, skin=SKIN, report_every=1000):
+    """ Streams :frames: through the contact and labelling stages.
+
+        :frames: iterable of (n_atoms, 3) arrays in :topology: order
+        :writer: a columnar_output.ContactWriter (or anything with a write)
+        Returns (VerletContacts, ContactLifetimes)
+    """
+    verlet = VerletContacts(topology, tolerance=tolerance, skin=skin)
+    lifetimes = ContactLifetimes()
+    n_atoms = len(verlet.topology)
+    # labels of every atom, looked up the first time it's in a contact
+    labels = np.full(n_atoms, -2, dtype=np.int64)
+    atoms = dict((suffix, verlet.topology[column].values) for column, suffix in _ATOM_COLUMNS)
+
+    for frame, xyz in enumerate(frames):
+        if len(xyz) != n_atoms:
+            raise ValueError("frame " + str(frame) + " has " + str(len(xyz)) +
+                             " atoms, the topology has " + str(n_atoms))
+        k, a, dist = verlet.update(xyz)
+        unlabelled = np.unique(a[labels[a] == -2])
+        if len(unlabelled):
+            labels[unlabelled] = label_contacts(pd.DataFrame({
+                'target_atom_residue': atoms['residue'][unlabelled],
+                'target_atom_name': atoms['name'][unlabelled]}),
+                residue_categories)['interaction_label'].values
+
+        contacts = pd.DataFrame({'PDB_ID': np.full(len(k), name, dtype=object)})
+        for _, suffix in _ATOM_COLUMNS:
+            contacts['key_atom_' + suffix] = atoms[suffix][k]
+        for _, suffix in _ATOM_COLUMNS:
+            contacts['target_atom_' + suffix] = atoms[suffix][a]
+        contacts['distance'] = dist
+        contacts['interaction_label'] = labels[a]
+        contacts['frame'] = frame
+        writer.write(contacts)
+
+        lifetimes.update(k * n_atoms + a, zip(atoms['name'][k], labels[a].tolist()))
+        if report_every and (frame + 1) % report_every == 0:
+            print("frame", frame + 1, "-", verlet.rebuilds, "list rebuilds,",
+                  lifetimes.lifetimes.count, "contacts ended")
+    lifetimes.finish()
+    return verlet, lifetimes
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import argparse
+    from columnar_output import ContactWriter
+    from flavin_contacts import load_label_table
+    # pickle the lifetimes as trajectory_contacts.ContactLifetimes, not __main__'s
+    from trajectory_contacts import analyze_trajectory, read_topology, trajectory_frames
+    parser = argparse.ArgumentParser(description="Isoalloxazine contacts of every frame of a trajectory.")
+    parser.add_argument("trajectory", help="multi-model PDB or binary trajectory")
+    parser.add_argument("output", help="Parquet file to stream the contacts of every frame to")
+    parser.add_argument("--topology", default=None,
+                        help="PDB file with the topology (default: first model of the trajectory)")
+    parser.add_argument("--name", default=None, help="value of the PDB_ID column")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="vdW distance window in angstroms")
+    parser.add_argument("--skin", type=float, default=SKIN, help="Verlet list skin in angstroms")
+    parser.add_argument("--dt", type=float, default=1.0, help="time between frames, for lifetimes")
+    parser.add_argument("--report-every", dest="report_every", type=int, default=1000,
+                        help="print progress every this many frames")
+    args = parser.parse_args()
+
+    topology = read_topology(args.topology or args.trajectory)
+    with ContactWriter(args.output) as writer:
+        verlet, lifetimes = analyze_trajectory(
+            trajectory_frames(args.trajectory), topology, writer, load_label_table(),
+            name=args.name or args.trajectory, tolerance=args.tolerance, skin=args.skin,
+            report_every=args.report_every)
+    pd.to_pickle(lifetimes, args.output + '.lifetimes.pkl')
+    table = lifetimes.to_frame(args.dt)
+    table.to_csv(args.output + '.lifetimes.csv', index=False)
+    print(lifetimes.frames, "frames,", writer.rows_written, "contacts,", verlet.rebuilds,
+          "Verlet list rebuilds")
+    print(table.tail(1))
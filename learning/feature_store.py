@@ -0,0 +1,190 @@
+'''
+    feature_store.py
+        Per flavin feature matrices for the redox potential models, built
+            once from the contacts written by filter_scripts/get_sample.py and
+            reused by every experiment after that.
+
+        A feature matrix is keyed by
+            - a hash of its definition (DEFINITION below, or any variation
+              of it: which blocks, which key atoms, ...)
+            - a hash of the contents of the contact file it's built from
+        so changing either builds a new matrix and everything else is just
+        a pickle load. Matrices live at <store>/<definition hash>/<contacts hash>.pkl
+        with the definition they were built from next to them.
+
+        One row per flavin instance (PDB_ID, chain_id, residue_number,
+            residue_name); feature blocks:
+            label_counts:   contacts per (key atom, interaction label)
+            min_distance:   closest contact of every key atom
+            residue_counts: contacts per target residue type
+            geometry:       contacts above/below/in the ring plane (when the
+                            contacts have isoalloxazine frame descriptors)
+
+        Usage:
+            python feature_store.py <contacts.parquet|csv> [--store DIR]
+'''
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# the contact tables and their helpers live with the pipeline that builds them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'filter_scripts'))
+from columnar_output import read_contacts
+from flavin_contacts import KEY_ATOMS
+from result_cache import settings_fingerprint
+
+STORE = './feature_store'
+
+# bump FEATURE_VERSION whenever the code of a feature block changes meaning
+FEATURE_VERSION = 1
+DEFINITION = {
+    'version': FEATURE_VERSION,
+    'blocks': ['label_counts', 'min_distance', 'residue_counts', 'geometry'],
+    'key_atoms': KEY_ATOMS,
+    # key atoms without any contact; a bit past the largest contact distance
+    'missing_distance': 6.0,
+    # |height| under this (angstroms) counts as in the ring plane
+    'in_plane': 1.0,
+}
+
+INSTANCE_COLUMNS = ['PDB_ID', 'chain_id', 'residue_number', 'residue_name']
+_KEY_COLUMNS = ['PDB_ID', 'key_atom_chain_id', 'key_atom_residue_number', 'key_atom_residue']
+
+
+def load_contacts(path):
+    """ contacts written by get_sample.py, either Parquet or CSV """
+    if path.endswith('.parquet'):
+        return read_contacts(path)
+    return pd.read_csv(path, index_col=0)
+
+
+def file_fingerprint(path, chunk=1 << 20):
+    """ sha1 hex digest of the contents of the file at :path: """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pivot(contacts, columns, values, aggfunc, prefix, fill):
+    table = pd.pivot_table(contacts, index='instance', columns=columns, values=values,
+                           aggfunc=aggfunc)
+    if isinstance(table.columns, pd.MultiIndex):
+        table.columns = ['_'.join([prefix] + [str(c) for c in column]) for column in table.columns]
+    else:
+        table.columns = [prefix + '_' + str(c) for c in table.columns]
+    return table.fillna(fill)
+
+
+def build_features(contacts, definition=DEFINITION):
+    """ Builds the feature matrix of :definition: out of a contact table.
+
+        Returns a pandas.DataFrame indexed by flavin instance
+            (INSTANCE_COLUMNS) with one column per feature
+    """
+    contacts = contacts.copy()
+    for column in _KEY_COLUMNS + ['key_atom_name', 'target_atom_residue']:
+        contacts[column] = contacts[column].astype(str)
+    contacts = contacts[contacts['key_atom_name'].isin(definition['key_atoms'])]
+    contacts['instance'] = contacts[_KEY_COLUMNS[0]].values.astype(object)
+    for column in _KEY_COLUMNS[1:]:
+        contacts['instance'] = contacts['instance'] + '|' + contacts[column].values.astype(object)
+    contacts['one'] = 1
+
+    blocks = []
+    if 'label_counts' in definition['blocks']:
+        labels = contacts.copy()
+        labels['interaction_label'] = labels['interaction_label'].astype(int)
+        blocks.append(_pivot(labels, ['key_atom_name', 'interaction_label'], 'one', 'sum',
+                             'n', 0))
+    if 'min_distance' in definition['blocks']:
+        closest = _pivot(contacts, 'key_atom_name', 'distance', 'min', 'd', np.nan)
+        wanted = ['d_' + atom for atom in definition['key_atoms']]
+        blocks.append(closest.reindex(columns=wanted).fillna(definition['missing_distance']))
+    if 'residue_counts' in definition['blocks']:
+        blocks.append(_pivot(contacts, 'target_atom_residue', 'one', 'sum', 'r', 0))
+    if 'geometry' in definition['blocks'] and 'height' in contacts:
+        height = contacts['height'].astype(float)
+        side = np.where(height.abs() < definition['in_plane'], 'plane',
+                        np.where(height > 0, 'above', 'below'))
+        geometry = contacts.assign(side=np.where(height.isnull(), 'unknown', side))
+        blocks.append(_pivot(geometry, 'side', 'one', 'sum', 'g', 0))
+
+    features = pd.concat(blocks, axis=1).fillna(0) if blocks else \
+        pd.DataFrame(index=contacts['instance'].unique())
+    features = features.reindex(columns=sorted(features.columns)).astype(np.float32)
+    parts = [key.split('|') for key in features.index]
+    features.index = pd.MultiIndex.from_tuples([(p[0], p[1], int(float(p[2])), p[3]) for p in parts],
+                                               names=INSTANCE_COLUMNS)
+    return features.sort_index()
+
+
+class FeatureStore():
+    '''
+        Feature matrices on disk, keyed by definition and contact file, see
+            the module docstring.
+
+        Usage:
+            store = FeatureStore('./feature_store')
+            features = store.load('FADS.parquet')   # builds it the first time
+    '''
+
+    def __init__(self, directory=STORE):
+        self.directory = directory
+
+    def path(self, definition, contacts_path):
+        return os.path.join(self.directory, settings_fingerprint(**definition),
+                            file_fingerprint(contacts_path) + '.pkl')
+
+    def load(self, contacts_path, definition=DEFINITION, rebuild=False):
+        """ the feature matrix of :definition: for the contacts at
+            :contacts_path:, built and stored if it isn't already
+        """
+        path = self.path(definition, contacts_path)
+        if os.path.exists(path) and not rebuild:
+            return pd.read_pickle(path)
+        features = build_features(load_contacts(contacts_path), definition)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        pd.to_pickle(definition, os.path.join(directory, 'definition.pkl'))
+        # write then rename so a killed build never leaves half a matrix behind
+        pd.to_pickle(features, path + '.tmp')
+        os.rename(path + '.tmp', path)
+        return features
+
+    def versions(self):
+        """ pandas.DataFrame of every stored matrix: definition hash,
+            contacts hash, path and size in bytes
+        """
+        rows = []
+        if os.path.isdir(self.directory):
+            for version in sorted(os.listdir(self.directory)):
+                folder = os.path.join(self.directory, version)
+                if not os.path.isdir(folder):
+                    continue
+                for name in sorted(os.listdir(folder)):
+                    if name.endswith('.pkl') and name != 'definition.pkl':
+                        path = os.path.join(folder, name)
+                        rows.append([version, name[:-len('.pkl')], path, os.path.getsize(path)])
+        return pd.DataFrame(rows, columns=['definition', 'contacts', 'path', 'bytes'])
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Build (or find) the feature matrix of a contact file.")
+    parser.add_argument("contacts", help="contacts written by get_sample.py (.parquet or .csv)")
+    parser.add_argument("--store", default=STORE, help="feature store directory")
+    parser.add_argument("--rebuild", action="store_true", help="build even if it's stored")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    features = store.load(args.contacts, rebuild=args.rebuild)
+    print(features.shape[0], "flavins x", features.shape[1], "features at",
+          store.path(DEFINITION, args.contacts))
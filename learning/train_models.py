@@ -0,0 +1,150 @@
+'''
+    train_models.py
+        Cross validated redox potential models on the stored feature matrices
+            (see feature_store.py).
+
+        Every flavin instance is joined on its PDB ID to the redox table
+            (sample_data/sample_redox_potentials.csv) and every (model,
+            hyperparameters) combination of MODELS is scored with the same
+            GroupKFold split, grouped by Enzyme so that no enzyme is ever in
+            both the training and the test folds. Combinations run in
+            parallel in a process pool; results are written to a CSV, best
+            first.
+
+        Usage:
+            python train_models.py <contacts.parquet|csv> <redox.csv> [--target "EM(mV)"] \
+                [--models ridge forest] [--folds 5] [--jobs 4] [--output results.csv]
+'''
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import GroupKFold
+from feature_store import DEFINITION, STORE, FeatureStore
+
+TARGET = 'EM(mV)'
+GROUP = 'Enzyme'
+
+# model name -> (estimator factory, hyperparameter grid)
+MODELS = {
+    'ridge': ('sklearn.linear_model.Ridge', {'alpha': [0.1, 1.0, 10.0, 100.0]}),
+    'lasso': ('sklearn.linear_model.Lasso', {'alpha': [0.1, 1.0, 10.0], 'max_iter': [10000]}),
+    'forest': ('sklearn.ensemble.RandomForestRegressor',
+               {'n_estimators': [200], 'max_depth': [None, 4, 8], 'min_samples_leaf': [1, 3],
+                'random_state': [0]}),
+    'boosting': ('sklearn.ensemble.GradientBoostingRegressor',
+                 {'n_estimators': [200], 'learning_rate': [0.05, 0.1], 'max_depth': [2, 3],
+                  'random_state': [0]}),
+}
+
+RESULT_COLUMNS = ['model', 'params', 'rmse', 'rmse_std', 'mae', 'r2', 'folds']
+
+
+def training_table(features, redox, target=TARGET, group=GROUP):
+    """ Joins the per flavin :features: to the :redox: table on PDB ID (case
+        insensitive) and returns (X, y, groups, rows) for every flavin with a
+        numeric :target:. :rows: holds the PDB ID, flavin and group of every
+        row of X.
+    """
+    redox = redox.copy()
+    redox['pdb_key'] = redox['PDB ID'].astype(str).str.lower()
+    redox[target] = pd.to_numeric(redox[target], errors='coerce')
+    # a few entries have more than one measurement; average them
+    redox = redox.dropna(subset=[target]).groupby('pdb_key').agg({target: 'mean', group: 'first'})
+
+    rows = features.index.to_frame(index=False) if hasattr(features.index, 'to_frame') else \
+        pd.DataFrame(list(features.index), columns=features.index.names)
+    rows['pdb_key'] = rows['PDB_ID'].astype(str).str.lower()
+    joined = rows.join(redox, on='pdb_key')
+    keep = joined[target].notnull().values
+    rows = joined[keep].reset_index(drop=True)
+    X = features.values[keep].astype(np.float64)
+    return X, rows[target].values, rows[group].astype(str).values, rows
+
+
+def parameter_grid(models):
+    """ every (model name, params) combination of the :models: """
+    for name in models:
+        _, grid = MODELS[name]
+        keys = sorted(grid)
+        for values in itertools.product(*[grid[k] for k in keys]):
+            yield name, dict(zip(keys, values))
+
+
+def _estimator(name, params):
+    module, _, cls = MODELS[name][0].rpartition('.')
+    return getattr(__import__(module, fromlist=[cls]), cls)(**params)
+
+
+def cross_validate(name, params, X, y, splits):
+    """ scores one (model, params) on the precomputed :splits:; runs in a
+        worker process
+    """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    errors, absolute, r2 = [], [], []
+    for train, test in splits:
+        model = make_pipeline(StandardScaler(), _estimator(name, params))
+        model.fit(X[train], y[train])
+        predicted = model.predict(X[test])
+        residual = predicted - y[test]
+        errors.append(np.sqrt(np.mean(residual ** 2)))
+        absolute.append(np.mean(np.abs(residual)))
+        total = np.sum((y[test] - y[test].mean()) ** 2)
+        r2.append(1 - np.sum(residual ** 2) / total if total > 0 else np.nan)
+    return [name, repr(params), np.mean(errors), np.std(errors), np.mean(absolute),
+            np.nanmean(r2), len(splits)]
+
+
+def group_splits(X, y, groups, folds=5):
+    """ (train, test) indices of the GroupKFold split over :groups:, with at
+        most as many folds as there are groups
+    """
+    folds = min(folds, len(np.unique(groups)))
+    return list(GroupKFold(n_splits=folds).split(X, y, groups))
+
+
+def run_experiments(X, y, groups, models, folds=5, jobs=None):
+    """ scores every combination of :models: with GroupKFold over :groups:
+        (see group_splits)
+
+        Returns a pandas.DataFrame of RESULT_COLUMNS, lowest RMSE first
+    """
+    splits = group_splits(X, y, groups, folds)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(cross_validate, name, params, X, y, splits)
+                   for name, params in parameter_grid(models)]
+        results = [future.result() for future in futures]
+    return pd.DataFrame(results, columns=RESULT_COLUMNS).sort_values(by='rmse') \
+        .reset_index(drop=True)
+
+
+# this is that part where a module is also a script
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Cross validated redox potential models.")
+    parser.add_argument("contacts", help="contacts written by get_sample.py (.parquet or .csv)")
+    parser.add_argument("redox", help="redox table, eg. sample_data/sample_redox_potentials.csv")
+    parser.add_argument("--store", default=STORE, help="feature store directory")
+    parser.add_argument("--target", default=TARGET, help="column of the redox table to predict")
+    parser.add_argument("--models", nargs='+', default=sorted(MODELS), choices=sorted(MODELS))
+    parser.add_argument("--folds", type=int, default=5, help="number of GroupKFold folds")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--output", default='model_results.csv', help="where to write the scores")
+    args = parser.parse_args()
+
+    start = time.time()
+    features = FeatureStore(args.store).load(args.contacts, DEFINITION)
+    X, y, groups, rows = training_table(features, pd.read_csv(args.redox), args.target)
+    print("Loaded", X.shape[0], "flavins x", X.shape[1], "features from",
+          len(np.unique(groups)), "enzymes in %.1fs" % (time.time() - start))
+    if len(np.unique(groups)) < 2:
+        raise ValueError("need at least two enzymes to make grouped folds")
+
+    results = run_experiments(X, y, groups, args.models, args.folds, args.jobs)
+    results.to_csv(args.output, index=False)
+    print(results.head(10))
+    print("Wrote", len(results), "results to", args.output, "in %.1fs" % (time.time() - start))
@@ -0,0 +1,74 @@
+'''
+    fixtures.py
+        Shared setup of the tests: puts filter_scripts on the path and loads
+            the structures they run on.
+
+        test.pdb is a homodimer with one FMN per chain (A 312 and B 312), so
+            it has two near-identical flavin sites.
+'''
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from biopandas.pdb import PandasPDB
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+FILTER_SCRIPTS = os.path.join(TESTS, '..', 'filter_scripts')
+sys.path.insert(0, FILTER_SCRIPTS)
+
+TEST_PDB = os.path.join(TESTS, 'test.pdb')
+CHEMICAL_CODES = os.path.join(FILTER_SCRIPTS, 'protein_atom_chemical_codes_v1.txt')
+
+# the two flavins of test.pdb
+INSTANCES = [('A', 312), ('B', 312)]
+
+_frames = {}
+
+
+def load_frames(path=TEST_PDB):
+    """ the biopandas record frames (PandasPDB().df) of the PDB file at :path: """
+    if path not in _frames:
+        _frames[path] = PandasPDB().read_pdb(path).df
+    return dict((name, frame.copy()) for name, frame in _frames[path].items())
+
+
+def load_structure(path=TEST_PDB):
+    """ ATOM and HETATM records of :path: as one frame, like fetch_structure """
+    frames = load_frames(path)
+    return pd.concat([frames['ATOM'], frames['HETATM']], ignore_index=True)
+
+
+def perturbed(structure, sigma, seed=0):
+    """ a copy of :structure: with gaussian noise of :sigma: angstroms on
+        every coordinate
+    """
+    moved = structure.copy()
+    noise = np.random.RandomState(seed).normal(0, sigma, (len(moved), 3))
+    moved[['x_coord', 'y_coord', 'z_coord']] = \
+        moved[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64) + noise
+    return moved
+
+
+def contact_pairs(contacts):
+    """ {(key atom number, target atom number): distance} of a contact table """
+    return dict(zip(zip(contacts['key_atom_number'].values.tolist(),
+                        contacts['target_atom_number'].values.tolist()),
+                    contacts['distance'].values.tolist()))
+
+
+def write_models(path, models, source=TEST_PDB):
+    """ writes an NMR style PDB file to :path: with one MODEL per array of
+        :models: ((n_atoms, 3) coordinates of the ATOM and HETATM records of
+        :source:, in file order)
+    """
+    with open(source) as f:
+        atoms = [line.rstrip('\n') for line in f if line.startswith(('ATOM', 'HETATM'))]
+    with open(path, 'w') as f:
+        for number, xyz in enumerate(models, 1):
+            f.write('MODEL     %4d\n' % number)
+            for line, (x, y, z) in zip(atoms, xyz):
+                f.write('%s%8.3f%8.3f%8.3f%s\n' % (line[:30], x, y, z, line[54:]))
+            f.write('ENDMDL\n')
+        f.write('END\n')
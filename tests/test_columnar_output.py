@@ -0,0 +1,114 @@
+'''
+    Parquet contact tables: round trips, projection and row group skipping
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyarrow.parquet as pq
+from fixtures import load_structure, perturbed
+from flavin_contacts import find_contacts
+from columnar_output import CONTACT_SCHEMA, ContactWriter, read_contacts, write_contacts
+
+
+def contact_table(pdb_ids):
+    """ contacts of a perturbed copy of test.pdb for every one of :pdb_ids: """
+    tables = []
+    for seed, pdb_id in enumerate(pdb_ids):
+        contacts = find_contacts(perturbed(load_structure(), 0.1, seed), tolerance=0.4)
+        contacts.insert(0, 'PDB_ID', pdb_id)
+        contacts['interaction_label'] = np.random.RandomState(seed).randint(-1, 4, len(contacts))
+        tables.append(contacts)
+    return tables
+
+
+class TestColumnarOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.pdb_ids = ['1AAA', '2BBB', '3CCC', '4DDD']
+        self.tables = contact_table(self.pdb_ids)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'contacts.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, row_group_size=1 << 16, schema=CONTACT_SCHEMA):
+        with ContactWriter(self.path, schema=schema, row_group_size=row_group_size) as writer:
+            for contacts in self.tables:
+                writer.write(contacts)
+        return writer
+
+    def test_round_trip(self):
+        contacts = self.tables[0]
+        write_contacts(contacts, self.path)
+        found = read_contacts(self.path)
+        self.assertEqual(list(found.columns), [name for name, _ in CONTACT_SCHEMA])
+        for name, dtype in CONTACT_SCHEMA:
+            self.assertEqual(str(found[name].dtype), dtype, name)
+        # rows come back sorted by key atom, then distance
+        expected = contacts.sort_values(by=['key_atom_number', 'distance'])
+        for name in ['key_atom_number', 'target_atom_number', 'interaction_label',
+                     'key_atom_residue_number', 'target_atom_residue_number']:
+            self.assertEqual(found[name].tolist(), expected[name].tolist(), name)
+        for name in ['key_atom_name', 'target_atom_residue', 'target_atom_chain_id']:
+            self.assertEqual(found[name].astype(str).tolist(), expected[name].tolist(), name)
+        np.testing.assert_allclose(found['distance'], expected['distance'], rtol=1e-6)
+        # columns the table doesn't have come back empty
+        self.assertTrue((found['frame'] == -1).all())
+        self.assertTrue(found['site_weight'].isnull().all())
+
+    def test_column_projection(self):
+        self.write()
+        found = read_contacts(self.path, columns=['distance', 'key_atom_name'])
+        self.assertEqual(list(found.columns), ['distance', 'key_atom_name'])
+        self.assertEqual(len(found), sum(len(t) for t in self.tables))
+        found = read_contacts(self.path, columns=['distance'], pdb_ids=['2BBB'])
+        self.assertEqual(list(found.columns), ['distance'])
+        self.assertEqual(len(found), len(self.tables[1]))
+
+    def test_pdb_ids_skip_row_groups(self):
+        writer = self.write(row_group_size=50)
+        self.assertEqual(writer.rows_written, sum(len(t) for t in self.tables))
+        groups = pq.ParquetFile(self.path).num_row_groups
+        self.assertTrue(groups > 4)
+
+        read = []
+        original = pq.ParquetFile.read_row_group
+
+        def counted(parquet, group, *args, **kwargs):
+            read.append(group)
+            return original(parquet, group, *args, **kwargs)
+
+        with mock.patch.object(pq.ParquetFile, 'read_row_group', counted):
+            found = read_contacts(self.path, pdb_ids=['3CCC'])
+        self.assertEqual(set(found['PDB_ID'].astype(str)), set(['3CCC']))
+        self.assertEqual(len(found), len(self.tables[2]))
+        self.assertTrue(0 < len(read) < groups)
+
+        # case insensitive, without reading every group
+        del read[:]
+        with mock.patch.object(pq.ParquetFile, 'read_row_group', counted):
+            found = read_contacts(self.path, pdb_ids=['3ccc', '1aAa'])
+        self.assertEqual(sorted(set(found['PDB_ID'].astype(str))), ['1AAA', '3CCC'])
+        self.assertEqual(len(found), len(self.tables[0]) + len(self.tables[2]))
+        self.assertTrue(len(read) < groups)
+        self.assertEqual(len(read_contacts(self.path, pdb_ids=['9zzz'])), 0)
+
+    def test_files_from_older_schemas(self):
+        older = [column for column in CONTACT_SCHEMA
+                 if column[0] not in ['site_group', 'site_weight', 'model',
+                                      'contact_occupancy', 'frame']]
+        self.write(schema=older)
+        found = read_contacts(self.path)
+        self.assertEqual(list(found.columns), [name for name, _ in older])
+        self.assertEqual(len(found), sum(len(t) for t in self.tables))
+        self.assertEqual(len(read_contacts(self.path, pdb_ids=['1AAA'])), len(self.tables[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
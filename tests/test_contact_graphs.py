@@ -0,0 +1,99 @@
+'''
+    Contact graph batches against the contact tables they're built from
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from biopandas.pdb import PandasPDB
+from scipy.sparse import block_diag
+from fixtures import CHEMICAL_CODES, load_structure, perturbed, write_models
+from flavin_contacts import KEY_ATOMS, find_contacts
+from radial_distribution import load_chemical_codes
+from structure_ensemble import StructureEnsemble, find_ensemble_contacts
+from contact_graphs import GRAPH_COLUMNS, RESIDUE_TYPES, ContactGraphBatch, GraphBatchWriter
+
+
+def contact_tables():
+    """ labelled contacts of a few perturbed copies of test.pdb """
+    tables = []
+    for seed in range(3):
+        contacts = find_contacts(perturbed(load_structure(), 0.1, seed), tolerance=0.5)
+        contacts.insert(0, 'PDB_ID', 'T%03d' % seed)
+        contacts['interaction_label'] = np.random.RandomState(seed).randint(-1, 4, len(contacts))
+        tables.append(contacts)
+    return tables
+
+
+class TestContactGraphs(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = contact_tables()
+        self.directory = tempfile.mkdtemp()
+        with GraphBatchWriter(self.directory, load_chemical_codes(CHEMICAL_CODES)) as writer:
+            for contacts in self.tables:
+                writer.write(contacts)
+        self.batch = ContactGraphBatch(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_graphs_hold_the_closest_contacts(self):
+        # two flavins per structure
+        self.assertEqual(len(self.batch), 2 * len(self.tables))
+        for i, graph in self.batch.graphs.iterrows():
+            contacts = self.tables[int(graph['PDB_ID'][1:])]
+            own = contacts[(contacts['key_atom_chain_id'] == graph['chain_id']) &
+                           (contacts['key_atom_residue_number'] == graph['residue_number'])]
+            residues = own.groupby(['target_atom_chain_id', 'target_atom_residue_number'],
+                                   sort=False)
+            dense = self.batch.csr(i).toarray()
+            self.assertEqual(dense.shape, (len(KEY_ATOMS), len(residues)))
+            nodes = self.batch.graph(i)
+            for n, (_, residue) in enumerate(residues):
+                closest = residue.groupby('key_atom_name')['distance'].min()
+                expected = np.zeros(len(KEY_ATOMS))
+                expected[[KEY_ATOMS.index(k) for k in closest.index]] = closest.values
+                np.testing.assert_allclose(dense[:, n], expected, rtol=1e-6)
+                self.assertEqual(nodes['node_contacts'][n], len(residue))
+                name = residue['target_atom_residue'].values[0]
+                self.assertEqual(RESIDUE_TYPES[nodes['residue_type'][n]],
+                                 name if name in RESIDUE_TYPES else 'other')
+
+    def test_minibatch_is_block_diagonal(self):
+        for start, stop in [(0, len(self.batch)), (1, 4), (5, 6)]:
+            adjacency, nodes = self.batch.minibatch(start, stop, 'label')
+            expected = block_diag([self.batch.csr(i, 'label') for i in range(start, stop)])
+            self.assertEqual(adjacency.shape, expected.shape)
+            self.assertEqual((adjacency != expected).nnz, 0)
+            self.assertEqual(nodes['graph'].tolist(), sorted(nodes['graph'].tolist()))
+            self.assertEqual(len(nodes['graph']), adjacency.shape[1])
+
+    def test_a_graph_per_model(self):
+        self.assertEqual(list(self.batch.graphs.columns), GRAPH_COLUMNS)
+        path = os.path.join(self.directory, 'models.pdb')
+        write_models(path, [perturbed(load_structure(), 0.2, seed)[
+            ['x_coord', 'y_coord', 'z_coord']].values for seed in range(3)])
+        contacts = find_ensemble_contacts(
+            StructureEnsemble.from_frames(PandasPDB().read_pdb(path).df), tolerance=0.5)
+        contacts.insert(0, 'PDB_ID', 'NMR1')
+        contacts['interaction_label'] = -1
+
+        directory = os.path.join(self.directory, 'models.graphs')
+        with GraphBatchWriter(directory, load_chemical_codes(CHEMICAL_CODES)) as writer:
+            writer.write(contacts)
+        batch = ContactGraphBatch(directory)
+        self.assertEqual(list(batch.graphs.columns), GRAPH_COLUMNS + ['model'])
+        self.assertEqual(sorted(zip(batch.graphs['chain_id'], batch.graphs['model'])),
+                         [(c, m) for c in 'AB' for m in [1, 2, 3]])
+        for i, graph in batch.graphs.iterrows():
+            own = contacts[(contacts['model'] == graph['model']) &
+                           (contacts['key_atom_chain_id'] == graph['chain_id'])]
+            self.assertEqual(batch.graph(i)['node_contacts'].sum(), len(own))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+'''
+    Merged statistics of shards against the statistics of one run
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from fixtures import INSTANCES, load_structure, perturbed
+from flavin_contacts import find_contacts
+from pocket_library import extract_pockets
+from corpus_statistics import CorpusStatistics, QuantileSketch, RunningMoments
+
+
+def structures():
+    """ labelled contact tables of a few (perturbed) copies of test.pdb, one
+        per flavin, standing in for a corpus
+    """
+    tables = []
+    for seed in range(4):
+        structure = perturbed(load_structure(), 0.1, seed)
+        for instance in INSTANCES:
+            contacts = find_contacts(structure, tolerance=0.4, instance=instance)
+            contacts.insert(0, 'PDB_ID', 'T%03d' % seed)
+            contacts['interaction_label'] = np.random.RandomState(seed).randint(-1, 4, len(contacts))
+            tables.append(contacts)
+    return tables
+
+
+class TestCorpusStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = structures()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameTables(self, found, expected):
+        for name in expected:
+            # ties in the count tables can come out in either order
+            left_table = found[name].sort_values(by=list(found[name].columns))
+            right_table = expected[name].sort_values(by=list(expected[name].columns))
+            for column in expected[name]:
+                left, right = left_table[column].values, right_table[column].values
+                if left.dtype.kind == 'f':
+                    np.testing.assert_allclose(left, right, rtol=1e-12, err_msg=name + column)
+                else:
+                    self.assertEqual(left.tolist(), right.tolist(), name + column)
+
+    def test_merged_shards_match_one_run(self):
+        whole = CorpusStatistics()
+        for contacts in self.tables:
+            whole.update(contacts)
+
+        paths = []
+        for i, shard in enumerate([self.tables[:3], self.tables[3:4], self.tables[4:]]):
+            stats = CorpusStatistics()
+            for contacts in shard:
+                stats.update(contacts)
+            paths.append(os.path.join(self.directory, '%d.stats.pkl' % i))
+            stats.save(paths[-1])
+        merged = CorpusStatistics.combine(paths)
+
+        # the shards split T001's two flavins between them
+        self.assertEqual(merged.structures, 4)
+        self.assertEqual(merged.structures, whole.structures)
+        self.assertEqual(merged.key_atom_label.counts, whole.key_atom_label.counts)
+        self.assertEqual(merged.distance_histogram.counts.tolist(),
+                         whole.distance_histogram.counts.tolist())
+        self.assertEqual(merged.distance_quantiles.buckets, whole.distance_quantiles.buckets)
+        self.assertSameTables(merged.tables(), whole.tables())
+
+    def test_structures_count_entries_not_pockets(self):
+        whole, pockets = CorpusStatistics(), CorpusStatistics()
+        for seed in range(3):
+            pdb_id = 'T%03d' % seed
+            structure = perturbed(load_structure(), 0.1, seed)
+            contacts = find_contacts(structure, tolerance=0.4)
+            contacts.insert(0, 'PDB_ID', pdb_id)
+            contacts['interaction_label'] = 0
+            whole.update(contacts, pdb_id)
+            for provenance, pocket in extract_pockets(structure, pdb_id):
+                contacts = find_contacts(pocket, tolerance=0.4, instance=(
+                    provenance['chain_id'], provenance['residue_number']))
+                contacts.insert(0, 'PDB_ID', pdb_id)
+                contacts['interaction_label'] = 0
+                pockets.update(contacts, pdb_id)
+        self.assertEqual(whole.structures, 3)
+        self.assertEqual(pockets.structures, 3)
+        self.assertEqual(pockets.key_atom_label.counts, whole.key_atom_label.counts)
+        self.assertEqual(pockets.distance.count, whole.distance.count)
+
+        # a structure without contacts still counts, once
+        whole.update(contacts.iloc[:0], 'T999')
+        whole.update(contacts.iloc[:0], 'T999')
+        self.assertEqual(whole.structures, 4)
+
+    def test_tables_match_pandas(self):
+        stats = CorpusStatistics()
+        for contacts in self.tables:
+            stats.update(contacts)
+        everything = pd.concat(self.tables, ignore_index=True)
+        distance = stats.tables()['distance']
+        overall = distance[distance['key_atom_name'] == 'all'].iloc[0]
+        self.assertEqual(overall['count'], len(everything))
+        self.assertAlmostEqual(overall['mean'], everything['distance'].mean(), places=12)
+        self.assertAlmostEqual(overall['std'], everything['distance'].std(ddof=1), places=12)
+        counts = stats.tables()['key_atom_label'].set_index(
+            ['key_atom_name', 'interaction_label'])['count']
+        expected = everything.groupby(['key_atom_name', 'interaction_label']).size()
+        self.assertEqual(counts.sort_index().to_dict(), expected.sort_index().to_dict())
+
+    def test_moments_and_sketch_merge(self):
+        values = np.random.RandomState(1).gamma(4.0, 1.0, 1000)
+        whole, left, right = RunningMoments(), RunningMoments(), RunningMoments()
+        whole.update(values)
+        left.update(values[:300])
+        right.update(values[300:])
+        left.merge(right)
+        self.assertEqual(left.count, whole.count)
+        self.assertAlmostEqual(left.mean, whole.mean, places=12)
+        self.assertAlmostEqual(left.variance, np.var(values, ddof=1), places=10)
+        self.assertEqual((left.min, left.max), (values.min(), values.max()))
+
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        sketch.update(values)
+        for q in [0.05, 0.5, 0.95]:
+            true = np.sort(values)[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - true), 0.01 * true + 1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+    Feature matrices of the redox potential models and their store
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from fixtures import TESTS, load_structure
+from flavin_contacts import find_contacts
+
+sys.path.insert(0, os.path.join(TESTS, '..', 'learning'))
+import feature_store  # noqa: E402
+from feature_store import DEFINITION, FeatureStore, build_features  # noqa: E402
+
+
+def labelled_contacts(pdb_id='T000'):
+    contacts = find_contacts(load_structure(), tolerance=0.4)
+    contacts.insert(0, 'PDB_ID', pdb_id)
+    contacts['interaction_label'] = np.random.RandomState(0).randint(-1, 4, len(contacts))
+    return contacts
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.contacts = labelled_contacts()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'contacts.csv')
+        self.contacts.to_csv(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_features_count_the_contacts(self):
+        features = build_features(self.contacts)
+        self.assertEqual(features.index.tolist(), [('T000', 'A', 312, 'FMN'),
+                                                   ('T000', 'B', 312, 'FMN')])
+        for (_, chain_id, _, _), row in features.iterrows():
+            own = self.contacts[self.contacts['key_atom_chain_id'] == chain_id]
+            for (atom, label), count in own.groupby(['key_atom_name', 'interaction_label']).size() \
+                    .items():
+                self.assertEqual(row['n_%s_%d' % (atom, label)], count)
+            closest = own.groupby('key_atom_name')['distance'].min()
+            for atom in DEFINITION['key_atoms']:
+                expected = closest.get(atom, DEFINITION['missing_distance'])
+                self.assertAlmostEqual(row['d_' + atom], expected, places=5)
+            residues = own.groupby('target_atom_residue').size()
+            self.assertEqual(dict((r, row['r_' + r]) for r in residues.index),
+                             residues.to_dict())
+
+    def test_store_builds_once_per_definition_and_file(self):
+        store = FeatureStore(os.path.join(self.directory, 'store'))
+        first = store.load(self.path)
+        built = feature_store.build_features
+        feature_store.build_features = None
+        try:
+            # stored: loading again must not build
+            pd.testing.assert_frame_equal(store.load(self.path), first)
+        finally:
+            feature_store.build_features = built
+
+        definition = dict(DEFINITION, blocks=['min_distance'])
+        self.assertEqual(store.load(self.path, definition).shape[1], len(DEFINITION['key_atoms']))
+        labelled_contacts('T001').to_csv(self.path)
+        store.load(self.path)
+        versions = store.versions()
+        self.assertEqual(len(versions), 3)
+        self.assertEqual(len(versions['definition'].unique()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
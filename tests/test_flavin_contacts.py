@@ -0,0 +1,86 @@
+'''
+    find_contacts against the row by row distance comparator it replaced
+'''
+
+import contextlib
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+from fixtures import INSTANCES, contact_pairs, load_structure
+from physical_constants import get_vdW_radius, vdW_bounds
+from flavin_contacts import FLAVINS, KEY_ATOMS, find_contacts, label_contacts
+
+
+def comparator_contacts(structure, tolerance):
+    """ {(key atom number, target atom number): distance} of every contact
+        the original _make_distance_comparator of get_sample.py finds
+    """
+    xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    names = structure['atom_name'].values
+    residues = structure['residue_name'].values
+    numbers = structure['residue_number'].values
+    atom_numbers = structure['atom_number'].values
+    found = {}
+    for key in KEY_ATOMS:
+        for origin in np.nonzero((names == key) & structure['residue_name'].isin(FLAVINS).values)[0]:
+            vdW_keyatom = get_vdW_radius(names[origin], residues[origin])
+            # the comparator's per axis box test, for every atom at once
+            inside = (np.abs(xyz - xyz[origin]) < vdW_bounds['lower']).all(axis=1)
+            for i in np.nonzero(inside)[0]:
+                if numbers[i] == numbers[origin]:
+                    continue
+                distance = np.sqrt(((xyz[i] - xyz[origin]) ** 2).sum())
+                expected = get_vdW_radius(names[i], residues[i]) + vdW_keyatom
+                if expected - tolerance < distance < expected + tolerance:
+                    found[(atom_numbers[origin], atom_numbers[i])] = distance
+    return found
+
+
+class TestFindContacts(unittest.TestCase):
+
+    def setUp(self):
+        self.structure = load_structure()
+
+    def test_matches_distance_comparator(self):
+        for tolerance in [0.1, 0.2, 0.5]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = comparator_contacts(self.structure, tolerance)
+            found = contact_pairs(find_contacts(self.structure, tolerance=tolerance))
+            self.assertTrue(len(expected) > 0)
+            self.assertEqual(sorted(found), sorted(expected))
+            for pair, distance in expected.items():
+                self.assertAlmostEqual(found[pair], distance, places=9)
+
+    def test_grouped_by_key_atom_closest_first(self):
+        contacts = find_contacts(self.structure)
+        rank = dict((name, i) for i, name in enumerate(KEY_ATOMS))
+        order = [rank[name] for name in contacts['key_atom_name'].values]
+        self.assertEqual(order, sorted(order))
+        for _, group in contacts.groupby('key_atom_number'):
+            distances = group['distance'].values
+            self.assertTrue((np.diff(distances) >= 0).all())
+
+    def test_instance_restricts_the_key_atoms(self):
+        contacts = find_contacts(self.structure)
+        for chain_id, residue_number in INSTANCES:
+            own = contacts[(contacts['key_atom_chain_id'] == chain_id) &
+                           (contacts['key_atom_residue_number'] == residue_number)]
+            only = find_contacts(self.structure, instance=(chain_id, residue_number))
+            self.assertEqual(contact_pairs(only), contact_pairs(own))
+
+    def test_labels(self):
+        table = {'LYS': pd.DataFrame({'Residue Atom': ['NZ', 'O'], ' Code ': [2, 3]}),
+                 'HOH': pd.DataFrame({'Residue Atom': ['O'], 'Code': [5]})}
+        contacts = pd.DataFrame({'target_atom_residue': ['LYS', 'LYS', 'HOH', 'LYS', 'ORO'],
+                                 'target_atom_name': ['NZ', 'O', 'O', 'CE', 'N1']})
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            labelled = label_contacts(contacts, table)
+        self.assertEqual(labelled['interaction_label'].tolist(), [2, 3, 5, -1, -1])
+        # unknown atoms and residues are logged once each
+        self.assertEqual(len(log.getvalue().strip().split('\n')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+'''
+    Flavin frames and the contact descriptors computed in them
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from fixtures import load_structure, perturbed, write_models
+from flavin_contacts import find_contacts
+from isoalloxazine_frames import DESCRIPTOR_COLUMNS, contact_descriptors, fit_frames, \
+    ring_coordinates
+
+
+def rotated(structure, seed=0):
+    """ :structure: moved by a random rotation and translation """
+    rng = np.random.RandomState(seed)
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    rotation *= np.sign(np.linalg.det(rotation))
+    moved = structure.copy()
+    xyz = moved[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+    moved[['x_coord', 'y_coord', 'z_coord']] = xyz.dot(rotation.T) + rng.normal(0, 20, 3)
+    return moved
+
+
+class TestIsoalloxazineFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.structure = load_structure()
+        self.contacts = find_contacts(self.structure, tolerance=0.5)
+
+    def test_frames_are_orthonormal_and_in_the_ring_plane(self):
+        instances, coords = ring_coordinates(self.structure)
+        self.assertEqual(len(instances), 2)
+        origins, axes = fit_frames(coords)
+        for i in range(len(instances)):
+            np.testing.assert_allclose(axes[i].dot(axes[i].T), np.eye(3), atol=1e-10)
+            self.assertAlmostEqual(np.linalg.det(axes[i]), 1.0)
+            heights = (coords[i] - origins[i]).dot(axes[i][2])
+            self.assertLess(np.abs(heights).max(), 0.3)
+
+    def test_descriptors_match_distances(self):
+        described = contact_descriptors(self.contacts, self.structure)
+        self.assertFalse(described[DESCRIPTOR_COLUMNS].isnull().values.any())
+        instances, coords = ring_coordinates(self.structure)
+        origins, _ = fit_frames(coords)
+        xyz = self.structure.set_index('atom_number')[['x_coord', 'y_coord', 'z_coord']]
+        targets = xyz.loc[described['target_atom_number'].values].values
+        chains = instances['chain_id'].values.tolist()
+        centroid = origins[[chains.index(c) for c in described['key_atom_chain_id'].values]]
+        np.testing.assert_allclose(described['plane_offset'] ** 2 + described['height'] ** 2,
+                                   ((targets - centroid) ** 2).sum(axis=1), rtol=1e-9)
+
+    def test_descriptors_dont_depend_on_the_frame_of_the_entry(self):
+        moved = rotated(self.structure)
+        found = contact_descriptors(self.contacts, moved)
+        expected = contact_descriptors(self.contacts, self.structure)
+        np.testing.assert_allclose(found[DESCRIPTOR_COLUMNS].values,
+                                   expected[DESCRIPTOR_COLUMNS].values, atol=1e-8)
+
+    def test_flattened_models_get_a_frame_each(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'models.pdb')
+            write_models(path, [perturbed(self.structure, 0.3, seed)[
+                ['x_coord', 'y_coord', 'z_coord']].values for seed in range(2)])
+            # every model's atoms flattened into one frame, like fetch_structure
+            flat = load_structure(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(flat), 2 * len(self.structure))
+        instances, _ = ring_coordinates(flat)
+        self.assertEqual(instances['copy'].tolist(), [0, 0, 1, 1])
+
+        contacts = find_contacts(flat, tolerance=0.5, positions=True)
+        with self.assertRaises(ValueError):
+            contact_descriptors(contacts.drop(['key_atom_position', 'target_atom_position'],
+                                              axis=1), flat)
+        described = contact_descriptors(contacts, flat)
+        model = (flat['line_idx'].values > len(self.structure) + 1).astype(int)
+        key_model = model[described['key_atom_position'].values]
+        own = key_model == model[described['target_atom_position'].values]
+        for i in range(2):
+            single = flat[model == i].reset_index(drop=True)
+            expected = contact_descriptors(find_contacts(single, tolerance=0.5), single)
+            expected = expected.set_index(['key_atom_number', 'target_atom_number'])
+            found = described[own & (key_model == i)] \
+                .set_index(['key_atom_number', 'target_atom_number'])
+            self.assertEqual(sorted(found.index), sorted(expected.index))
+            np.testing.assert_allclose(found.loc[expected.index, DESCRIPTOR_COLUMNS].values,
+                                       expected[DESCRIPTOR_COLUMNS].values, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+    Pockets against the structures they are cut out of, and reopening a library
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fixtures import INSTANCES, contact_pairs, load_structure
+from flavin_contacts import find_contacts
+from pocket_library import PocketLibrary, PocketWriter, extract_pockets
+
+
+class TestPocketLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.structure = load_structure()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.pockets')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameContacts(self, provenance, pocket):
+        instance = (provenance['chain_id'], provenance['residue_number'])
+        for tolerance in [0.2, 0.5]:
+            expected = find_contacts(self.structure, tolerance=tolerance, instance=instance)
+            found = find_contacts(pocket, tolerance=tolerance, instance=instance)
+            self.assertTrue(len(expected) > 0)
+            self.assertEqual(contact_pairs(found), contact_pairs(expected))
+
+    def test_pockets_give_the_contacts_of_the_structure(self):
+        pockets = extract_pockets(self.structure, 'test')
+        self.assertEqual(sorted((p['chain_id'], p['residue_number']) for p, _ in pockets),
+                         INSTANCES)
+        for provenance, pocket in pockets:
+            self.assertTrue(len(pocket) < len(self.structure))
+            self.assertSameContacts(provenance, pocket)
+
+    def test_read_back_from_the_library(self):
+        with PocketWriter(self.path) as writer:
+            self.assertEqual(writer.write_structure('test', self.structure), 2)
+        library = PocketLibrary(self.path)
+        self.assertEqual(len(library), 2)
+        self.assertEqual(len(library.select(['TEST'])), 2)
+        self.assertEqual(len(library.select(['2dor'])), 0)
+        for provenance, pocket in library.pockets():
+            self.assertEqual(provenance['PDB_ID'], 'test')
+            self.assertSameContacts(provenance, pocket)
+
+    def test_reopening_skips_known_pockets(self):
+        for _ in range(2):
+            with PocketWriter(self.path) as writer:
+                writer.write_structure('test', self.structure)
+        with PocketWriter(self.path) as writer:
+            self.assertEqual(writer.write_structure('TEST', self.structure), 0)
+        library = PocketLibrary(self.path)
+        self.assertEqual(len(library), 2)
+        self.assertEqual(len(library.index.drop_duplicates(['chain_id', 'residue_number'])), 2)
+
+    def test_index_is_saved_without_close(self):
+        writer = PocketWriter(self.path, save_every=1)
+        writer.write_structure('test', self.structure)
+        # the run dies here, without closing the writer
+        library = PocketLibrary(self.path)
+        self.assertEqual(len(library), 2)
+        for i in range(len(library)):
+            _, pocket = library.read(i)
+            self.assertEqual(len(pocket), library.index['n_atoms'].values[i])
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
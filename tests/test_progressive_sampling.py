@@ -0,0 +1,72 @@
+'''
+    Stratified sampling order and the precision it stops on
+'''
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import fixtures  # noqa: F401, puts filter_scripts on the path
+from progressive_sampling import ContactFrequencies, rounds_of, stratified_order, \
+    wilson_interval
+
+
+class TestProgressiveSampling(unittest.TestCase):
+
+    def setUp(self):
+        self.pdb_ids = ['%04d' % i for i in range(40)]
+        self.strata = ['common'] * 30 + ['rare'] * 8 + [np.nan] * 2
+
+    def test_order_is_a_seeded_permutation(self):
+        for allocation in ['equal', 'proportional']:
+            order = stratified_order(self.pdb_ids, self.strata, 7, allocation)
+            self.assertEqual(sorted(order), self.pdb_ids)
+            self.assertEqual(order, stratified_order(self.pdb_ids, self.strata, 7, allocation))
+            self.assertNotEqual(order, stratified_order(self.pdb_ids, self.strata, 8, allocation))
+        self.assertEqual(sorted(stratified_order(self.pdb_ids, seed=1)), self.pdb_ids)
+        with self.assertRaises(ValueError):
+            stratified_order(self.pdb_ids, self.strata, 7, 'greedy')
+
+    def test_prefixes_are_stratified(self):
+        stratum = dict(zip(self.pdb_ids, [str(s) for s in self.strata]))
+        equal = [stratum[p] for p in stratified_order(self.pdb_ids, self.strata, 3, 'equal')]
+        self.assertEqual(sorted(equal[:3]), ['common', 'nan', 'rare'])
+        proportional = [stratum[p] for p in
+                        stratified_order(self.pdb_ids, self.strata, 3, 'proportional')]
+        self.assertEqual(proportional[:20].count('common'), 15)
+
+    def test_rounds(self):
+        self.assertEqual(rounds_of(self.pdb_ids, 16), [self.pdb_ids[:16], self.pdb_ids[16:32],
+                                                       self.pdb_ids[32:]])
+        self.assertEqual(rounds_of(self.pdb_ids, None), [self.pdb_ids])
+
+    def test_wilson_interval(self):
+        lower, upper = wilson_interval([0, 5, 20], [20, 20, 20])
+        self.assertAlmostEqual(lower[0], 0.0)
+        self.assertAlmostEqual(upper[2], 1.0)
+        # 5 out of 20, by hand
+        p, n, z = 0.25, 20.0, 1.96
+        center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+        half = z / (1 + z ** 2 / n) * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+        self.assertAlmostEqual(lower[1], center - half)
+        self.assertAlmostEqual(upper[1], center + half)
+        self.assertTrue(np.isnan(wilson_interval([0], [0])[0]).all())
+
+    def test_frequencies_count_structures(self):
+        frequencies = ContactFrequencies()
+        self.assertEqual(frequencies.max_width(), np.inf)
+        contacts = pd.DataFrame({'key_atom_name': ['N5', 'N5', 'O4'],
+                                 'interaction_label': [1, 1, 2]})
+        frequencies.update('1abc', contacts)
+        frequencies.update('1abc', contacts.iloc[2:])
+        frequencies.update('2xyz', contacts.iloc[:1])
+        frequencies.update('3def', contacts.iloc[:0])
+        table = frequencies.intervals().set_index(['key_atom_name', 'interaction_label'])
+        self.assertEqual(frequencies.structures, 3)
+        self.assertEqual(table['structures'].to_dict(), {('N5', 1): 2, ('O4', 2): 1})
+        self.assertAlmostEqual(table['frequency'][('N5', 1)], 2 / 3.0)
+        self.assertAlmostEqual(frequencies.max_width(), table['width'].max())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+'''
+    RadialHistogram binning, merging and shard files
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from fixtures import CHEMICAL_CODES, load_structure, perturbed
+from physical_constants import vdW_radii
+from radial_distribution import RING_ATOMS, RadialHistogram, chemical_code_array, \
+    load_chemical_codes
+
+
+class TestRadialHistogram(unittest.TestCase):
+
+    def setUp(self):
+        self.codes = load_chemical_codes(CHEMICAL_CODES)
+        self.structures = [perturbed(load_structure(), 0.2, seed) for seed in range(3)]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def histogram(self, structures):
+        hist = RadialHistogram(cutoff=8.0, bin_width=0.25, codes=self.codes)
+        for structure in structures:
+            hist.update(structure)
+        return hist
+
+    def test_ring_atoms(self):
+        self.assertEqual(sorted(RING_ATOMS), sorted(vdW_radii['Isoalloxazine']))
+        self.assertEqual(RING_ATOMS[:3], ['N1', 'C2', 'O2'])
+
+    def test_counts_match_brute_force(self):
+        structure = self.structures[0]
+        hist = self.histogram([structure])
+        xyz = structure[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+        residue = (structure['chain_id'] + ':' + structure['residue_number'].astype(str)).values
+        code = chemical_code_array(structure['atom_name'].values, structure['residue_name'].values,
+                                   self.codes)
+        expected = np.zeros_like(hist.counts)
+        rings = np.nonzero(structure['residue_name'].isin(['FMN', 'FAD']).values &
+                           structure['atom_name'].isin(RING_ATOMS).values)[0]
+        for i in rings:
+            dist = np.sqrt(((xyz - xyz[i]) ** 2).sum(axis=1))
+            near = np.nonzero((dist < hist.cutoff) & (residue != residue[i]))[0]
+            slot = RING_ATOMS.index(structure['atom_name'].values[i])
+            np.add.at(expected, (slot, code[near], (dist[near] / hist.bin_width).astype(int)), 1)
+        self.assertEqual(hist.counts.tolist(), expected.tolist())
+        self.assertEqual(hist.references.sum(), len(rings))
+
+    def test_merged_shards_match_one_run(self):
+        whole = self.histogram(self.structures)
+        paths = []
+        for i, structure in enumerate(self.structures):
+            paths.append(os.path.join(self.directory, '%d.rdf.npz' % i))
+            self.histogram([structure]).save(paths[-1])
+        merged = RadialHistogram.combine(paths)
+        self.assertEqual(merged.counts.tolist(), whole.counts.tolist())
+        self.assertEqual(merged.references.tolist(), whole.references.tolist())
+        np.testing.assert_array_equal(merged.edges, whole.edges)
+        self.assertEqual(merged.codes, whole.codes)
+        np.testing.assert_allclose(merged.g(), whole.g())
+
+    def test_refuses_different_bins(self):
+        hist = self.histogram([])
+        other = RadialHistogram(cutoff=8.0, bin_width=0.5, codes=self.codes)
+        with self.assertRaises(ValueError):
+            hist.merge(other)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+    ResultCache memoization, size tracking and eviction
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import fixtures
+from result_cache import LOW_WATER, ResultCache, combine_keys, settings_fingerprint, \
+    structure_fingerprint
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def disk_size(self, cache):
+        return sum(size for _, size, _ in cache.entries())
+
+    def test_memoize_computes_once(self):
+        cache = ResultCache(self.directory)
+        calls = []
+        for _ in range(3):
+            value = cache.memoize('geometry', 'key', lambda: calls.append(1) or [1, 2, 3])
+        self.assertEqual(value, [1, 2, 3])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_size_tracks_the_directory(self):
+        cache = ResultCache(self.directory)
+        for i in range(20):
+            cache.put('geometry', str(i), list(range(i)))
+        # overwriting an entry replaces its size
+        cache.put('geometry', '3', list(range(500)))
+        self.assertEqual(cache.size, self.disk_size(cache))
+        self.assertEqual(ResultCache(self.directory).size, cache.size)
+
+    def test_evicts_least_recently_used(self):
+        entry = ResultCache(self.directory)
+        entry.put('geometry', 'probe', list(range(100)))
+        size = entry.size
+        shutil.rmtree(self.directory)
+
+        cache = ResultCache(self.directory, max_bytes=10 * size)
+        for i in range(10):
+            cache.put('geometry', str(i), list(range(100)))
+            past = time.time() - 1000 + i
+            os.utime(cache._path('geometry', str(i)), (past, past))
+        # reading bumps an entry to most recently used
+        self.assertIsNotNone(cache.get('geometry', '0'))
+        cache.put('geometry', 'new', list(range(100)))
+
+        self.assertLessEqual(cache.size, cache.max_bytes * LOW_WATER)
+        self.assertEqual(cache.size, self.disk_size(cache))
+        self.assertIsNotNone(cache.get('geometry', '0'))
+        self.assertIsNotNone(cache.get('geometry', 'new'))
+        self.assertIsNone(cache.get('geometry', '1'))
+
+    def test_keys(self):
+        self.assertEqual(settings_fingerprint(a=1, b=[1.0, 'x']),
+                         settings_fingerprint(b=[1.0, 'x'], a=1))
+        self.assertNotEqual(settings_fingerprint(a=1), settings_fingerprint(a=2))
+        structure = fixtures.load_structure()
+        moved = fixtures.perturbed(structure, 0.001)
+        self.assertEqual(structure_fingerprint(structure), structure_fingerprint(structure.copy()))
+        self.assertNotEqual(structure_fingerprint(structure), structure_fingerprint(moved))
+        self.assertNotEqual(combine_keys('a', 'b'), combine_keys('b', 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+'''
+    Grouping of near-identical flavin sites and fanning results out to them
+'''
+
+import unittest
+
+import numpy as np
+import pandas as pd
+from fixtures import INSTANCES, load_structure, perturbed
+from flavin_contacts import find_contacts
+from pocket_library import extract_pockets
+from site_redundancy import fan_out, group_sites, site_profile
+
+
+def sites_of(structures):
+    """ the sites table, profiles and pockets of every flavin in
+        :structures: ({PDB ID: structure})
+    """
+    rows, profiles, pockets = [], [], []
+    for pdb_id, structure in sorted(structures.items()):
+        for provenance, pocket in extract_pockets(structure, pdb_id):
+            fingerprint, profile = site_profile(
+                pocket, (provenance['chain_id'], provenance['residue_number']))
+            row = dict(provenance)
+            row['fingerprint'] = fingerprint
+            rows.append(row)
+            profiles.append(profile)
+            pockets.append(pocket)
+    return pd.DataFrame(rows), profiles, pockets
+
+
+class TestSiteRedundancy(unittest.TestCase):
+
+    def setUp(self):
+        self.structure = load_structure()
+
+    def test_chains_of_a_homodimer_group(self):
+        sites, profiles, _ = sites_of({'test': self.structure})
+        membership = group_sites(sites, profiles)
+        self.assertEqual(membership['site_group'].tolist(), [0, 0])
+        self.assertEqual(membership['representative'].tolist(), [0, 0])
+        self.assertEqual(membership['site_weight'].tolist(), [0.5, 0.5])
+
+    def test_noisy_copies_group(self):
+        for seed in range(3):
+            sites, profiles, _ = sites_of({'a': self.structure,
+                                           'b': perturbed(self.structure, 0.2, seed)})
+            membership = group_sites(sites, profiles)
+            self.assertEqual(membership['group_size'].tolist(), [4] * 4)
+
+    def test_different_sites_dont_group(self):
+        sites, profiles, _ = sites_of({'a': self.structure,
+                                       'b': perturbed(self.structure, 1.5, 0)})
+        membership = group_sites(sites, profiles)
+        a = membership[membership['PDB_ID'] == 'a']
+        b = membership[membership['PDB_ID'] == 'b']
+        self.assertFalse(set(a['site_group']) & set(b['site_group']))
+
+        # same residues lining the ring, but further away
+        sites, profiles, _ = sites_of({'a': self.structure})
+        sites = pd.concat([sites.iloc[:1], sites.iloc[:1]], ignore_index=True)
+        sites.loc[1, 'PDB_ID'] = 'b'
+        further = profiles[0].copy()
+        further['distance'] += 2.0
+        membership = group_sites(sites, [profiles[0], further])
+        self.assertEqual(membership['site_group'].tolist(), [0, 1])
+        further['distance'] -= 1.5
+        membership = group_sites(sites, [profiles[0], further])
+        self.assertEqual(membership['site_group'].tolist(), [0, 0])
+
+        # sites without a profile are on their own
+        sites['fingerprint'] = None
+        membership = group_sites(sites, profiles)
+        self.assertEqual(membership['group_size'].tolist(), [1] * len(sites))
+
+    def test_fan_out_refers_to_member_atoms(self):
+        sites, profiles, pockets = sites_of({'test': self.structure})
+        membership = group_sites(sites, profiles)
+        contacts = find_contacts(pockets[0], tolerance=0.5, instance=INSTANCES[0])
+        fanned = fan_out(contacts, membership, 0, {1: pockets[1]}, profiles)
+        self.assertEqual(len(fanned), 2 * len(contacts))
+        self.assertEqual(fanned['site_weight'].tolist(), [0.5] * len(fanned))
+        own, copy = fanned.iloc[:len(contacts)], fanned.iloc[len(contacts):]
+        self.assertEqual(own['key_atom_number'].tolist(), contacts['key_atom_number'].tolist())
+
+        atoms = self.structure.set_index('atom_number')
+        xyz = atoms[['x_coord', 'y_coord', 'z_coord']].astype(np.float64)
+        self.assertEqual(set(copy['key_atom_chain_id']), set([INSTANCES[1][0]]))
+        self.assertEqual(atoms.loc[copy['key_atom_number'].values, 'atom_name'].tolist(),
+                         copy['key_atom_name'].tolist())
+        self.assertEqual(set(atoms.loc[copy['key_atom_number'].values, 'chain_id']),
+                         set([INSTANCES[1][0]]))
+
+        mapped = copy[copy['target_atom_number'] != -1]
+        self.assertTrue(len(mapped) > 0.8 * len(copy))
+        self.assertFalse(set(mapped['target_atom_number']) & set(contacts['target_atom_number']))
+        targets = atoms.loc[mapped['target_atom_number'].values]
+        self.assertEqual(targets['atom_name'].tolist(), mapped['target_atom_name'].tolist())
+        self.assertEqual(targets['residue_name'].tolist(), mapped['target_atom_residue'].tolist())
+        self.assertEqual(targets['residue_number'].tolist(),
+                         mapped['target_atom_residue_number'].tolist())
+        distance = np.linalg.norm(xyz.loc[mapped['key_atom_number'].values].values -
+                                  xyz.loc[mapped['target_atom_number'].values].values, axis=1)
+        self.assertLess(np.abs(distance - mapped['distance'].values).max(), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
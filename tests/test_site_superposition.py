@@ -0,0 +1,141 @@
+'''
+    Batched Kabsch fits and tiled RMSD matrices against brute force
+'''
+
+import unittest
+
+import numpy as np
+from fixtures import INSTANCES, load_structure
+from radial_distribution import RING_ATOMS
+from site_superposition import apply_fit, condensed_rmsd, kabsch, site_arrays, superpose, \
+    top_k_rmsd
+
+
+def random_rotation(rng):
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    return rotation * np.sign(np.linalg.det(rotation))
+
+
+def single_fit(mobile, reference, weights):
+    """ (rotation, translation, rmsd) of one weighted Kabsch fit, np.nan rows
+        left out
+    """
+    present = ~np.isnan(mobile).any(axis=1) & ~np.isnan(reference).any(axis=1)
+    x, y, w = mobile[present], reference[present], weights[present]
+    x_center = (w[:, None] * x).sum(axis=0) / w.sum()
+    y_center = (w[:, None] * y).sum(axis=0) / w.sum()
+    u, _, vt = np.linalg.svd((w[:, None] * (x - x_center)).T.dot(y - y_center))
+    d = np.sign(np.linalg.det(vt.T.dot(u.T)))
+    rotation = vt.T.dot(np.diag([1.0, 1.0, d])).dot(u.T)
+    fitted = (x - x_center).dot(rotation.T) + y_center
+    rmsd = np.sqrt((w * ((fitted - y) ** 2).sum(axis=1)).sum() / w.sum())
+    return rotation, y_center - rotation.dot(x_center), rmsd
+
+
+def brute_force_rmsd(points):
+    """ the full RMSD matrix of :points:, pair by pair over shared slots """
+    n = len(points)
+    matrix = np.full((n, n), np.nan)
+    for i in range(n):
+        for j in range(n):
+            shared = ~np.isnan(points[i]).any(axis=1) & ~np.isnan(points[j]).any(axis=1)
+            if i != j and shared.any():
+                delta = points[i][shared] - points[j][shared]
+                matrix[i, j] = np.sqrt((delta ** 2).sum(axis=1).mean())
+    return matrix
+
+
+class TestKabsch(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.reference = self.rng.normal(0, 3, (18, 3))
+
+    def test_recovers_a_known_motion(self):
+        rotations = np.stack([random_rotation(self.rng) for _ in range(5)])
+        shifts = self.rng.normal(0, 10, (5, 3))
+        mobile = np.einsum('nij,mj->nmi', rotations, self.reference) + shifts[:, None, :]
+        found, translations, rmsd = kabsch(mobile, self.reference)
+        np.testing.assert_allclose(rmsd, 0.0, atol=1e-9)
+        np.testing.assert_allclose(apply_fit(mobile, found, translations),
+                                   np.broadcast_to(self.reference, mobile.shape), atol=1e-9)
+        np.testing.assert_allclose(np.einsum('nij,njk->nik', found, rotations),
+                                   np.broadcast_to(np.eye(3), (5, 3, 3)), atol=1e-9)
+
+    def test_matches_single_fits(self):
+        mobile = np.stack([self.reference.dot(random_rotation(self.rng).T) +
+                           self.rng.normal(0, 0.5, (18, 3)) for _ in range(8)])
+        mobile[1, 3] = np.nan
+        mobile[2, [0, 5, 17]] = np.nan
+        weights = self.rng.uniform(0.5, 2.0, (8, 18))
+        for w in [None, weights]:
+            rotations, translations, rmsd = kabsch(mobile, self.reference, w)
+            for i in range(len(mobile)):
+                expected = single_fit(mobile[i], self.reference,
+                                      np.ones(18) if w is None else w[i])
+                np.testing.assert_allclose(rotations[i], expected[0], atol=1e-9)
+                np.testing.assert_allclose(translations[i], expected[1], atol=1e-9)
+                self.assertAlmostEqual(rmsd[i], expected[2], places=9)
+
+    def test_too_few_points(self):
+        mobile = np.stack([self.reference, self.reference])
+        mobile[1, 2:] = np.nan
+        rotations, translations, rmsd = kabsch(mobile, self.reference)
+        self.assertAlmostEqual(rmsd[0], 0.0)
+        self.assertTrue(np.isnan(rmsd[1]) and np.isnan(rotations[1]).all())
+
+    def test_chains_of_test_pdb_superpose(self):
+        structure = load_structure()
+        arrays = [site_arrays(structure, instance) for instance in INSTANCES]
+        rings = np.stack([ring for ring, _ in arrays])
+        pockets = np.stack([pocket for _, pocket in arrays])
+        self.assertEqual(rings.shape, (2, len(RING_ATOMS), 3))
+        self.assertFalse(np.isnan(rings).any())
+        _, moved, rmsd = superpose(rings, pockets)
+        self.assertLess(np.nanmax(rmsd), 0.2)
+        self.assertAlmostEqual(condensed_rmsd(moved)[0], brute_force_rmsd(moved)[0, 1], places=4)
+
+
+class TestRMSDMatrix(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.points = rng.normal(0, 1, (11, 18, 3)) + rng.normal(0, 3, (11, 1, 3))
+        # missing slots, and a site sharing no slot with one other site
+        self.points[rng.uniform(size=(11, 18)) < 0.2] = np.nan
+        self.points[9, :9] = np.nan
+        self.points[10, 9:] = np.nan
+        self.expected = brute_force_rmsd(self.points)
+
+    def test_condensed_matches_brute_force(self):
+        n = len(self.points)
+        upper = np.triu_indices(n, 1)
+        for block in [3, 4, 64]:
+            found = condensed_rmsd(self.points, block=block)
+            self.assertEqual(found.dtype, np.float32)
+            np.testing.assert_allclose(found, self.expected[upper], rtol=1e-5, atol=1e-5)
+        self.assertTrue(np.isnan(self.expected[9, 10]))
+
+        out = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+        self.assertIs(condensed_rmsd(self.points, block=3, out=out), out)
+        np.testing.assert_allclose(out, self.expected[upper], rtol=1e-5, atol=1e-5)
+
+    def test_top_k_matches_brute_force(self):
+        matrix = np.where(np.isnan(self.expected), np.inf, self.expected)
+        for block in [3, 64]:
+            neighbours, rmsd = top_k_rmsd(self.points, 4, block=block)
+            self.assertEqual(neighbours.shape, (len(self.points), 4))
+            for i in range(len(self.points)):
+                expected = np.sort(matrix[i])[:4]
+                np.testing.assert_allclose(rmsd[i], expected, rtol=1e-5)
+                np.testing.assert_allclose(matrix[i][neighbours[i]], expected, rtol=1e-5)
+
+    def test_top_k_pads_small_sets(self):
+        neighbours, rmsd = top_k_rmsd(self.points[:3], 4, block=2)
+        self.assertEqual(neighbours[:, 2:].tolist(), [[-1, -1]] * 3)
+        self.assertTrue(np.isnan(rmsd[:, 2:]).all())
+        self.assertEqual(set(neighbours[0, :2]), set([1, 2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+'''
+    Ensembles of models against the contacts of every model on its own
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from biopandas.pdb import PandasPDB
+from fixtures import load_structure, perturbed, write_models
+import flavin_contacts
+from flavin_contacts import fetch_structure, find_contacts
+from structure_ensemble import StructureEnsemble, contact_occupancy, fetch_ensemble, \
+    find_ensemble_contacts
+
+COLUMNS = ['key_atom_number', 'target_atom_number', 'key_atom_name', 'target_atom_name']
+
+
+class TestStructureEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'models.pdb')
+        structure = load_structure()
+        self.models = [perturbed(structure, 0.15, seed)[['x_coord', 'y_coord', 'z_coord']].values
+                       for seed in range(3)]
+        write_models(self.path, self.models)
+        self.ensemble = StructureEnsemble.from_frames(PandasPDB().read_pdb(self.path).df)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_models_are_stacked(self):
+        self.assertEqual(self.ensemble.n_models, 3)
+        self.assertEqual(self.ensemble.model_ids.tolist(), [1, 2, 3])
+        self.assertEqual(self.ensemble.coordinates.shape, (3, len(self.models[0]), 3))
+        for i, xyz in enumerate(self.models):
+            np.testing.assert_allclose(self.ensemble.coordinates[i], xyz, atol=5e-4)
+
+    def test_contacts_of_every_model(self):
+        for tolerance in [0.2, 0.5]:
+            contacts = find_ensemble_contacts(self.ensemble, tolerance=tolerance)
+            for i, model_id in enumerate(self.ensemble.model_ids):
+                expected = find_contacts(self.ensemble.model(i), tolerance=tolerance)
+                found = contacts[contacts['model'] == model_id]
+                self.assertTrue(len(expected) > 0)
+                self.assertEqual(found[COLUMNS].values.tolist(), expected[COLUMNS].values.tolist())
+                np.testing.assert_allclose(found['distance'].values, expected['distance'].values,
+                                           rtol=1e-12)
+
+    def test_occupancy(self):
+        contacts = find_ensemble_contacts(self.ensemble, tolerance=0.3)
+        pairs = contacts.groupby(['key_atom_number', 'target_atom_number'])['model']
+        models = pairs.transform('size').values
+        np.testing.assert_allclose(contacts['contact_occupancy'].values, models / 3.0)
+
+        table = contact_occupancy(contacts)
+        self.assertEqual(len(table), pairs.ngroups)
+        self.assertEqual(sorted(table['models'].tolist()), sorted(pairs.size().tolist()))
+        np.testing.assert_allclose(table['contact_occupancy'], table['models'] / 3.0)
+        self.assertTrue((table['min_distance'] <= table['mean_distance'] + 1e-12).all())
+        self.assertTrue((np.diff(table['contact_occupancy'].values) <= 0).all())
+
+    def test_best_altloc_is_kept(self):
+        frames = PandasPDB().read_pdb(self.path).df
+        atoms = frames['ATOM']
+        atoms = atoms[atoms['line_idx'] < atoms['line_idx'].min() + len(self.models[0])]
+        residue = atoms[(atoms['chain_id'] == 'A') & (atoms['residue_number'] == 10)]
+        second = residue.copy()
+        residue = residue.assign(alt_loc='A', occupancy=0.4)
+        second = second.assign(alt_loc='B', occupancy=0.6, x_coord=second['x_coord'] + 1.0)
+        second['line_idx'] = second['line_idx'] + 0.5
+        rest = atoms.drop(residue.index)
+        frames['ATOM'] = pd.concat([rest, residue, second])
+        frames['OTHERS'] = frames['OTHERS'].iloc[:0]
+        ensemble = StructureEnsemble.from_frames(frames)
+        self.assertEqual(ensemble.n_models, 1)
+        model = ensemble.model(0)
+        kept = model[(model['chain_id'] == 'A') & (model['residue_number'] == 10)]
+        self.assertEqual(len(kept), len(residue))
+        self.assertEqual(set(kept['alt_loc']), set(['B']))
+        np.testing.assert_allclose(kept['x_coord'].values, second['x_coord'].values)
+
+    def test_fetching_retries(self):
+        calls = []
+
+        def flaky(failures):
+            """ a PandasPDB whose first :failures: downloads fail """
+            class FlakyPDB(PandasPDB):
+                def fetch_pdb(pdb, pdb_id):
+                    calls.append(pdb_id)
+                    if len(calls) <= failures:
+                        raise IOError("connection reset")
+                    return pdb.read_pdb(self.path)
+            return FlakyPDB
+
+        with mock.patch.object(flavin_contacts.pdb, 'PandasPDB', flaky(2)):
+            ensemble = fetch_ensemble('nmr1')
+        self.assertEqual(calls, ['nmr1'] * 3)
+        self.assertEqual(ensemble.n_models, 3)
+
+        del calls[:]
+        with mock.patch.object(flavin_contacts.pdb, 'PandasPDB', flaky(1)):
+            structure = fetch_structure('nmr1')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(structure), 3 * len(self.models[0]))
+
+        del calls[:]
+        with mock.patch.object(flavin_contacts.pdb, 'PandasPDB', flaky(10)):
+            self.assertIsNone(fetch_ensemble('nmr1'))
+            self.assertIsNone(fetch_structure('nmr1', attempts=2))
+        self.assertEqual(len(calls), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
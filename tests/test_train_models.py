@@ -0,0 +1,82 @@
+'''
+    Joining features to redox potentials, grouped folds and the model grid
+'''
+
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+from fixtures import TESTS
+
+sys.path.insert(0, os.path.join(TESTS, '..', 'learning'))
+from feature_store import INSTANCE_COLUMNS  # noqa: E402
+from train_models import MODELS, RESULT_COLUMNS, group_splits, parameter_grid, \
+    run_experiments, training_table  # noqa: E402
+
+
+def synthetic(n_enzymes=4, per_enzyme=3, seed=0):
+    """ (features, redox) of a made up corpus: a flavin per PDB ID, a few
+        PDB IDs per enzyme, the potential linear in the first feature
+    """
+    rng = np.random.RandomState(seed)
+    pdb_ids = ['%d%s%02d' % (e + 1, 'ABCD'[e], i) for e in range(n_enzymes)
+               for i in range(per_enzyme)]
+    values = rng.normal(0, 1, (len(pdb_ids), 3))
+    index = pd.MultiIndex.from_tuples([(p, 'A', 500, 'FAD') for p in pdb_ids],
+                                      names=INSTANCE_COLUMNS)
+    features = pd.DataFrame(values, index=index, columns=['f0', 'f1', 'f2'])
+    redox = pd.DataFrame({'PDB ID': [p.lower() for p in pdb_ids],
+                          'Enzyme': ['enzyme %d' % (i // per_enzyme) for i in range(len(pdb_ids))],
+                          'EM(mV)': (-200 + 50 * values[:, 0]).astype(object)})
+    return features, redox
+
+
+class TestTrainModels(unittest.TestCase):
+
+    def setUp(self):
+        self.features, self.redox = synthetic()
+
+    def test_training_table(self):
+        redox = self.redox.copy()
+        # a second measurement of the first entry, in another case
+        redox.loc[len(redox)] = [redox['PDB ID'][0].upper(), redox['Enzyme'][0], -100.0]
+        redox.loc[1, 'EM(mV)'] = 'n/a'
+        X, y, groups, rows = training_table(self.features, redox)
+
+        self.assertEqual(len(X), len(self.features) - 1)
+        self.assertNotIn(self.features.index[1][0], rows['PDB_ID'].tolist())
+        self.assertEqual(rows['PDB_ID'].tolist(),
+                         [p for i, p in enumerate(self.features.index.get_level_values(0))
+                          if i != 1])
+        self.assertAlmostEqual(y[0], (-200 + 50 * self.features['f0'].values[0] - 100.0) / 2)
+        np.testing.assert_allclose(y[1:], -200 + 50 * self.features['f0'].values[2:])
+        np.testing.assert_array_equal(X, self.features.values[[0] + list(range(2, 12))])
+        self.assertEqual(list(groups[:3]), ['enzyme 0'] * 2 + ['enzyme 1'])
+
+    def test_folds_never_share_an_enzyme(self):
+        X, y, groups, _ = training_table(self.features, self.redox)
+        for folds in [2, 3, 10]:
+            splits = group_splits(X, y, groups, folds)
+            self.assertEqual(len(splits), min(folds, 4))
+            for train, test in splits:
+                self.assertFalse(set(groups[train]) & set(groups[test]))
+            self.assertEqual(sorted(np.concatenate([test for _, test in splits])),
+                             list(range(len(X))))
+
+    def test_a_result_per_combination(self):
+        grid = list(parameter_grid(['ridge', 'lasso']))
+        self.assertEqual(len(grid), len(MODELS['ridge'][1]['alpha']) +
+                         len(MODELS['lasso'][1]['alpha']))
+        X, y, groups, _ = training_table(self.features, self.redox)
+        results = run_experiments(X, y, groups, ['ridge', 'lasso'], folds=3, jobs=1)
+        self.assertEqual(list(results.columns), RESULT_COLUMNS)
+        self.assertEqual(sorted(zip(results['model'], results['params'])),
+                         sorted((name, repr(params)) for name, params in grid))
+        self.assertEqual(results['folds'].tolist(), [3] * len(grid))
+        self.assertTrue((np.diff(results['rmse'].values) >= 0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+'''
+    Verlet list contacts of a trajectory against find_contacts of every frame
+'''
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from fixtures import TEST_PDB, write_models
+from columnar_output import ContactWriter
+from flavin_contacts import find_contacts
+from trajectory_contacts import BinaryTrajectoryWriter, VerletContacts, analyze_trajectory, \
+    binary_frames, pdb_frames, read_topology, trajectory_frames
+
+# a few residues' worth of interaction labels, instead of the full table
+LABELS = {'LYS': pd.DataFrame({'Residue Atom': ['NZ', 'O', 'N'], 'Code': [2, 3, 1]}),
+          'HOH': pd.DataFrame({'Residue Atom': ['O'], 'Code': [5]}),
+          'SER': pd.DataFrame({'Residue Atom': ['OG', 'O', 'N'], 'Code': [4, 3, 1]})}
+
+
+def random_walk(xyz, frames, step, seed=0):
+    """ :frames: frames of every atom of :xyz: taking gaussian steps of
+        :step: angstroms per coordinate
+    """
+    rng = np.random.RandomState(seed)
+    walk = [xyz]
+    for _ in range(frames - 1):
+        walk.append(walk[-1] + rng.normal(0, step, xyz.shape))
+    return walk
+
+
+def at(topology, xyz):
+    """ :topology: with coordinates :xyz: """
+    structure = topology.copy()
+    structure[['x_coord', 'y_coord', 'z_coord']] = xyz
+    return structure
+
+
+class TestTrajectoryContacts(unittest.TestCase):
+
+    def setUp(self):
+        self.topology = read_topology(TEST_PDB)
+        xyz = self.topology[['x_coord', 'y_coord', 'z_coord']].values.astype(np.float64)
+        self.frames = random_walk(xyz, 60, 0.05)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_topology(self):
+        self.assertEqual(len(self.topology), 5248)
+        self.assertEqual(sorted(set(self.topology['record_name'])), ['ATOM', 'HETATM'])
+
+    def test_verlet_contacts_match_find_contacts(self):
+        numbers = self.topology['atom_number'].values
+        for tolerance in [0.2, 0.5]:
+            verlet = VerletContacts(self.topology, tolerance=tolerance, skin=1.0)
+            for xyz in self.frames:
+                k, a, dist = verlet.update(xyz)
+                expected = find_contacts(at(self.topology, xyz), tolerance=tolerance)
+                self.assertTrue(len(expected) > 0)
+                self.assertEqual(list(zip(numbers[k].tolist(), numbers[a].tolist())),
+                                 list(zip(expected['key_atom_number'].tolist(),
+                                          expected['target_atom_number'].tolist())))
+                np.testing.assert_allclose(dist, expected['distance'].values, rtol=1e-12)
+            self.assertTrue(1 < verlet.rebuilds < len(self.frames))
+
+    def test_binary_trajectory_round_trip(self):
+        path = os.path.join(self.directory, 'walk.trj')
+        with BinaryTrajectoryWriter(path, len(self.topology)) as writer:
+            for xyz in self.frames:
+                writer.write(xyz)
+            with self.assertRaises(ValueError):
+                writer.write(self.frames[0][:10])
+        read = list(trajectory_frames(path))
+        self.assertEqual(len(read), len(self.frames))
+        for found, expected in zip(read, self.frames):
+            np.testing.assert_array_equal(found, expected.astype(np.float32))
+        with self.assertRaises(ValueError):
+            next(binary_frames(TEST_PDB))
+
+    def test_pdb_frames(self):
+        path = os.path.join(self.directory, 'walk.pdb')
+        write_models(path, self.frames[:4])
+        self.assertEqual(len(read_topology(path)), len(self.topology))
+        read = list(trajectory_frames(path))
+        self.assertEqual(len(read), 4)
+        for found, expected in zip(read, self.frames):
+            np.testing.assert_allclose(found, expected, atol=5e-4)
+        # no MODEL records: one frame
+        self.assertEqual(len(list(pdb_frames(TEST_PDB))), 1)
+
+    def test_frames_stay_in_order_in_parquet(self):
+        path = os.path.join(self.directory, 'walk.parquet')
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ContactWriter(path, row_group_size=100) as writer:
+                verlet, lifetimes = analyze_trajectory(self.frames, self.topology, writer,
+                                                       LABELS, name='walk', tolerance=0.3)
+        self.assertEqual(lifetimes.frames, len(self.frames))
+        table = pq.ParquetFile(path)
+        self.assertTrue(table.num_row_groups > 1)
+        frames = table.read(columns=['frame'])['frame'].to_pylist()
+        self.assertEqual(frames, sorted(frames))
+        self.assertEqual(sorted(set(frames)), list(range(len(self.frames))))
+
+        contacts = table.read().to_pandas()
+        counts = contacts.groupby('frame').size()
+        for frame in [0, 30, 59]:
+            expected = find_contacts(at(self.topology, self.frames[frame]), tolerance=0.3)
+            self.assertEqual(counts[frame], len(expected))
+        water = (contacts['target_atom_residue'] == 'HOH').values
+        self.assertTrue((contacts['interaction_label'].values[water] == 5).all())
+        self.assertTrue(contacts['interaction_label'][~water].isin([-1, 1, 2, 3, 4]).all())
+
+        # every contact ends once, at the latest at the end of the trajectory
+        pairs = set(zip(contacts['key_atom_number'], contacts['target_atom_number']))
+        self.assertTrue(lifetimes.lifetimes.count >= len(pairs))
+        self.assertTrue(0 < lifetimes.censored <= len(pairs))
+        self.assertEqual(lifetimes.lifetimes.max, len(self.frames))
+
+
+if __name__ == '__main__':
+    unittest.main()